@@ -1,33 +1,221 @@
-from flask import Flask, request, jsonify, session, send_from_directory
-from flask_socketio import SocketIO, emit, disconnect
 from config import Config
-from models import db, User, Conversation, Message, Friendship, bcrypt
-from utils.redis_helpers import set_user_socket, get_user_socket, remove_user_socket
+
+# 多进程部署时 Socket.IO 消息队列和进程间广播的订阅循环需要协作式 I/O，须在其他模块导入前打补丁
+if Config.SOCKETIO_MESSAGE_QUEUE:
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import Flask, Response, request, jsonify, session, abort
+from flask_socketio import SocketIO, emit, disconnect, join_room
+from models import db, User, Conversation, Message, MessageArchive, RetentionPolicy, Friendship, Job, bcrypt
+from utils.redis_helpers import redis_store, is_redis_available
+from utils.presence import Presence, user_room
+from utils.groups import (GroupMembers, group_room, user_group_ids, add_members, create_group,
+                          remove_member, group_to_dict)
+from utils.inbox import build_inbox, conversation_delta
+from utils.summary import ensure_members, reset_conversation
+from utils.history import fetch_page, encode_cursor, message_to_dict, InvalidCursor, DEFAULT_PAGE_SIZE
+from utils import database
+from utils.migrations import upgrade
+from utils.persistence import MessageWriter
+from utils.delivery import fetch_pending
+from utils.receipts import ReceiptAggregator
+from utils.auth import AuthService, Principal
+from utils.search import search_messages, DEFAULT_PAGE_SIZE as SEARCH_PAGE_SIZE
+from utils.jobs import JobRunner, job_to_dict
+from utils.archive import retention_enabled, policy_to_dict, get_stats as get_archive_stats
+from utils.conversation_cache import ConversationCache
+from utils.friends import FriendGraph
+from utils.directory import (list_users, get_counts, adjust_counts, parse_flag,
+                             DEFAULT_PAGE_SIZE as DIRECTORY_PAGE_SIZE)
+from utils.cluster import ClusterBus
+from utils.media import MediaStore
+from utils.ratelimit import RateLimiter
+from utils.outbound import OutboundGuard
+from utils.codec import SocketCodec, negotiate, compact_message, encode as encode_payload
+from utils.metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import HTTPException
+from werkzeug.security import safe_join
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime
 import os
-import uuid
+import logging
+
+logger = logging.getLogger(__name__)
 
 # --- 初始化 ---
 app = Flask(__name__)
 app.config.from_object(Config)
-db.init_app(app)
+# 经反向代理部署时从 X-Forwarded-For 取客户端 IP（登录 / 注册按 IP 限流）
+if app.config['PROXY_FIX_X_FOR']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+# SQLite 打开 WAL 并设置 PRAGMA；其他数据库使用连接池（见 utils/database.py）
+database.init_app(app, db)
 bcrypt.init_app(app)
-socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins="*")
+# 配置消息队列后，emit 到其他进程上的连接会经队列转发
+socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins="*",
+                    message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'])
+# 运行指标：路由 / 事件耗时、每个请求的 SQL 条数和耗时、Redis 命令耗时（/metrics）
+metrics = Metrics(app, socketio, db)
+if metrics.enabled:
+    redis_store.on_record = metrics.record_redis
+message_writer = MessageWriter(app, socketio)
+conversation_cache = ConversationCache(app.config['CONVERSATION_CACHE_SIZE'], app.config['CONVERSATION_CACHE_REDIS'])
+group_members = GroupMembers(app.config['GROUP_MEMBER_CACHE_SIZE'])
+friend_graph = FriendGraph(app.config['FRIEND_GRAPH_CACHE_SIZE'])
+cluster_bus = ClusterBus(app, socketio)
+presence = Presence(app.config['PRESENCE_TTL'])
+media_store = MediaStore(app, socketio)
+receipts = ReceiptAggregator(app, socketio)
+auth = AuthService(app, socketio)
+# 后台任务删除会话 / 用户后经集群广播让各进程的缓存失效
+job_runner = JobRunner(app, socketio, publish=cluster_bus.publish)
+# 令牌桶限流（socket 事件、登录 / 注册 / 上传）和出站背压（慢连接的发送队列上限）
+limiter = RateLimiter(app, socketio)
+outbound = OutboundGuard(app, socketio)
+# 按连接协商的紧凑消息编码（连接时 auth={encoding: 'compact' | 'msgpack'}）
+codec = SocketCodec(app, socketio)
+# 定期归档冷消息、删除过期归档（未配置任何保留期限时不创建任务）
+job_runner.schedule('retention', app.config['RETENTION_INTERVAL'], when=lambda: retention_enabled(app.config))
+
+if app.config['SOCKETIO_MESSAGE_QUEUE'] and not is_redis_available():
+    logger.warning("已启用多进程消息队列但 Redis 不可用：在线状态只保存在本进程内，跨进程消息将无法送达")
+
+# --- 运行指标：抓取时读取的连接数、队列长度和各组件计数（均为本进程） ---
+def online_user_count():
+    # 每个有连接的用户在本进程上有一个 user:{id} 房间
+    rooms = socketio.server.manager.rooms.get('/', {})
+    return sum(1 for room, sids in rooms.items() if isinstance(room, str) and room.startswith('user:') and sids)
+
+metrics.gauge('lightchat_connected_sockets', 'Socket.IO 连接数', lambda: len(socketio.server.eio.sockets))
+metrics.gauge('lightchat_online_users', '有连接的用户数', online_user_count)
+metrics.gauge('lightchat_message_write_queue', '写入管道中等待提交的消息数', message_writer.queue_size)
+metrics.gauge('lightchat_db_pool_checked_out', '已取出的数据库连接数', lambda: db.engine.pool.checkedout())
+metrics.counter('lightchat_messages_persisted_total', '已提交的消息数', lambda: message_writer.stats['messages'])
+metrics.counter('lightchat_message_write_failures_total', '提交失败的消息数', lambda: message_writer.stats['failed'])
+metrics.counter('lightchat_receipts_total', '推送的回执数', lambda: {
+    'delivered': receipts.stats['delivered_receipts'], 'read': receipts.stats['read_receipts']}, labels=('status',))
+metrics.counter('lightchat_rate_limited_total', '被限流丢弃 / 拒绝的请求和事件数',
+                lambda: {rule: limiter.stats[f'{rule}_throttled'] for rule in limiter.rules}, labels=('rule',))
+metrics.counter('lightchat_outbound_dropped_total', '因发送队列积压丢弃的包 / 可丢弃事件数', lambda: {
+    'packet': outbound.stats['dropped'], 'typing': outbound.stats['typing_dropped']}, labels=('kind',))
+metrics.counter('lightchat_slow_disconnects_total', '因发送队列达到上限断开的连接数',
+                lambda: outbound.stats['slow_disconnects'])
+
+# --- 进程间缓存失效 ---
+@cluster_bus.on('conversation_pair')
+def drop_conversation_pair(user_one_id, user_two_id):
+    conversation_cache.invalidate(user_one_id, user_two_id)
+
+@cluster_bus.on('conversation_user')
+def drop_conversation_user(user_id, partner_ids):
+    conversation_cache.invalidate_user(user_id, partner_ids)
+
+@cluster_bus.on('friend_graph')
+def drop_friend_graph(*user_ids):
+    friend_graph.invalidate(*user_ids)
+
+@cluster_bus.on('user_principal')
+def drop_user_principal(user_id):
+    auth.invalidate(user_id)
+
+# 用户被标记删除：各进程丢弃其 Principal 缓存，并断开该用户在本进程上的所有连接
+@cluster_bus.on('user_deleted')
+def disconnect_deleted_user(user_id):
+    auth.invalidate(user_id)
+    server = socketio.server
+    for sid, _ in list(server.manager.get_participants('/', user_room(user_id))):
+        server.disconnect(sid, namespace='/')
+
+# 群成员变化：各进程让成员缓存失效，并把这些用户在本进程上的连接加入 / 移出群房间
+@cluster_bus.on('group_membership')
+def sync_group_membership(conversation_id, user_ids, joined):
+    group_members.invalidate(conversation_id)
+    server = socketio.server
+    room = group_room(conversation_id)
+    for user_id in user_ids:
+        for sid, _ in list(server.manager.get_participants('/', user_room(user_id))):
+            if joined:
+                server.enter_room(sid, room, namespace='/')
+            else:
+                server.leave_room(sid, room, namespace='/')
+
+# 输入状态经集群广播到各进程，由持有接收方连接的进程发送（发送队列积压的连接直接跳过）
+@cluster_bus.on('typing')
+def forward_typing(receiver_id, payload):
+    outbound.emit_droppable('typing', payload, user_room(receiver_id))
+
+# --- 实时投递 ---
+def deliver_committed(batch):
+    # 消息所在批次提交后推送给接收方，带上该接收方的投递序号；离线的接收方重连时由 sync 补发
+    # 群聊消息一次发到群房间（全体在线成员，含发送方的其他设备），不带序号；离线成员重连后从会话列表和历史记录查看
+    # 同一批次中发往同一房间的多条消息合并为一个 receive_msg_batch（MESSAGE_BATCH_FRAMES）
+    last_by_conversation = {}
+    group_senders = {}
+    frames = {}
+    for pending in batch:
+        message_dto = message_to_dict(pending.message)
+        conv_id = pending.message.conversation_id
+        if pending.group:
+            frames.setdefault(group_room(conv_id), []).append(message_dto)
+            group_senders.setdefault(conv_id, []).append(pending.message.sender_id)
+        for receiver_id, seq in pending.deliveries:
+            frames.setdefault(user_room(receiver_id), []).append(dict(message_dto, seq=seq))
+        last = last_by_conversation.get(conv_id)
+        if last is None or (pending.message.timestamp, pending.message.id) > (last.message.timestamp, last.message.id):
+            last_by_conversation[conv_id] = pending
+    for room, messages in frames.items():
+        emit_messages(messages, room)
+    # 会话列表增量：每个会话每批一条，推给所有参与者（含发送方的其他设备），客户端不再逐条消息重新加载列表
+    for conv_id, pending in last_by_conversation.items():
+        if conv_id in group_senders:
+            socketio.emit('conversation_updated',
+                          conversation_delta(pending.message, senders=group_senders[conv_id]), to=group_room(conv_id))
+            continue
+        for user_id, unread_count in pending.unread_counts.items():
+            socketio.emit('conversation_updated', conversation_delta(pending.message, unread_count),
+                          to=user_room(user_id))
+
+message_writer.on_commit = deliver_committed
+
+def emit_messages(messages, room):
+    # 一条消息发 receive_msg；多条时发一个 receive_msg_batch（按顺序的消息数组），关闭合并时逐条发送
+    if len(messages) == 1 or not app.config['MESSAGE_BATCH_FRAMES']:
+        for message_dto in messages:
+            socketio.emit('receive_msg', message_dto, to=room)
+    else:
+        socketio.emit('receive_msg_batch', messages, to=room)
+
+def sync_payload(user_id, after_seq=0):
+    # 一次范围查询取出序号之后的全部待确认消息，合并为一个事件
+    rows, last_seq, has_more = fetch_pending(user_id, max(after_seq, receipts.acked_seq(user_id)))
+    return {
+        'messages': [dict(message_to_dict(msg), seq=seq) for seq, msg in rows],
+        'last_seq': last_seq,
+        'has_more': has_more
+    }
 
 # --- 认证辅助函数 (简化) ---
 def get_current_user_id():
     # ⚠️ 实际应从 JWT 或安全的 Session 中获取，此处简化为直接从 Session
-    return session.get('user_id')
+    # 账号已删除或正在删除（墓碑）时按未登录处理；Principal 有缓存，通常不查库
+    user_id = session.get('user_id')
+    if user_id is not None and auth.get_principal(user_id) is None:
+        return None
+    return user_id
 
 def get_current_user():
+    # 返回缓存的 Principal (id, username, is_admin)，不查 User 表
     user_id = get_current_user_id()
     if user_id:
-        return User.query.get(user_id)
+        return auth.get_principal(user_id)
     return None
 
 def is_admin():
     user = get_current_user()
-    return user and user.is_admin
+    return bool(user and user.is_admin)
 
 # --- 文件上传辅助函数 ---
 # 确保上传文件夹存在
@@ -37,16 +225,36 @@ if not os.path.exists(app.config['UPLOAD_FOLDER']):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-# --- 辅助函数：查找或创建会话 ---
-def get_or_create_conversation(user_one_id, user_two_id):
+# --- 辅助函数：查找或创建会话，返回会话ID ---
+def find_conversation_id(user_one_id, user_two_id):
+    # 只查找不创建，会话不存在时返回 None
+    u1, u2 = min(user_one_id, user_two_id), max(user_one_id, user_two_id)
+    # 热点会话直接命中缓存，不查库
+    conv_id = conversation_cache.get(u1, u2)
+    if conv_id is None:
+        conv_id = db.session.query(Conversation.id).filter_by(user_one_id=u1, user_two_id=u2).scalar()
+        if conv_id is not None:
+            conversation_cache.set(u1, u2, conv_id)
+    return conv_id
+
+def get_or_create_conversation_id(user_one_id, user_two_id):
     # 确保 user_one_id < user_two_id 的顺序，方便查找
     u1, u2 = min(user_one_id, user_two_id), max(user_one_id, user_two_id)
-    conv = Conversation.query.filter_by(user_one_id=u1, user_two_id=u2).first()
-    if not conv:
-        conv = Conversation(user_one_id=u1, user_two_id=u2)
-        db.session.add(conv)
+    conv_id = find_conversation_id(u1, u2)
+    if conv_id is not None:
+        return conv_id
+    
+    conv = Conversation(user_one_id=u1, user_two_id=u2)
+    ensure_members(conv)
+    db.session.add(conv)
+    try:
         db.session.commit()
-    return conv
+    except IntegrityError:
+        # (user_one_id, user_two_id) 唯一索引：并发发送方已创建同一会话，改为读取
+        db.session.rollback()
+        conv = Conversation.query.filter_by(user_one_id=u1, user_two_id=u2).one()
+    conversation_cache.set(u1, u2, conv.id)
+    return conv.id
 
 # --- 路由 ---
 
@@ -56,6 +264,7 @@ def index():
 
 # --- 图片上传路由 ---
 @app.route('/api/upload/image', methods=['POST'])
+@limiter.limit_request('upload', get_current_user_id)
 def upload_image():
     # 检查用户是否登录
     if not get_current_user_id():
@@ -76,35 +285,63 @@ def upload_image():
         return jsonify({'message': 'File type not allowed'}), 400
 
     try:
-        # 生成唯一文件名
-        unique_filename = str(uuid.uuid4()) + '.' + file.filename.rsplit('.', 1)[1].lower()
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-
-        # 保存文件
-        file.save(file_path)
+        # 边写边计算内容哈希，相同图片只存一份；缩略图在后台生成
+        ext = file.filename.rsplit('.', 1)[1].lower()
+        media = media_store.save(file.stream, ext)
 
-        # 生成图片URL
-        image_url = '/uploads/images/' + unique_filename
-
-        return jsonify({'message': 'Image uploaded successfully', 'image_url': image_url}), 200
+        return jsonify({
+            'message': 'Image uploaded successfully',
+            'image_url': media.url,
+            'thumbnail_url': media.thumbnail_url,
+            'size': media.size,
+            'deduplicated': media.deduplicated
+        }), 200
     except Exception as e:
         return jsonify({'message': 'Failed to upload image', 'error': str(e)}), 500
 
 # --- 静态文件路由 (用于访问上传的图片) ---
 @app.route('/uploads/images/<filename>')
 def uploaded_image(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # 旧版按 uuid 命名的图片：同样不会被覆盖，可长期缓存（ETag 由文件修改时间和大小生成）
+    path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return media_store.send(path)
+
+@app.route('/media/<digest>.<ext>')
+def media_original(digest, ext):
+    path = media_store.original_path(digest, ext)
+    if path is None or not os.path.exists(path):
+        abort(404)
+    # 内容哈希即强 ETag
+    return media_store.send(path, etag=digest)
+
+@app.route('/media/thumbs/<digest>.jpg')
+def media_thumbnail(digest):
+    path = media_store.ensure_thumbnail(digest)
+    if path is not None:
+        return media_store.send(path, etag=f"{digest}-thumb")
+    # 无法生成缩略图（如未安装 Pillow）时返回原图
+    original = media_store.find_original(digest)
+    if original is None:
+        abort(404)
+    return media_store.send(original, etag=digest)
 
 @app.route('/api/auth/login', methods=['POST'])
+@limiter.limit_request('login', lambda: request.remote_addr)
 def login():
     data = request.get_json()
-    user = User.query.filter_by(username=data['username']).first()
-    if user and user.check_password(data['password']):
+    # 正在删除的账号（墓碑）不能登录
+    user = User.query.filter_by(username=data['username'], deleted_at=None).first()
+    # bcrypt 校验在原生线程中执行，不阻塞其他连接
+    if user and auth.check_password(user.password_hash, data['password']):
         session['user_id'] = user.id # 登录成功，存储到 Session
+        auth.remember(Principal(user.id, user.username, user.is_admin))
         return jsonify({'message': 'Login successful', 'user_id': user.id, 'username': user.username, 'is_admin': user.is_admin}), 200
     return jsonify({'message': 'Invalid credentials'}), 401
 
 @app.route('/api/auth/register', methods=['POST'])
+@limiter.limit_request('register', lambda: request.remote_addr)
 def register():
     data = request.get_json()
     
@@ -113,17 +350,18 @@ def register():
         return jsonify({'message': 'Username already exists'}), 400
     
     # 检查是否是第一个用户
-    is_first_user = User.query.count() == 0
+    is_first_user = db.session.query(User.id).first() is None
     
     # 创建新用户
     user = User(username=data['username'])
-    user.set_password(data['password'])
+    user.password_hash = auth.hash_password(data['password'])
     
     # 如果是第一个用户，设置为管理员
     if is_first_user:
         user.is_admin = True
     
     db.session.add(user)
+    adjust_counts(users=1, admins=1 if is_first_user else 0)
     db.session.commit()
     
     return jsonify({'message': 'Registration successful', 'user_id': user.id, 'username': user.username}), 201
@@ -140,50 +378,16 @@ def get_friends():
         if not user_id: 
             return jsonify({'message': 'Unauthorized'}), 401
 
-        # 获取用户的所有好友
-        friends = []
-        
-        # 查询用户作为 user_a 的好友
-        friendships_as_a = Friendship.query.filter_by(user_a_id=user_id, status='Accepted').all()
-        for friendship in friendships_as_a:
-            friends.append(friendship.user_b)
-        
-        # 查询用户作为 user_b 的好友
-        friendships_as_b = Friendship.query.filter_by(user_b_id=user_id, status='Accepted').all()
-        for friendship in friendships_as_b:
-            friends.append(friendship.user_a)
-        
-        # 为每个好友获取会话信息
-        results = []
-        for friend in friends:
-            try:
-                # 获取会话
-                conv = get_or_create_conversation(user_id, friend.id)
-                
-                # 获取最后一条消息
-                last_message = Message.query.filter_by(conversation_id=conv.id).order_by(Message.timestamp.desc()).first()
-                
-                # 获取未读消息数
-                unread_count = Message.query.filter_by(conversation_id=conv.id, is_read=False, sender_id=friend.id).count()
-                
-                # 安全地处理last_message为None的情况
-                last_message_content = 'No messages yet.'
-                if last_message is not None:
-                    last_message_content = last_message.content if last_message.content else 'No messages yet.'
-                
-                results.append({
-                    'conversation_id': conv.id,
-                    'receiver_id': friend.id,
-                    'receiver_name': friend.username,
-                    'last_message_content': last_message_content,
-                    'unread_count': unread_count
-                })
-            except Exception as e:
-                # 即使某个朋友处理出错，也继续处理其他朋友
-                continue
+        # 好友、会话、最后一条消息和未读数由一次集合查询得到（只读，不会创建会话）
+        results = build_inbox(user_id)
+        # 好友在线状态：好友列表走缓存，在线状态一次批量查询
+        online = friend_graph.online_friends(user_id, presence)
+        for r in results:
+            r['online'] = r['receiver_id'] in online
         
         return jsonify(results)
     except Exception as e:
+        logger.exception(f"获取好友列表失败: {e}")
         return jsonify({'message': 'Internal server error', 'error': str(e)}), 500
 
 @app.route('/api/friends/add/<username>', methods=['POST'])
@@ -198,23 +402,23 @@ def add_friend(username):
     # 不能添加自己
     if friend_user.id == user_id: return jsonify({'message': 'Cannot add yourself as friend'}), 400
     
-    # 检查是否已经是好友 (更全面的检查)
+    # 检查是否已经是好友（好友列表走缓存）
     u1, u2 = min(user_id, friend_user.id), max(user_id, friend_user.id)
-    existing_friendship = Friendship.query.filter(
-        ((Friendship.user_a_id == u1) & (Friendship.user_b_id == u2)) |
-        ((Friendship.user_a_id == u2) & (Friendship.user_b_id == u1))
-    ).first()
-    
-    if existing_friendship:
+    if friend_graph.is_friend(user_id, friend_user.id):
         return jsonify({'message': 'Already friends'}), 400
     
-    # 创建好友关系
+    # 创建好友关系；其他进程的缓存尚未失效时由主键拒绝重复
     friendship = Friendship(user_a_id=u1, user_b_id=u2, status='Accepted')
     db.session.add(friendship)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'message': 'Already friends'}), 400
+    cluster_bus.publish('friend_graph', u1, u2)
     
     # 创建会话
-    get_or_create_conversation(user_id, friend_user.id)
+    get_or_create_conversation_id(user_id, friend_user.id)
     
     return jsonify({'message': 'Friend added successfully', 'friend_id': friend_user.id, 'friend_username': friend_user.username}), 200
 
@@ -231,29 +435,181 @@ def remove_friend(friend_id):
     # 删除好友关系
     db.session.delete(friendship)
     db.session.commit()
+    cluster_bus.publish('conversation_pair', u1, u2)
+    cluster_bus.publish('friend_graph', u1, u2)
     
     return jsonify({'message': 'Friend removed successfully'}), 200
 
+# --- 群聊 ---
+def publish_membership(conversation_id, user_ids, joined):
+    # 各进程更新成员缓存和群房间；再通知这些用户的各设备（新成员的会话列表中还没有该群，收到后完整加载一次）
+    cluster_bus.publish('group_membership', conversation_id, user_ids, joined)
+    event = 'conversation_updated' if joined else 'conversation_removed'
+    for user_id in user_ids:
+        socketio.emit(event, {'conversation_id': conversation_id}, to=user_room(user_id))
+
+def get_group(conversation_id, user_id):
+    # 返回 (群会话, 成员ID集合, 错误响应)：不是群聊或当前用户不是成员时返回错误
+    members = group_members.get(conversation_id)
+    if members is None:
+        return None, None, (jsonify({'message': 'Group not found'}), 404)
+    if user_id not in members:
+        return None, None, (jsonify({'message': 'You are not a member of this group'}), 403)
+    return db.session.get(Conversation, conversation_id), members, None
+
+def parse_member_ids(user_id, value):
+    # 请求中的成员ID列表：去重、去掉自己，且必须都是当前用户的好友；返回 (ID 列表, 错误响应)
+    if not isinstance(value, list) or not all(isinstance(i, int) for i in value):
+        return None, (jsonify({'message': 'user_ids must be a list of user IDs'}), 400)
+    ids = [i for i in dict.fromkeys(value) if i != user_id]
+    if set(ids) - friend_graph.are_friends(user_id, ids):
+        return None, (jsonify({'message': 'Only friends can be added to a group'}), 400)
+    return ids, None
+
+@app.route('/api/groups', methods=['POST'])
+def create_group_route():
+    user_id = get_current_user_id()
+    if not user_id: return jsonify({'message': 'Unauthorized'}), 401
+
+    data = request.get_json() or {}
+    title = (data.get('title') or '').strip()
+    if not title or len(title) > 50:
+        return jsonify({'message': 'Title is required (at most 50 characters)'}), 400
+    member_ids, error = parse_member_ids(user_id, data.get('user_ids', []))
+    if error: return error
+    if len(member_ids) + 1 > app.config['GROUP_MAX_MEMBERS']:
+        return jsonify({'message': f"A group can have at most {app.config['GROUP_MAX_MEMBERS']} members"}), 400
+
+    conv = create_group(user_id, title, member_ids)
+    db.session.commit()
+    members = [user_id, *member_ids]
+    publish_membership(conv.id, members, True)
+    return jsonify(group_to_dict(conv, members)), 201
+
+@app.route('/api/groups/<int:conversation_id>', methods=['GET'])
+def get_group_route(conversation_id):
+    user_id = get_current_user_id()
+    if not user_id: return jsonify({'message': 'Unauthorized'}), 401
+    conv, members, error = get_group(conversation_id, user_id)
+    if error: return error
+    return jsonify(group_to_dict(conv, members)), 200
+
+@app.route('/api/groups/<int:conversation_id>/members', methods=['POST'])
+def add_group_members(conversation_id):
+    # 任何成员都可以把自己的好友拉进群
+    user_id = get_current_user_id()
+    if not user_id: return jsonify({'message': 'Unauthorized'}), 401
+    conv, members, error = get_group(conversation_id, user_id)
+    if error: return error
+    member_ids, error = parse_member_ids(user_id, (request.get_json() or {}).get('user_ids'))
+    if error: return error
+    if len(members | set(member_ids)) > app.config['GROUP_MAX_MEMBERS']:
+        return jsonify({'message': f"A group can have at most {app.config['GROUP_MAX_MEMBERS']} members"}), 400
+
+    added = add_members(conversation_id, member_ids)
+    db.session.commit()
+    if added:
+        publish_membership(conversation_id, added, True)
+    return jsonify({'message': 'Members added', 'added': added}), 200
+
+@app.route('/api/groups/<int:conversation_id>/members/<int:member_id>', methods=['DELETE'])
+def remove_group_member(conversation_id, member_id):
+    # 群主可以移除任何成员，其他成员只能退出（移除自己）；群主退出后群主为空
+    user_id = get_current_user_id()
+    if not user_id: return jsonify({'message': 'Unauthorized'}), 401
+    conv, members, error = get_group(conversation_id, user_id)
+    if error: return error
+    if member_id != user_id and conv.owner_id != user_id:
+        return jsonify({'message': 'Only the group owner can remove other members'}), 403
+    if member_id not in members:
+        return jsonify({'message': 'User is not a member of this group'}), 404
+
+    remove_member(conversation_id, member_id)
+    if conv.owner_id == member_id:
+        conv.owner_id = None
+    db.session.commit()
+    publish_membership(conversation_id, [member_id], False)
+    return jsonify({'message': 'Member removed'}), 200
+
+def former_senders(messages, members):
+    # 删除用户时群聊中的消息保留（其他成员的记录不缺失），发送者的账号已不存在：客户端显示为已删除的用户
+    sender_ids = {msg.sender_id for msg in messages} - members
+    if not sender_ids:
+        return {}
+    names = dict(db.session.query(User.id, User.username).filter(User.id.in_(sender_ids)))
+    return {str(sender_id): names.get(sender_id) for sender_id in sender_ids}
+
 @app.route('/api/history/<int:conversation_id>', methods=['GET'])
 def get_history(conversation_id):
     user_id = get_current_user_id()
     if not user_id: return jsonify({'message': 'Unauthorized'}), 401
+    members = group_members.get(conversation_id)
+    if members is not None and user_id not in members:
+        return jsonify({'message': 'You are not a member of this group'}), 403
 
-    # 简单分页，每次加载 50 条
-    messages = Message.query.filter_by(conversation_id=conversation_id)\
-                            .order_by(Message.timestamp.asc())\
-                            .limit(50).all()\
+    # 该会话还有排队未提交的消息时先提交，保证读到自己刚发的消息
+    if message_writer.has_pending(conversation_id):
+        message_writer.flush()
+
+    # 游标分页：默认最新一页，?before=<cursor> 向前翻页，?after=<cursor> 取更新的消息
+    # ?format=compact|msgpack：消息为与 Socket.IO 紧凑编码相同的数组（msgpack 时整个响应为 msgpack）
+    before = request.args.get('before')
+    after = request.args.get('after')
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    try:
+        messages, has_more = fetch_page(conversation_id, before=before, after=after, limit=limit)
+    except InvalidCursor:
+        return jsonify({'message': 'Invalid cursor'}), 400
     
-    # 标记已读 (在加载历史记录时)
-    Message.query.filter_by(conversation_id=conversation_id, is_read=False)\
-                 .filter(Message.sender_id != user_id)\
-                 .update({'is_read': True})
-    db.session.commit()
+    # 加载最新一页即视为已读到其中对方的最后一条消息：只记入回执合并器，由后台批量前移已读水位
+    if before is None and after is None:
+        incoming = [msg.id for msg in messages if msg.sender_id != user_id]
+        if incoming:
+            receipts.mark_read(user_id, conversation_id, incoming[-1])
+
+    # before: 传给 ?before= 获取更早一页（没有更早的消息时为 null）
+    # after: 传给 ?after= 获取这一页之后的新消息
+    older_exists = has_more if after is None else True
+    page = {
+        'messages': [message_to_dict(msg) for msg in messages],
+        'before': encode_cursor(messages[0]) if messages and older_exists else None,
+        'after': encode_cursor(messages[-1]) if messages else after,
+        'has_more': has_more
+    }
+    if members is not None:
+        # 群聊：这一页中已不是成员的发送者（退群的成员、已删除的用户）的用户名，已删除的为 null
+        page['senders'] = former_senders(messages, members)
+    encoding = negotiate(request.args.get('format'))
+    if encoding == 'json':
+        return jsonify(page)
+    page['messages'] = [compact_message(dto) for dto in page['messages']]
+    if encoding == 'msgpack':
+        return Response(encode_payload(page, encoding), mimetype='application/x-msgpack')
+    return jsonify(page)
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    user_id = get_current_user_id()
+    if not user_id: return jsonify({'message': 'Unauthorized'}), 401
 
-    return jsonify([
-        {'sender_id': msg.sender_id, 'content': msg.content, 'type': msg.type, 'timestamp': msg.timestamp.isoformat()}
-        for msg in messages
-    ])
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'message': 'Query is required'}), 400
+    conversation_id = request.args.get('conversation_id', type=int)
+    limit = request.args.get('limit', SEARCH_PAGE_SIZE, type=int)
+    offset = request.args.get('offset', 0, type=int)
+
+    # 只搜已提交的消息，先写入排队中的消息（否则刚发的消息搜不到）
+    message_writer.flush()
+    result = search_messages(user_id, query, conversation_id=conversation_id, limit=limit, offset=offset)
+    # 分页：next_offset 传给 ?offset= 获取下一页（没有更多结果时为 null）；
+    # truncated 为 true 表示关键词不能走索引，只扫描了会话内最近的一部分消息
+    return jsonify({
+        'results': [dict(message_to_dict(msg), snippet=snippet) for msg, snippet in result.hits],
+        'next_offset': offset + len(result.hits) if result.has_more else None,
+        'has_more': result.has_more,
+        'truncated': result.truncated
+    })
 
 @app.route('/api/history/<int:conversation_id>', methods=['DELETE'])
 def clear_history(conversation_id):
@@ -265,32 +621,89 @@ def clear_history(conversation_id):
     if not conversation:
         return jsonify({'message': 'Conversation not found'}), 404
     
-    if conversation.user_one_id != user_id and conversation.user_two_id != user_id:
+    # 群聊的记录对所有成员清空，只有群主可以操作
+    if conversation.is_group:
+        if conversation.owner_id != user_id:
+            return jsonify({'message': 'Only the group owner can clear the history'}), 403
+    elif conversation.user_one_id != user_id and conversation.user_two_id != user_id:
         return jsonify({'message': 'You are not part of this conversation'}), 403
     
-    # 删除该会话的所有消息
-    Message.query.filter_by(conversation_id=conversation_id).delete()
-    db.session.commit()
+    # 先提交排队中的消息，再记下当前最后一条消息：它及之前的消息由后台任务分段删除，之后新发的保留
+    message_writer.flush()
+    cutoff_id, total = db.session.query(func.max(Message.id), func.count(Message.id))\
+        .filter(Message.conversation_id == conversation_id).one()
+    # 消息可能已全部归档，截止位置取两者中较大的
+    archived_id = db.session.query(func.max(MessageArchive.last_id))\
+        .filter(MessageArchive.conversation_id == conversation_id).scalar()
+    cutoff_id = max(cutoff_id or 0, archived_id or 0)
+    # 摘要和未读数立即清空，会话列表马上反映
+    reset_conversation(conversation_id)
+    job = job_runner.enqueue('clear_history', conversation_id, requested_by=user_id,
+                             cutoff_id=cutoff_id, total=total)
+    if not conversation.is_group:
+        cluster_bus.publish('conversation_pair', conversation.user_one_id, conversation.user_two_id)
     
-    return jsonify({'message': 'Chat history cleared successfully'}), 200
+    return jsonify({'message': 'Chat history clearing started', 'job': job_to_dict(job)}), 202
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    # 后台任务的状态和进度（发起人或管理员可查看）
+    user_id = get_current_user_id()
+    if not user_id: return jsonify({'message': 'Unauthorized'}), 401
+    job = db.session.get(Job, job_id)
+    if not job:
+        return jsonify({'message': 'Job not found'}), 404
+    if job.requested_by != user_id and not is_admin():
+        return jsonify({'message': 'Forbidden'}), 403
+    return jsonify(job_to_dict(job)), 200
 
-# --- 管理员路由 ---
 @app.route('/api/admin/users', methods=['GET'])
 def get_all_users():
     # 检查是否为管理员
     if not is_admin():
         return jsonify({'message': 'Unauthorized'}), 401
     
-    # 获取所有用户信息
-    users = User.query.all()
-    return jsonify([
-        {
-            'id': user.id,
-            'username': user.username,
-            'is_admin': user.is_admin
-        }
-        for user in users
-    ]), 200
+    # 用户目录：键集分页，可按用户名前缀（?q=）、是否管理员（?admin=1|0）、是否在线（?online=1|0）过滤；
+    # next_cursor 传给 ?cursor= 获取下一页（没有更多时为 null）。用户数 / 管理员数来自维护的计数，不做 COUNT(*)
+    try:
+        users, next_cursor = list_users(
+            presence,
+            prefix=(request.args.get('q') or '').strip() or None,
+            admin=parse_flag(request.args.get('admin')),
+            online=parse_flag(request.args.get('online')),
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', DIRECTORY_PAGE_SIZE, type=int))
+    except InvalidCursor:
+        return jsonify({'message': 'Invalid cursor'}), 400
+    return jsonify({
+        'users': users,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
+        'counts': get_counts()
+    }), 200
+
+@app.route('/api/admin/stats', methods=['GET'])
+def get_stats():
+    # 检查是否为管理员
+    if not is_admin():
+        return jsonify({'message': 'Unauthorized'}), 401
+    
+    # 各缓存 / 写入管道的运行计数
+    return jsonify({
+        'conversation_cache': conversation_cache.get_stats(),
+        'group_members': group_members.get_stats(),
+        'friend_graph': friend_graph.get_stats(),
+        'message_writer': dict(message_writer.stats),
+        'receipts': dict(receipts.stats),
+        'auth': auth.get_stats(),
+        'jobs': job_runner.get_stats(),
+        'archive': get_archive_stats(),
+        'rate_limit': limiter.get_stats(),
+        'outbound': outbound.get_stats(),
+        'codec': codec.get_stats(),
+        'cluster': dict(cluster_bus.stats, enabled=cluster_bus.enabled),
+        'redis': redis_store.get_stats()
+    }), 200
 
 @app.route('/api/admin/users/<int:user_id>/toggle-admin', methods=['POST'])
 def toggle_admin(user_id):
@@ -309,7 +722,9 @@ def toggle_admin(user_id):
         return jsonify({'message': 'User not found'}), 404
     
     user.is_admin = not user.is_admin
+    adjust_counts(admins=1 if user.is_admin else -1)
     db.session.commit()
+    cluster_bus.publish('user_principal', user.id)
     
     return jsonify({
         'message': 'Admin status updated successfully',
@@ -333,36 +748,106 @@ def delete_user(user_id):
     if not user:
         return jsonify({'message': 'User not found'}), 404
     
-    # 删除与该用户相关的所有消息
-    Message.query.filter(Message.sender_id == user_id).delete()
-    Message.query.filter(Message.receiver_id == user_id).delete()
-    
-    # 删除与该用户相关的所有好友关系
-    friendships = Friendship.query.filter(
-        (Friendship.user_a_id == user_id) | (Friendship.user_b_id == user_id)
-    ).all()
-    for friendship in friendships:
-        db.session.delete(friendship)
-    
-    # 删除与该用户相关的所有会话
-    conversations = Conversation.query.filter(
-        (Conversation.user_one_id == user_id) | (Conversation.user_two_id == user_id)
-    ).all()
-    for conversation in conversations:
-        db.session.delete(conversation)
-    
-    # 删除用户
-    db.session.delete(user)
-    db.session.commit()
+    # 先标记墓碑并断开该用户的所有连接：任务执行期间该账号的登录、请求、连接和发送的消息都被拒绝，
+    # 不会在任务删除其会话之后再写入新消息
+    if user.deleted_at is None:
+        user.deleted_at = datetime.utcnow()
+        db.session.commit()
+    cluster_bus.publish('user_deleted', user_id)
+
+    # 消息、会话、好友关系和账号由后台任务分段删除，这里只估算消息数并创建任务
+    message_writer.flush()
+    user_conversations = db.session.query(Conversation.id).filter(
+        (Conversation.user_one_id == user_id) | (Conversation.user_two_id == user_id))
+    total = db.session.query(func.count(Message.id))\
+        .filter(Message.conversation_id.in_(user_conversations)).scalar()
+    job = job_runner.enqueue('delete_user', user_id, requested_by=current_user.id, total=total)
     
-    return jsonify({'message': 'User deleted successfully'}), 200
+    return jsonify({'message': 'User deletion started', 'job': job_to_dict(job)}), 202
+
+@app.route('/api/admin/jobs', methods=['GET'])
+def list_jobs():
+    if not is_admin():
+        return jsonify({'message': 'Unauthorized'}), 401
+    # 最近的后台任务，可按状态过滤（?status=running）
+    query = Job.query
+    status = request.args.get('status')
+    if status:
+        query = query.filter_by(status=status)
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    return jsonify([job_to_dict(job) for job in query.order_by(Job.id.desc()).limit(limit)]), 200
+
+@app.route('/api/admin/retention', methods=['GET'])
+def get_retention():
+    if not is_admin():
+        return jsonify({'message': 'Unauthorized'}), 401
+    # 全局保留期限（配置文件）和按会话覆盖的策略
+    return jsonify({
+        'archive_after_days': app.config['RETENTION_ARCHIVE_AFTER_DAYS'],
+        'delete_after_days': app.config['RETENTION_DELETE_AFTER_DAYS'],
+        'conversations': [policy_to_dict(p) for p in RetentionPolicy.query.order_by(RetentionPolicy.conversation_id)]
+    }), 200
+
+@app.route('/api/admin/retention/<int:conversation_id>', methods=['PUT'])
+def set_retention(conversation_id):
+    if not is_admin():
+        return jsonify({'message': 'Unauthorized'}), 401
+    if not db.session.get(Conversation, conversation_id):
+        return jsonify({'message': 'Conversation not found'}), 404
+
+    # 天数为 null 时使用全局配置，0 表示不归档 / 不删除
+    data = request.get_json() or {}
+    values = {}
+    for field in ('archive_after_days', 'delete_after_days'):
+        value = data.get(field)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+            return jsonify({'message': f'{field} must be a non-negative integer or null'}), 400
+        values[field] = value
+
+    policy = db.session.get(RetentionPolicy, conversation_id)
+    if policy is None:
+        policy = RetentionPolicy(conversation_id=conversation_id)
+        db.session.add(policy)
+    policy.archive_after_days = values['archive_after_days']
+    policy.delete_after_days = values['delete_after_days']
+    policy.updated_at = datetime.utcnow()
+    db.session.commit()
+    return jsonify(policy_to_dict(policy)), 200
+
+@app.route('/api/admin/retention/<int:conversation_id>', methods=['DELETE'])
+def delete_retention(conversation_id):
+    if not is_admin():
+        return jsonify({'message': 'Unauthorized'}), 401
+    # 删除会话策略，恢复使用全局配置
+    RetentionPolicy.query.filter_by(conversation_id=conversation_id).delete()
+    db.session.commit()
+    return jsonify({'message': 'Retention policy removed'}), 200
+
+@app.route('/api/admin/retention/run', methods=['POST'])
+def run_retention():
+    if not is_admin():
+        return jsonify({'message': 'Unauthorized'}), 401
+    # 立即执行一次归档（已有未完成的归档任务时返回该任务）
+    job = job_runner.enqueue('retention', 0, requested_by=get_current_user_id())
+    return jsonify({'message': 'Retention started', 'job': job_to_dict(job)}), 202
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus 抓取（本进程的指标）；不要对公网开放，见部署说明
+    if not metrics.enabled:
+        abort(404)
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
 # --- 全局错误处理 ---
 @app.errorhandler(Exception)
 def handle_exception(e):
     """全局异常处理，确保所有API错误返回JSON响应"""
+    if isinstance(e, HTTPException):
+        # 404 等 HTTP 错误按原样返回（API 路由原本就自行返回 JSON）
+        return e
     if request.path.startswith('/api/'):
-        # 如果是API请求，返回JSON错误响应
+        # 如果是API请求，返回JSON错误响应（非API请求由 Flask 记录日志）
+        logger.exception(f"{request.method} {request.path} 出错: {e}")
         return jsonify({'message': 'Internal Server Error', 'error': str(e)}), 500
     # 非API请求返回默认错误页面
     return app.handle_exception(e)
@@ -370,82 +855,190 @@ def handle_exception(e):
 # --- SocketIO 事件处理 (P2P 核心) ---
 
 @socketio.on('connect')
-def handle_connect():
-    # ⚠️ 必须确保用户已经登录，这里从 Session 中获取 user_id
-    user_id = session.get('user_id') 
+def handle_connect(auth=None):
+    # ⚠️ 必须确保用户已经登录，这里从 Session 中获取 user_id（正在删除的账号按未登录处理）
+    user_id = get_current_user_id()
     if user_id is None:
         # 如果未认证，断开连接
         disconnect()
         return False
     
-    # 存储用户ID和Socket ID的映射
-    set_user_socket(user_id, request.sid)
-    # 存储反向映射，便于 disconnect 时查询 user_id (可选优化)
-    # redis_client.set(f"sid:{request.sid}", user_id, ex=SOCKET_TTL)
+    # Socket.IO 连接不经过 Flask 的 before_request：只收到长连接的进程也要运行后台任务和定期的保留任务
+    job_runner.start()
+    # 协商消息负载的编码（auth 或查询参数 encoding），之后的 receive_msg / receive_msg_batch / sync 按此编码发送
+    requested = auth.get('encoding') if isinstance(auth, dict) else request.args.get('encoding')
+    codec.accept(request.sid, requested)
+    # 登记连接（同一用户可有多个连接），并加入用户房间：推送给房间即送达该用户的所有设备
+    presence.connect(user_id, request.sid)
+    join_room(user_room(user_id))
+    # 加入所在群聊的房间：群消息一次发到房间即送达全部在线成员
+    for conversation_id in user_group_ids(user_id):
+        join_room(group_room(conversation_id))
+    # 补发上次确认之后的消息（离线期间收到的、或推送时连接已断开的）
+    emit('sync', sync_payload(user_id), to=request.sid)
 
 
 @socketio.on('disconnect')
-def handle_disconnect():
-    # ⚠️ 依赖于反向映射或在 connect 时将 user_id 存储在 SocketIO session
-    # 假设我们能在 disconnect 时获取 user_id
-    user_id = session.get('user_id') 
-    if user_id:
-        remove_user_socket(user_id)
+def handle_disconnect(reason=None):
+    # 较新的 python-socketio 会传入断开原因
+    # 通过 sid 反向索引找到用户，只移除这一个连接，其他设备保持在线
+    presence.disconnect(request.sid)
+    limiter.forget(request.sid)
+    codec.forget(request.sid)
+
+@socketio.on('heartbeat')
+@limiter.limit_event()
+def handle_heartbeat():
+    # 客户端定时发送，刷新连接的过期时间
+    presence.heartbeat(request.sid, session.get('user_id'))
+
+@socketio.on('sync')
+@limiter.limit_event()
+def handle_sync(data=None):
+    # 客户端按上一批的 last_seq 继续拉取（has_more 时），或发现序号缺口时主动请求
+    user_id = session.get('user_id')
+    if user_id is None:
+        return
+    after_seq = data.get('after_seq') if isinstance(data, dict) else None
+    # 与 ack 一样只接受整数：缺失、非整数或负数时按 0 处理（从已确认的序号之后补发）
+    if not isinstance(after_seq, int) or after_seq < 0:
+        after_seq = 0
+    emit('sync', sync_payload(user_id, after_seq), to=request.sid)
+
+@socketio.on('ack')
+@limiter.limit_event()
+def handle_ack(data):
+    # 客户端确认已连续收到 seq 及之前的所有消息，合并后批量落库并向发送方推送送达回执
+    user_id = session.get('user_id')
+    seq = (data or {}).get('seq')
+    if user_id is None or not isinstance(seq, int):
+        return
+    receipts.ack_delivered(user_id, seq)
+
+@socketio.on('read')
+@limiter.limit_event()
+def handle_read(data):
+    # 客户端报告已读到会话中的某条消息：合并后批量前移已读水位，并向会话中其他参与者推送已读回执
+    # （是否为该会话参与者在落库时校验）
+    user_id = session.get('user_id')
+    conversation_id = (data or {}).get('conversation_id')
+    message_id = (data or {}).get('message_id')
+    if user_id is None or not isinstance(conversation_id, int) or not isinstance(message_id, int):
+        return
+    receipts.mark_read(user_id, conversation_id, message_id)
+
+def resolve_target(sender_id, data):
+    # 消息的目标会话：单聊带 receiver_id（接收方必须是好友，查找或创建会话），群聊带 conversation_id（校验成员身份）
+    # 好友列表和成员列表都走缓存；返回 (会话ID, 接收方ID)，群聊的接收方为 None；无效时返回 None
+    receiver_id = data.get('receiver_id')
+    if receiver_id is None:
+        group_id = data.get('conversation_id')
+        members = group_members.get(group_id) if isinstance(group_id, int) else None
+        if not members or sender_id not in members:
+            return None
+        return group_id, None
+    if not receiver_id or not friend_graph.is_friend(sender_id, receiver_id):
+        return None
+    return get_or_create_conversation_id(sender_id, receiver_id), receiver_id
+
+def submit_messages(sender_id, conv_id, receiver_id, items):
+    # 消息持久化：分配服务端消息ID后交给写入管道批量提交
+    # （会话 last_message_at、摘要、接收方未读计数和投递序号在同一事务内更新）
+    # 已读状态由接收方客户端的 read 事件更新。items 为 [(content, type)]，返回消息 DTO 列表；保存失败时返回 None
+    pending = []
+    for content, message_type in items:
+        new_message = Message(
+            conversation_id=conv_id, 
+            sender_id=sender_id, 
+            content=content,
+            type=message_type,
+            is_read=False,
+            timestamp=datetime.utcnow()
+        )
+        if receiver_id is None:
+            # 群聊：一条消息、一次未读数 UPDATE，与成员数无关
+            pending.append(message_writer.submit(new_message, group=True))
+        else:
+            pending.append(message_writer.submit(new_message, [receiver_id]))
+    
+    # 持久确认模式：批次提交成功后再推送（等待前归还数据库连接，避免占满连接池）
+    if app.config['MESSAGE_DURABLE_ACK']:
+        db.session.close()
+        if not all(p.wait() for p in pending):
+            emit('send_error', {'message': 'Failed to save message'}, to=request.sid)
+            return None
+    return [message_to_dict(p.message) for p in pending]
+
+def echo_messages(messages, sender_id, receiver_id):
+    # 实时定向传输 (P2P)：接收方的所有设备在批次提交后由 deliver_committed 推送（带投递序号）
+    # 发送给发送方的所有设备 (本地确认 + 多端同步)；群聊的其他设备在提交后随群房间收到，这里只回显给当前连接
+    room = request.sid if receiver_id is None else user_room(sender_id)
+    if len(messages) == 1:
+        emit('receive_msg', messages[0], to=room)
+    else:
+        emit('receive_msg_batch', messages, to=room)
 
 @socketio.on('send_msg')
+@limiter.limit_event('send_msg', lambda data: get_current_user_id())
 def handle_send_message(data):
     sender_id = get_current_user_id()
-    receiver_id = data.get('receiver_id')
     content = data.get('content')
     message_type = data.get('type', 'text')  # 默认文本类型
-    
-    if not sender_id or not receiver_id or not content:
+    if not sender_id or not content:
         return
-        
-    # 1. 查找或创建会话
-    conv = get_or_create_conversation(sender_id, receiver_id)
-    
-    # 2. 消息持久化
-    new_message = Message(
-        conversation_id=conv.id, 
-        sender_id=sender_id, 
-        content=content,
-        type=message_type,  # 添加消息类型
-        is_read=False # 默认未读
-    )
-    db.session.add(new_message)
-    # 更新会话最后消息时间
-    conv.last_message_at = datetime.utcnow()
-    db.session.commit()
-    
-    # 组装完整的消息 DTO
-    message_dto = {
-        'conversation_id': conv.id,
-        'sender_id': sender_id,
-        'content': content,
-        'type': message_type,  # 添加消息类型到DTO
-        'timestamp': new_message.timestamp.isoformat()
-    }
+    target = resolve_target(sender_id, data)
+    if target is None:
+        return
+    conv_id, receiver_id = target
+    messages = submit_messages(sender_id, conv_id, receiver_id, [(content, message_type)])
+    if messages:
+        echo_messages(messages, sender_id, receiver_id)
 
-    # 3. 实时定向传输 (P2P)
-    receiver_sid = get_user_socket(receiver_id)
-    
-    # 发送给接收方
-    if receiver_sid:
-        emit('receive_msg', message_dto, to=receiver_sid)
-        # 标记已读 (如果用户在线，可以假设消息被接收即已读，但通常在前端确认)
-        new_message.is_read = True 
-        db.session.commit()
-        
-    # 4. 发送给发送方 (本地确认)
-    emit('receive_msg', message_dto, to=request.sid)
+def batch_size(data):
+    # send_msg_batch 按消息条数消耗 send_msg 令牌
+    messages = (data or {}).get('messages')
+    return len(messages) if isinstance(messages, list) and messages else 1
+
+@socketio.on('send_msg_batch')
+@limiter.limit_event('send_msg', lambda data: get_current_user_id(), batch_size)
+def handle_send_message_batch(data):
+    # 一次发送多条消息给同一个目标（一次选择多张图片、断线期间积压的消息等），回显合并为一个 receive_msg_batch
+    sender_id = get_current_user_id()
+    items = (data or {}).get('messages')
+    if not sender_id or not isinstance(items, list) or not 0 < len(items) <= app.config['SEND_MSG_BATCH_MAX']:
+        return
+    items = [(item.get('content'), item.get('type', 'text')) for item in items if isinstance(item, dict)]
+    items = [item for item in items if item[0]]
+    if not items:
+        return
+    target = resolve_target(sender_id, data)
+    if target is None:
+        return
+    conv_id, receiver_id = target
+    messages = submit_messages(sender_id, conv_id, receiver_id, items)
+    if messages:
+        echo_messages(messages, sender_id, receiver_id)
+
+@socketio.on('typing')
+@limiter.limit_event('typing', lambda data: (get_current_user_id(), (data or {}).get('receiver_id')))
+def handle_typing(data):
+    # 输入状态：同一对用户在合并窗口（RATE_LIMIT_TYPING）内只转发一次，不落库；只发给已有会话的对方
+    sender_id = get_current_user_id()
+    receiver_id = (data or {}).get('receiver_id')
+    if not sender_id or not isinstance(receiver_id, int) or receiver_id == sender_id:
+        return
+    conv_id = find_conversation_id(sender_id, receiver_id)
+    if conv_id is None:
+        return
+    cluster_bus.publish('typing', receiver_id, {'conversation_id': conv_id, 'user_id': sender_id})
 
 # --- 启动 ---
 if __name__ == '__main__':
     with app.app_context():
         # ⚠️ 首次运行或需要重置数据库时取消注释
         # db.drop_all()
-        db.create_all()
+        # 空库建表，旧库执行待完成的迁移（见 migrate.py）
+        upgrade()
         
         # ⚠️ 创建测试用户 (首次运行时)
         if not User.query.first():
@@ -454,6 +1047,7 @@ if __name__ == '__main__':
             user2 = User(username='userB')
             user2.set_password('123')
             db.session.add_all([user1, user2])
+            adjust_counts(users=2)
             db.session.commit()
             
             # 建立好友关系
@@ -463,7 +1057,17 @@ if __name__ == '__main__':
             db.session.commit()
             
             # 创建会话
-            get_or_create_conversation(user1.id, user2.id)
+            get_or_create_conversation_id(user1.id, user2.id)
 
-    # 使用 socketio.run() 启动服务器，使用端口5001避免冲突
-    socketio.run(app, host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    # 继续执行上次退出时未完成的后台任务
+    job_runner.start()
+
+    # 使用 socketio.run() 启动服务器，默认端口5001避免冲突（可通过 SERVER_PORT 修改）
+    try:
+        socketio.run(app, host=app.config['SERVER_HOST'], port=app.config['SERVER_PORT'],
+                     debug=app.config['SERVER_DEBUG'])
+    finally:
+        # 退出前提交写入管道中剩余的消息和回执
+        message_writer.stop()
+        receipts.stop()
+        job_runner.stop()
\ No newline at end of file
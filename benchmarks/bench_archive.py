@@ -0,0 +1,154 @@
+"""
+消息归档基准：超过 --archive-days 天的消息压缩归档前后的数据库大小和历史记录查询延迟。
+
+生成 --messages 条随机中文文本消息（均匀分布在过去 --days 天、--conversations 个会话中），建立全文索引，然后：
+- before: 全部消息在 Message 表中
+- after:  执行保留任务（retention）的归档、合并全文索引步骤后
+两种状态都先 VACUUM，再统计数据库文件大小、各部分（消息表及索引 / 全文索引 / 归档）占用，
+以及随机会话的最新一页、--old-days 天前一页（归档后由归档读取）的 p50 / p99 延迟。
+
+用法: python -m benchmarks.bench_archive --messages 1000000 --archive-days 90
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import load_app, timer, percentile, print_table
+from benchmarks.bench_inbox import DUMMY_HASH
+from benchmarks.bench_search import random_text
+
+
+def seed(m, users, conversations, messages, days, batch_size=50000):
+    from sqlalchemy import insert
+    from utils.search import rebuild_index
+    from utils.summary import rebuild_summaries
+    db = m.db
+    rng = random.Random(42)
+    db.session.execute(insert(m.User), [
+        {'id': uid, 'username': f'u{uid}', 'password_hash': DUMMY_HASH, 'is_admin': False}
+        for uid in range(1, users + 1)
+    ])
+    pairs = set()
+    while len(pairs) < conversations:
+        a, b = rng.sample(range(1, users + 1), 2)
+        pairs.add((min(a, b), max(a, b)))
+    pairs = sorted(pairs)
+    db.session.execute(insert(m.Conversation), [
+        {'id': i, 'user_one_id': a, 'user_two_id': b} for i, (a, b) in enumerate(pairs, 1)
+    ])
+    db.session.commit()
+
+    start = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / messages
+    for first in range(1, messages + 1, batch_size):
+        rows = []
+        for msg_id in range(first, min(first + batch_size, messages + 1)):
+            conv_id = rng.randrange(1, conversations + 1)
+            rows.append({'id': msg_id, 'conversation_id': conv_id, 'sender_id': rng.choice(pairs[conv_id - 1]),
+                         'content': random_text(rng), 'type': 'text', 'is_read': True,
+                         'timestamp': start + step * msg_id})
+        db.session.execute(insert(m.Message), rows)
+        db.session.commit()
+    rebuild_index()
+    rebuild_summaries()
+
+
+def old_cursors(m, conversation_ids, old_days):
+    """每个会话中 old_days 天前的第一条消息之后的游标（归档前后相同）"""
+    from utils.history import encode_cursor
+    when = datetime.utcnow() - timedelta(days=old_days)
+    cursors = []
+    for conv_id in conversation_ids:
+        msg = m.Message.query.filter(m.Message.conversation_id == conv_id, m.Message.timestamp >= when)\
+            .order_by(m.Message.timestamp.asc(), m.Message.id.asc()).first()
+        if msg is not None:
+            cursors.append((conv_id, encode_cursor(msg)))
+    return cursors
+
+
+def measure(m, db_path, name, conversation_ids, cursors, queries):
+    """VACUUM 后统计大小和查询延迟"""
+    from utils.history import fetch_page
+    m.db.session.commit()
+    m.db.session.execute(m.db.text('VACUUM'))
+    sizes = {'message': 0, 'fts': 0, 'archive': 0}
+    for table, size in m.db.session.execute(m.db.text('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')):
+        if table.startswith('message_fts'):
+            sizes['fts'] += size
+        elif table.startswith(('message_archive', 'ix_message_archive')):
+            sizes['archive'] += size
+        elif table == 'message' or table.startswith('ix_message_') or table.startswith('sqlite_autoindex_message'):
+            sizes['message'] += size
+
+    def run(calls):
+        latencies = []
+        for fn in calls:
+            start = time.perf_counter()
+            fn()
+            latencies.append((time.perf_counter() - start) * 1000)
+        m.db.session.rollback()
+        return latencies
+
+    rng = random.Random(7)
+    latest = run([lambda c=rng.choice(conversation_ids): fetch_page(c) for _ in range(queries)])
+    old = run([lambda c=c, cur=cur: fetch_page(c, before=cur) for c, cur in
+               (rng.choice(cursors) for _ in range(queries))])
+    mb = 1024 * 1024
+    return (name, f'{os.path.getsize(db_path) / mb:.1f}', f"{sizes['message'] / mb:.1f}", f"{sizes['fts'] / mb:.1f}",
+            f"{sizes['archive'] / mb:.1f}", f'{percentile(latest, 50):.2f}', f'{percentile(latest, 99):.2f}',
+            f'{percentile(old, 50):.2f}', f'{percentile(old, 99):.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--conversations', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=365, help='消息分布的天数')
+    parser.add_argument('--archive-days', type=int, default=90)
+    parser.add_argument('--old-days', type=int, default=200, help='测量该天数前的一页')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--chunk', type=int, default=5000, help='归档任务每段处理的消息数')
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='lightchat-archive-'), 'bench.db')
+    m = load_app(db_path)
+    from models import Job
+    from utils.jobs import JOB_STEPS
+    rows = []
+    with m.app.app_context():
+        result = {}
+        with timer(result):
+            seed(m, args.users, args.conversations, args.messages, args.days)
+        print(f"seeded {args.messages} messages in {result['seconds']:.1f}s")
+        conversation_ids = list(range(1, args.conversations + 1))
+        cursors = old_cursors(m, conversation_ids, args.old_days)
+        rows.append(measure(m, db_path, 'hot only', conversation_ids, cursors, args.queries))
+
+        # 直接执行保留任务的各步骤（与 JobRunner 相同的分段提交）
+        m.app.config['RETENTION_ARCHIVE_AFTER_DAYS'] = args.archive_days
+        job = Job(kind='retention', target_id=0)
+        m.db.session.add(job)
+        m.db.session.commit()
+        with timer(result):
+            for name, step in JOB_STEPS['retention']:
+                while True:
+                    done = step(m.job_runner, job, args.chunk)
+                    job.progress += done if name == 'messages' else 0
+                    m.db.session.commit()
+                    if not done:
+                        break
+        print(f"archived {job.progress} messages and compacted the search index in {result['seconds']:.1f}s")
+        rows.append(measure(m, db_path, f'archived > {args.archive_days}d', conversation_ids, cursors, args.queries))
+    print_table(('state', 'db MB', 'message MB', 'fts MB', 'archive MB', 'latest p50 ms', 'latest p99 ms',
+                 f'{args.old_days}d ago p50 ms', f'{args.old_days}d ago p99 ms'), rows)
+    m.message_writer.stop()
+    m.receipts.stop()
+    return rows
+
+
+if __name__ == '__main__':
+    main()
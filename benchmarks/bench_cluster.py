@@ -0,0 +1,206 @@
+"""
+多进程部署压测：N 个 app.py 进程共享同一个 SQLite 库和 Redis（Socket.IO 消息队列 + 在线状态），
+发送方与接收方连接在不同进程上，测量连接速率、跨进程消息吞吐和端到端延迟。
+
+未指定 --redis-url 时自动启动 benchmarks/mini_redis.py 作为 Redis 替身。
+客户端使用 python-socketio 的同步客户端：pip install "python-socketio[client]"
+
+用法: python -m benchmarks.bench_cluster --workers 1,2 --pairs 20 --messages 50
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+import bcrypt
+import redis
+import requests
+import socketio
+
+from benchmarks.common import ROOT, load_app, percentile, print_table
+
+BASE_PORT = 5100
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{host}:{port} 未在 {timeout} 秒内就绪")
+
+
+def seed(m, pairs):
+    """创建 pairs 对互为好友的用户（低强度 bcrypt，加快登录），返回 [(sender_id, receiver_id)]"""
+    password_hash = bcrypt.hashpw(b'pw', bcrypt.gensalt(4)).decode()
+    result = []
+    with m.app.app_context():
+        for k in range(pairs):
+            sender = m.User(username=f'sender{k}', password_hash=password_hash)
+            receiver = m.User(username=f'receiver{k}', password_hash=password_hash)
+            m.db.session.add_all([sender, receiver])
+            m.db.session.flush()
+            m.db.session.add(m.Friendship(user_a_id=sender.id, user_b_id=receiver.id, status='Accepted'))
+            m.db.session.commit()
+            m.get_or_create_conversation_id(sender.id, receiver.id)
+            result.append((sender.id, receiver.id, sender.username, receiver.username))
+    return result
+
+
+def start_workers(count, db_path, redis_url, log_dir):
+    parsed = urlparse(redis_url)
+    procs = []
+    for i in range(count):
+        env = dict(os.environ,
+                   DATABASE_URL='sqlite:///' + db_path,
+                   SOCKETIO_MESSAGE_QUEUE=redis_url,
+                   REDIS_HOST=parsed.hostname or 'localhost',
+                   REDIS_PORT=str(parsed.port or 6379),
+                   WORKER_ID=str(i),
+                   SERVER_HOST='127.0.0.1',
+                   SERVER_PORT=str(BASE_PORT + i),
+                   SERVER_DEBUG='0')
+        log = open(os.path.join(log_dir, f'worker{i}.log'), 'w')
+        procs.append(subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT, env=env,
+                                      stdout=log, stderr=subprocess.STDOUT))
+    for i in range(count):
+        wait_for_port('127.0.0.1', BASE_PORT + i)
+    return procs
+
+
+def stop_processes(procs):
+    for proc in procs:
+        proc.send_signal(signal.SIGINT)
+    for proc in procs:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+class BenchClient:
+    """登录后建立 WebSocket 连接，记录收到的对方消息及延迟"""
+
+    def __init__(self, base_url, user_id, username, on_message):
+        self.base_url = base_url
+        self.user_id = user_id
+        http = requests.Session()
+        resp = http.post(base_url + '/api/auth/login', json={'username': username, 'password': 'pw'})
+        resp.raise_for_status()
+        self.cookie = '; '.join(f'{k}={v}' for k, v in http.cookies.items())
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('receive_msg', self._on_receive)
+        self.sio.on('receive_msg_batch', self._on_receive_batch)
+        self.on_message = on_message
+
+    def connect(self):
+        self.sio.connect(self.base_url, headers={'Cookie': self.cookie}, transports=['websocket'], wait_timeout=10)
+
+    def _on_receive(self, data):
+        if data['sender_id'] != self.user_id:
+            self.on_message(time.time() - float(data['content']))
+
+    def _on_receive_batch(self, messages):
+        for data in messages:
+            self._on_receive(data)
+
+
+def run_once(workers, pairs, messages, redis_url, m, db_path, users, log_dir):
+    redis.Redis.from_url(redis_url).flushdb()
+    procs = start_workers(workers, db_path, redis_url, log_dir)
+    clients = []
+    try:
+        expected = pairs * messages
+        latencies = []
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def on_message(latency):
+            with lock:
+                latencies.append(latency)
+                if len(latencies) >= expected:
+                    done.set()
+
+        # 第 k 对的发送方连 (2k % W) 号进程、接收方连 (2k+1 % W) 号进程：W>=2 时每条消息都跨进程
+        senders = []
+        for index, (sender_id, receiver_id, sender_name, receiver_name) in enumerate(users[:pairs]):
+            sender_url = f'http://127.0.0.1:{BASE_PORT + (2 * index) % workers}'
+            receiver_url = f'http://127.0.0.1:{BASE_PORT + (2 * index + 1) % workers}'
+            clients.append(BenchClient(receiver_url, receiver_id, receiver_name, on_message))
+            sender = BenchClient(sender_url, sender_id, sender_name, lambda latency: None)
+            clients.append(sender)
+            senders.append((sender, receiver_id))
+
+        start = time.perf_counter()
+        for client in clients:
+            client.connect()
+        connect_seconds = time.perf_counter() - start
+
+        def send_all(sender, receiver_id):
+            for _ in range(messages):
+                sender.sio.emit('send_msg', {'receiver_id': receiver_id, 'content': repr(time.time())})
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=send_all, args=s) for s in senders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        done.wait(60)
+        elapsed = time.perf_counter() - start
+    finally:
+        for client in clients:
+            if client.sio.connected:
+                client.sio.disconnect()
+        stop_processes(procs)
+
+    with m.app.app_context():
+        persisted = m.Message.query.count()
+    ms = [v * 1000 for v in latencies]
+    return (workers, len(clients), f'{len(clients) / connect_seconds:.0f}',
+            f'{len(latencies)}/{expected}', f'{len(latencies) / elapsed:.0f}',
+            f'{percentile(ms, 50):.1f}', f'{percentile(ms, 95):.1f}', f'{percentile(ms, 99):.1f}', persisted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', default='1,2', help='逗号分隔的进程数')
+    parser.add_argument('--pairs', type=int, default=20, help='发送方/接收方对数')
+    parser.add_argument('--messages', type=int, default=50, help='每个发送方的消息数')
+    parser.add_argument('--redis-url', help='使用已有的 Redis（默认启动 mini_redis）')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='lightchat-cluster-')
+    db_path = os.path.join(work_dir, 'bench.db')
+    m = load_app(db_path)
+    users = seed(m, args.pairs)
+
+    helper = []
+    redis_url = args.redis_url
+    if not redis_url:
+        redis_url = 'redis://127.0.0.1:6399/0'
+        helper.append(subprocess.Popen([sys.executable, '-m', 'benchmarks.mini_redis', '--port', '6399'],
+                                       cwd=ROOT, stdout=subprocess.DEVNULL))
+        wait_for_port('127.0.0.1', 6399)
+    try:
+        rows = [run_once(int(w), args.pairs, args.messages, redis_url, m, db_path, users, work_dir)
+                for w in args.workers.split(',')]
+    finally:
+        stop_processes(helper)
+    print_table(('workers', 'clients', 'connect/s', 'delivered', 'msg/s',
+                 'p50 ms', 'p95 ms', 'p99 ms', 'persisted (total)'), rows)
+    print(f"worker 日志: {work_dir}")
+    return rows
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+消息负载编码基准：json（字典）vs compact（JSON 数组）vs msgpack，单条 receive_msg 与合并的 receive_msg_batch
+
+- bytes/msg: 实际发出的 Engine.IO 包大小（WebSocket 帧负载，msgpack 含二进制附件的占位包）
+- encode us/msg: 服务端把消息 DTO 编码为待发送包的 CPU 时间（compact / msgpack 含字段重排和时间戳换算）
+
+消息内容为中英文长短不一的文本和带缩略图的图片消息，与实际推送的 DTO 结构相同（带投递序号）。
+
+用法: python -m benchmarks.bench_codec --messages 2000 --batch 20
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import print_table
+from engineio import packet as eio_packet
+from socketio import packet as sio_packet
+from utils.codec import compact_payload, encode, msgpack
+
+TEXTS = ('ok', 'on my way', 'see you at 7?', '好的，明天见', 'Could you send me the slides from this morning?',
+         '今天的会议改到下午三点，地点不变，记得带上上周的报告。')
+
+
+def sample_messages(count, seed=42):
+    """count 条消息 DTO（与 message_to_dict 加上 seq 的结果相同），约 10% 为图片"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    messages = []
+    for i in range(count):
+        dto = {
+            'id': 361520305766400 + i * 4096 + rng.randrange(4096),
+            'conversation_id': rng.randrange(1, 50000),
+            'sender_id': rng.randrange(1, 10000),
+            'content': rng.choice(TEXTS),
+            'type': 'text',
+            'timestamp': (start + timedelta(seconds=i, microseconds=rng.randrange(10 ** 6))).isoformat(),
+            'seq': 1000 + i,
+        }
+        if rng.random() < 0.1:
+            digest = '%064x' % rng.getrandbits(256)
+            dto.update(type='image', content=f'/media/{digest}.jpg', thumbnail_url=f'/media/thumb/{digest}.jpg')
+        messages.append(dto)
+    return messages
+
+
+def build_packets(event, data, encoding):
+    """服务端发出的 Engine.IO 包"""
+    payload = data if encoding == 'json' else encode(compact_payload(event, data), encoding)
+    encoded = sio_packet.Packet(sio_packet.EVENT, data=[event, payload]).encode()
+    return [eio_packet.Packet(eio_packet.MESSAGE, p) for p in (encoded if isinstance(encoded, list) else [encoded])]
+
+
+def wire_bytes(packets):
+    total = 0
+    for pkt in packets:
+        encoded = pkt.encode()
+        total += len(encoded.encode() if isinstance(encoded, str) else encoded)
+    return total
+
+
+def frames(messages, batch):
+    """(事件, 数据) 列表：batch 为 1 时逐条 receive_msg，否则每 batch 条一个 receive_msg_batch"""
+    if batch == 1:
+        return [('receive_msg', dto) for dto in messages]
+    return [('receive_msg_batch', messages[i:i + batch]) for i in range(0, len(messages), batch)]
+
+
+def measure(messages, batch, encoding, repeat=3):
+    items = frames(messages, batch)
+    size = sum(wire_bytes(build_packets(event, data, encoding)) for event, data in items)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for event, data in items:
+            build_packets(event, data, encoding)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return size / len(messages), best / len(messages) * 1e6
+
+
+def run(count, batch):
+    messages = sample_messages(count)
+    encodings = ['json', 'compact'] + (['msgpack'] if msgpack is not None else [])
+    rows = []
+    for frame in (1, batch):
+        base = None
+        for encoding in encodings:
+            size, cpu = measure(messages, frame, encoding)
+            base = base or (size, cpu)
+            rows.append(('receive_msg' if frame == 1 else f'receive_msg_batch x{frame}', encoding,
+                         f'{size:.1f}', f'{size / base[0] * 100:.0f}%', f'{cpu:.2f}', f'{cpu / base[1] * 100:.0f}%'))
+    if msgpack is None:
+        print('未安装 msgpack，跳过 msgpack 编码')
+    print_table(('frame', 'encoding', 'bytes/msg', 'vs json', 'encode us/msg', 'vs json'), rows)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=20, help='receive_msg_batch 每帧的消息数')
+    args = parser.parse_args()
+    run(args.messages, args.batch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+管理员用户目录基准：旧的一次返回全部用户 vs 键集分页
+
+- all:          旧的 GET /api/admin/users（User.query.all() 全部序列化为一个 JSON 数组）
+- first page:   第一页（含在线状态和计数）
+- deep page:    用最后一页之前的游标翻页（键集分页，耗时与位置无关）
+- prefix:       用户名前缀搜索（走 username 唯一索引）
+- admins:       只看管理员（走 (is_admin, id) 索引）
+另外对比用户数 / 管理员数：COUNT(*) 与维护的计数。
+
+用法: python -m benchmarks.bench_directory --users 100000,300000 --repeat 5
+"""
+import argparse
+
+from benchmarks.common import load_app, QueryCounter, timer, percentile, print_table
+from benchmarks.bench_inbox import DUMMY_HASH
+
+
+def seed(m, start, stop):
+    """追加用户 [start, stop)，每 1000 个中一个管理员，再按 User 表重建计数"""
+    from sqlalchemy import insert
+    from utils.directory import rebuild_counts
+    rows = [{'id': uid, 'username': f'user{uid:07d}', 'password_hash': DUMMY_HASH, 'is_admin': uid % 1000 == 1}
+            for uid in range(start, stop)]
+    for i in range(0, len(rows), 10000):
+        m.db.session.execute(insert(m.User), rows[i:i + 10000])
+    rebuild_counts()
+    m.db.session.commit()
+
+
+def legacy_all(m):
+    users = m.User.query.all()
+    return m.jsonify([{'id': user.id, 'username': user.username, 'is_admin': user.is_admin} for user in users])
+
+
+def measure(m, engine, fn, repeat):
+    """返回 (p50 秒, 响应字节数, SQL 条数)"""
+    timings, size, statements = [], 0, 0
+    for _ in range(repeat):
+        result = {}
+        with QueryCounter(engine) as counter, timer(result):
+            response = fn()
+            size = len(response.get_data())
+        m.db.session.expunge_all()
+        timings.append(result['seconds'])
+        statements = counter.count
+    return percentile(timings, 50), size, statements
+
+
+def run(sizes, repeat):
+    m = load_app()
+    from sqlalchemy import func
+    from utils.directory import get_counts
+    client = m.app.test_client()
+    rows = []
+    with m.app.app_context():
+        engine = m.db.engine
+    total = 1
+    for size in sizes:
+        with m.app.app_context():
+            seed(m, total, size + 1)
+        total = size + 1
+        # 以用户 1（管理员）登录；在线状态由进程内存储提供，不需要 Redis
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        deep_cursor = size - 50
+        prefix = f'user{size // 2:07d}'[:-2]  # 匹配 100 个用户
+        cases = [
+            ('all (legacy)', None),
+            ('first page', '/api/admin/users?limit=50'),
+            ('deep page', f'/api/admin/users?limit=50&cursor={deep_cursor}'),
+            ('prefix', f'/api/admin/users?limit=50&q={prefix}'),
+            ('admins', '/api/admin/users?limit=50&admin=1'),
+        ]
+        for name, url in cases:
+            with m.app.test_request_context():
+                if url is None:
+                    p50, nbytes, statements = measure(m, engine, lambda: legacy_all(m), repeat)
+                else:
+                    p50, nbytes, statements = measure(m, engine, lambda: client.get(url), repeat)
+            rows.append((size, name, statements, f'{nbytes / 1024:.1f}', f'{p50 * 1000:.1f}'))
+        with m.app.app_context():
+            for name, fn in (('COUNT(*)', lambda: (m.db.session.query(func.count(m.User.id)).scalar(),
+                                                   m.db.session.query(func.count(m.User.id))
+                                                   .filter(m.User.is_admin == True).scalar())),  # noqa: E712
+                             ('counters', get_counts)):
+                timings = []
+                for _ in range(repeat):
+                    result = {}
+                    with timer(result):
+                        fn()
+                    timings.append(result['seconds'])
+                rows.append((size, name, '-', '-', f'{percentile(timings, 50) * 1000:.2f}'))
+    print_table(('users', 'request', 'SQL', 'KB', 'p50 ms'), rows)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', default='100000,300000', help='用户数，逗号分隔（递增）')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run([int(size) for size in args.users.split(',')], args.repeat)
+
+
+if __name__ == '__main__':
+    main()
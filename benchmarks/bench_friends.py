@@ -0,0 +1,120 @@
+"""
+好友关系基准：好友关系判断和好友列表的 SQL 数与耗时
+
+- or_query:    旧的 add_friend 查重 / 校验方式，(a=u1 AND b=u2) OR (a=u2 AND b=u1) 一次查询
+- lazy_load:   旧的好友列表构建方式，两个方向各一次查询，再逐行懒加载 friendship.user_a / user_b
+- load_friends: 一次 UNION ALL 查询读取 {friend_id: username}（FriendGraph 未命中时）
+- cached:      FriendGraph 命中，is_friend 不查库
+
+每种方式分别在没有 / 有 ix_friendship_user_b_id 索引时测量，并打印按 user_b_id 查找的查询计划。
+随机抽取的 (用户, 对方) 中一半互为好友。
+
+用法: python -m benchmarks.bench_friends --users 20000 --friends 50 --checks 2000
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import load_app, QueryCounter, percentile, print_table
+from benchmarks.datagen import friend_graph as seed_graph
+
+INDEX = 'ix_friendship_user_b_id'
+
+
+def sample_pairs(pairs, users, count, seed=7):
+    """count 个 (用户, 对方)：一半是好友（随机方向），一半是随机用户"""
+    rng = random.Random(seed)
+    pairs = list(pairs)
+    samples = []
+    for i in range(count):
+        if i % 2 == 0:
+            a, b = rng.choice(pairs)
+            samples.append((a, b) if rng.random() < 0.5 else (b, a))
+        else:
+            samples.append(tuple(rng.sample(range(1, users + 1), 2)))
+    return samples
+
+
+def or_query(m, a, b):
+    Friendship = m.Friendship
+    u1, u2 = min(a, b), max(a, b)
+    return Friendship.query.filter(
+        ((Friendship.user_a_id == u1) & (Friendship.user_b_id == u2)) |
+        ((Friendship.user_a_id == u2) & (Friendship.user_b_id == u1))
+    ).first() is not None
+
+
+def lazy_load(m, a, b):
+    Friendship = m.Friendship
+    friends = [f.user_b for f in Friendship.query.filter_by(user_a_id=a, status='Accepted').all()]
+    friends += [f.user_a for f in Friendship.query.filter_by(user_b_id=a, status='Accepted').all()]
+    return b in {friend.id for friend in friends}
+
+
+def load_friends(m, a, b):
+    from utils.friends import load_friends as load
+    return b in load(a)
+
+
+def cached(m, a, b):
+    return m.friend_graph.is_friend(a, b)
+
+
+def query_plan(m):
+    from sqlalchemy import text
+    rows = m.db.session.execute(text('EXPLAIN QUERY PLAN SELECT user_a_id FROM friendship WHERE user_b_id = 1'))
+    return '; '.join(row[-1] for row in rows)
+
+
+def measure(m, engine, check, samples):
+    m.db.session.expire_all()
+    timings = []
+    with QueryCounter(engine) as counter:
+        for a, b in samples:
+            start = time.perf_counter()
+            check(m, a, b)
+            timings.append(time.perf_counter() - start)
+            m.db.session.expunge_all()
+    return counter.count / len(samples), timings
+
+
+def run(users, friends, checks):
+    m = load_app()
+    from sqlalchemy import text
+    rows = []
+    with m.app.app_context():
+        conversations = seed_graph(m, users, friends)
+        samples = sample_pairs(conversations, users, checks)
+        engine = m.db.engine
+        for indexed in (False, True):
+            if indexed:
+                m.db.session.execute(text(f'CREATE INDEX {INDEX} ON friendship (user_b_id, user_a_id)'))
+            else:
+                m.db.session.execute(text(f'DROP INDEX IF EXISTS {INDEX}'))
+            m.db.session.execute(text('ANALYZE'))
+            m.db.session.commit()
+            print(f"{'有' if indexed else '无'}索引: {query_plan(m)}")
+            for name, check in (('or_query', or_query), ('lazy_load', lazy_load),
+                                ('load_friends', load_friends), ('cached', cached)):
+                if check is cached:
+                    m.friend_graph.invalidate(*range(1, users + 1))
+                    for a, _ in samples:
+                        m.friend_graph.friends(a)
+                statements, timings = measure(m, engine, check, samples)
+                rows.append(('yes' if indexed else 'no', name, f'{statements:.1f}',
+                             f'{percentile(timings, 50) * 1e6:.0f}', f'{percentile(timings, 95) * 1e6:.0f}'))
+    print_table(('user_b index', 'check', 'SQL/check', 'p50 us', 'p95 us'), rows)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--friends', type=int, default=50, help='每个用户的平均好友数')
+    parser.add_argument('--checks', type=int, default=2000)
+    args = parser.parse_args()
+    run(args.users, args.friends, args.checks)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+群聊扇出基准：同一条内容发给房间内 N 个成员，按房间大小对比
+
+- pairwise: 旧做法，给每个成员各发一条单聊消息（N 条 Message、N 个投递序号、N 次推送）
+- group:    一条群消息（1 条 Message、一条 CASE UPDATE 累加全体未读数、一次发到群房间）
+
+统计写入管道一次提交（含提交后的推送）执行的 SQL 语句数和耗时，以及在线成员实际收到的 receive_msg 数。
+所有成员都在线（每人一个进程内 Socket.IO 测试连接）。
+
+用法: python -m benchmarks.bench_groups --sizes 10,100,1000 --repeat 5
+"""
+import argparse
+from datetime import datetime
+
+from benchmarks.common import load_app, QueryCounter, timer, percentile, print_table
+from benchmarks.bench_inbox import DUMMY_HASH
+
+
+def seed(m, members):
+    """用户 1 与用户 2..members 互为好友，各有一个单聊会话（会话ID = 对方ID - 1）"""
+    from sqlalchemy import insert
+    db = m.db
+    db.session.execute(insert(m.User), [
+        {'id': uid, 'username': f'u{uid}', 'password_hash': DUMMY_HASH, 'is_admin': False}
+        for uid in range(1, members + 1)
+    ])
+    db.session.execute(insert(m.Friendship), [
+        {'user_a_id': 1, 'user_b_id': uid, 'status': 'Accepted'} for uid in range(2, members + 1)
+    ])
+    db.session.execute(insert(m.Conversation), [
+        {'id': uid - 1, 'user_one_id': 1, 'user_two_id': uid} for uid in range(2, members + 1)
+    ])
+    db.session.execute(insert(m.ConversationMember), [
+        {'conversation_id': uid - 1, 'user_id': user_id, 'unread_count': 0}
+        for uid in range(2, members + 1) for user_id in (1, uid)
+    ])
+    db.session.commit()
+
+
+def connect(m, user_id):
+    client = m.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    return m.socketio.test_client(m.app, flask_test_client=client)
+
+
+def new_message(m, conversation_id):
+    return m.Message(conversation_id=conversation_id, sender_id=1, content='hello everyone',
+                     type='text', is_read=False, timestamp=datetime.utcnow())
+
+
+def send_pairwise(m, members, group_id):
+    for uid in range(2, members + 1):
+        m.message_writer.submit(new_message(m, uid - 1), [uid])
+
+
+def send_group(m, members, group_id):
+    m.message_writer.submit(new_message(m, group_id), group=True)
+
+
+def received(sockets):
+    """清空并统计各连接收到的 receive_msg 数"""
+    return sum(1 for socket in sockets for packet in socket.get_received() if packet['name'] == 'receive_msg')
+
+
+def run(sizes, repeat):
+    m = load_app()
+    from utils.groups import create_group
+    rows = []
+    with m.app.app_context():
+        seed(m, max(sizes))
+        groups = {}
+        for size in sizes:
+            groups[size] = create_group(1, f'group {size}', range(2, size + 1)).id
+        m.db.session.commit()
+        engine = m.db.engine
+
+    for size in sizes:
+        # 成员连接时加入群房间；发送方也在线（群消息会推送到它自己的房间连接）
+        sockets = [connect(m, uid) for uid in range(1, size + 1)]
+        received(sockets)
+        for name, send in (('pairwise', send_pairwise), ('group', send_group)):
+            timings, statements, deliveries = [], 0, 0
+            for _ in range(repeat):
+                send(m, size, groups[size])
+                result = {}
+                with QueryCounter(engine) as counter, timer(result):
+                    m.message_writer.flush()
+                timings.append(result['seconds'])
+                statements = counter.count
+                deliveries = received(sockets)
+            rows.append((size, name, size - 1 if name == 'pairwise' else 1, statements,
+                         f'{percentile(timings, 50) * 1000:.1f}', f'{percentile(timings, 95) * 1000:.1f}',
+                         deliveries))
+        for socket in sockets:
+            socket.disconnect()
+    print_table(('members', 'mode', 'messages', 'SQL/send', 'commit+fanout p50 ms', 'p95 ms', 'receive_msg'),
+                rows)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='10,100,1000', help='房间大小（成员数，含发送方），逗号分隔')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run([int(size) for size in args.sizes.split(',')], args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+/api/history 分页基准：OFFSET 分页 vs (timestamp, id) 游标分页，随会话长度变化的单页耗时。
+
+用法: python -m benchmarks.bench_history --lengths 1000,10000,100000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import load_app, print_table
+
+DUMMY_HASH = '$2b$12$' + 'x' * 53
+PAGE = 50
+
+
+def seed_conversation(m, conversation_id, length):
+    """在一个新会话里写入 length 条消息（每秒一条）"""
+    from sqlalchemy import insert
+    db = m.db
+    db.session.execute(insert(m.Conversation), [{'id': conversation_id, 'user_one_id': 1, 'user_two_id': 2}])
+    start = datetime.utcnow() - timedelta(seconds=length)
+    batch = []
+    for i in range(length):
+        batch.append({'conversation_id': conversation_id, 'sender_id': 1 + i % 2,
+                      'content': f'message {i}', 'type': 'text',
+                      'timestamp': start + timedelta(seconds=i), 'is_read': True})
+        if len(batch) == 10000:
+            db.session.execute(insert(m.Message), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(m.Message), batch)
+    db.session.commit()
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def run(lengths, repeat):
+    m = load_app()
+    from utils.history import fetch_page, encode_cursor
+    Message = m.Message
+    rows = []
+    with m.app.app_context():
+        m.db.session.add_all([m.User(id=1, username='a', password_hash=DUMMY_HASH),
+                              m.User(id=2, username='b', password_hash=DUMMY_HASH)])
+        m.db.session.commit()
+        for cid, length in enumerate(lengths, start=1):
+            seed_conversation(m, cid, length)
+            middle = length // 2
+
+            def offset_newest():
+                Message.query.filter_by(conversation_id=cid)\
+                    .order_by(Message.timestamp.desc()).offset(0).limit(PAGE).all()
+
+            def offset_middle():
+                Message.query.filter_by(conversation_id=cid)\
+                    .order_by(Message.timestamp.desc()).offset(middle).limit(PAGE).all()
+
+            anchor = Message.query.filter_by(conversation_id=cid)\
+                .order_by(Message.timestamp.desc()).offset(middle).first()
+            cursor = encode_cursor(anchor)
+
+            rows.append((length, 'offset newest', f'{best_of(offset_newest, repeat):.2f}'))
+            rows.append((length, 'offset middle', f'{best_of(offset_middle, repeat):.2f}'))
+            rows.append((length, 'keyset newest', f'{best_of(lambda: fetch_page(cid), repeat):.2f}'))
+            rows.append((length, 'keyset middle', f'{best_of(lambda: fetch_page(cid, before=cursor), repeat):.2f}'))
+    print_table(('messages', 'page', 'ms'), rows)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lengths', default='1000,10000,100000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run([int(x) for x in args.lengths.split(',')], args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+会话列表（/api/friends）基准：旧的逐好友 N+1 查询 vs 集合查询 build_inbox。
+
+用法: python -m benchmarks.bench_inbox --friends 100,500,1000,2000,5000 --messages 5
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from benchmarks.common import load_app, QueryCounter, timer, print_table
+
+# 固定的 bcrypt 哈希，避免造数时逐个计算
+DUMMY_HASH = '$2b$12$' + 'x' * 53
+
+
+def seed_friends(m, owner_id, start, stop, messages_per_conv):
+    """为 owner 追加 [start, stop) 号好友，每个好友一条会话和若干消息"""
+    from sqlalchemy import insert
+    db = m.db
+    now = datetime.utcnow()
+    db.session.execute(insert(m.User), [
+        {'id': uid, 'username': f'u{uid}', 'password_hash': DUMMY_HASH, 'is_admin': False}
+        for uid in range(start, stop)
+    ])
+    db.session.execute(insert(m.Friendship), [
+        {'user_a_id': min(owner_id, uid), 'user_b_id': max(owner_id, uid), 'status': 'Accepted'}
+        for uid in range(start, stop)
+    ])
+    db.session.execute(insert(m.Conversation), [
+        {'id': uid, 'user_one_id': min(owner_id, uid), 'user_two_id': max(owner_id, uid),
+         'last_message_at': now}
+        for uid in range(start, stop)
+    ])
+    rows = []
+    for uid in range(start, stop):
+        for i in range(messages_per_conv):
+            rows.append({
+                'conversation_id': uid,
+                'sender_id': random.choice((owner_id, uid)),
+                'content': f'message {i} from {uid}',
+                'type': 'text',
+                'timestamp': now - timedelta(seconds=random.randint(0, 86400)),
+                'is_read': random.random() < 0.5,
+            })
+    if rows:
+        db.session.execute(insert(m.Message), rows)
+    db.session.commit()
+    # 造数绕过了发送路径，用对账命令生成会话摘要
+    from utils.summary import rebuild_summaries
+    rebuild_summaries()
+
+
+def legacy_inbox(m, user_id):
+    """旧版 get_friends 的查询模式（会话已存在，因此不会写库）"""
+    Friendship, Message = m.Friendship, m.Message
+    friends = [f.user_b for f in Friendship.query.filter_by(user_a_id=user_id, status='Accepted').all()]
+    friends += [f.user_a for f in Friendship.query.filter_by(user_b_id=user_id, status='Accepted').all()]
+    results = []
+    for friend in friends:
+        u1, u2 = min(user_id, friend.id), max(user_id, friend.id)
+        conv = m.Conversation.query.filter_by(user_one_id=u1, user_two_id=u2).first()
+        last_message = Message.query.filter_by(conversation_id=conv.id)\
+            .order_by(Message.timestamp.desc()).first()
+        unread_count = Message.query.filter_by(conversation_id=conv.id, is_read=False,
+                                               sender_id=friend.id).count()
+        results.append((conv.id, friend.id, last_message and last_message.content, unread_count))
+    return results
+
+
+def run(friend_counts, messages_per_conv, repeat):
+    m = load_app()
+    from utils.inbox import build_inbox
+    rows = []
+    with m.app.app_context():
+        engine = m.db.engine
+        m.db.session.add(m.User(id=1, username='owner', password_hash=DUMMY_HASH))
+        m.db.session.commit()
+        seeded = 0
+        for count in friend_counts:
+            seed_friends(m, 1, seeded + 2, count + 2, messages_per_conv)
+            seeded = count
+            for name, fn in (('legacy', legacy_inbox), ('build_inbox', lambda mod, uid: build_inbox(uid))):
+                best = None
+                for _ in range(repeat):
+                    m.db.session.expire_all()
+                    result = {}
+                    with QueryCounter(engine) as counter, timer(result):
+                        fn(m, 1)
+                    if best is None or result['seconds'] < best[1]:
+                        best = (counter.count, result['seconds'])
+                rows.append((count, name, best[0], f'{best[1] * 1000:.1f}'))
+    print_table(('friends', 'impl', 'queries', 'ms'), rows)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--friends', default='100,500,1000,2000,5000')
+    parser.add_argument('--messages', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run([int(x) for x in args.friends.split(',')], args.messages, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+清空大会话对其他写入的影响：旧版在一个事务中删除整个会话的消息 vs 后台任务按 JOB_CHUNK_SIZE 分段删除。
+
+在 --messages 条消息的会话上执行清空，同时另一个进程不停向其他会话写入消息（每条一个事务），
+统计清空耗时、最长的单个删除事务，以及并发写入的 p50 / p99 / 最大延迟。
+
+用法: python -m benchmarks.bench_jobs --messages 200000 --chunk 500
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import ROOT, load_app, percentile, print_table
+from benchmarks.bench_inbox import DUMMY_HASH
+from benchmarks.bench_db import make_engine
+
+
+def seed(m):
+    """会话 1 为待清空的大会话，会话 2 供并发写入"""
+    from sqlalchemy import insert
+    m.db.session.execute(insert(m.User), [
+        {'id': uid, 'username': f'u{uid}', 'password_hash': DUMMY_HASH, 'is_admin': False} for uid in (1, 2, 3)
+    ])
+    m.db.session.execute(insert(m.Conversation), [
+        {'id': 1, 'user_one_id': 1, 'user_two_id': 2}, {'id': 2, 'user_one_id': 1, 'user_two_id': 3}
+    ])
+    m.db.session.commit()
+
+
+def fill(m, messages):
+    """向会话 1 写入 messages 条消息并建立索引和摘要（清除上一轮写进程的消息）"""
+    from sqlalchemy import insert
+    m.Message.query.filter_by(conversation_id=2).delete()
+    from utils.search import rebuild_index
+    from utils.summary import rebuild_summaries
+    start = datetime.utcnow() - timedelta(days=30)
+    for first in range(1, messages + 1, 50000):
+        m.db.session.execute(insert(m.Message), [
+            {'id': i, 'conversation_id': 1, 'sender_id': 1 + i % 2, 'content': f'message {i}', 'type': 'text',
+             'is_read': False, 'timestamp': start + timedelta(milliseconds=i)}
+            for i in range(first, min(first + 50000, messages + 1))
+        ])
+        m.db.session.commit()
+    rebuild_index()
+    rebuild_summaries()
+
+
+def writer(url, stop_file, out_file):
+    """写进程：向会话 2 不停写入消息直到 stop_file 出现，把每个事务的耗时写入 out_file"""
+    from sqlalchemy import insert
+    from models import Message
+    engine = make_engine('sqlite WAL', url)
+    latencies = []
+    n = 10 ** 9
+    while not os.path.exists(stop_file):
+        n += 1
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            conn.execute(insert(Message.__table__).values(
+                id=n, conversation_id=2, sender_id=1, content='x', type='text',
+                timestamp=datetime.utcnow(), is_read=False))
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.005)
+    engine.dispose()
+    with open(out_file, 'w') as f:
+        json.dump(latencies, f)
+
+
+def legacy_clear(m):
+    """旧版 clear_history：一个事务删除全部消息"""
+    from utils.search import FTS_TABLE
+    start = time.perf_counter()
+    m.db.session.execute(m.db.text(
+        f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT id FROM message WHERE conversation_id = 1)"))
+    m.Message.query.filter_by(conversation_id=1).delete()
+    m.db.session.commit()
+    elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, elapsed
+
+
+def job_clear(m, chunk):
+    """后台任务的步骤逐段执行，记录最长的单段事务"""
+    from utils.jobs import JOB_STEPS
+    from models import Job
+    m.job_runner.chunk_size = chunk
+    cutoff = m.db.session.query(m.db.func.max(m.Message.id)).filter_by(conversation_id=1).scalar()
+    job = Job(kind='clear_history', target_id=1, cutoff_id=cutoff)
+    m.db.session.add(job)
+    m.db.session.commit()
+    longest = 0
+    start = time.perf_counter()
+    for name, fn in JOB_STEPS[job.kind]:
+        while True:
+            chunk_start = time.perf_counter()
+            done = fn(m.job_runner, job, chunk)
+            m.db.session.commit()
+            longest = max(longest, (time.perf_counter() - chunk_start) * 1000)
+            if not done:
+                break
+            time.sleep(m.job_runner.chunk_pause)
+    return (time.perf_counter() - start) * 1000, longest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--chunk', type=int, default=500)
+    parser.add_argument('--writer', nargs=3, metavar=('URL', 'STOP_FILE', 'OUT_FILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.writer:
+        return writer(*args.writer)
+
+    # 写进程单独启动（app 已 monkey_patch，不能 fork）
+    work_dir = tempfile.mkdtemp(prefix='lightchat-jobs-')
+    db_path = os.path.join(work_dir, 'bench.db')
+    m = load_app(db_path)
+    rows = []
+    with m.app.app_context():
+        seed(m)
+        for name in ('legacy single transaction', 'chunked job'):
+            fill(m, args.messages)
+            stop_file = os.path.join(work_dir, 'stop')
+            out_file = os.path.join(work_dir, 'writes.json')
+            proc = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_jobs', '--writer',
+                                     'sqlite:///' + db_path, stop_file, out_file], cwd=ROOT)
+            time.sleep(2)
+            if name == 'chunked job':
+                total_ms, longest_ms = job_clear(m, args.chunk)
+            else:
+                total_ms, longest_ms = legacy_clear(m)
+            time.sleep(0.5)
+            open(stop_file, 'w').close()
+            if proc.wait() != 0:
+                raise RuntimeError('写进程异常退出')
+            os.remove(stop_file)
+            with open(out_file) as f:
+                write_ms = json.load(f)
+            rows.append((name, args.messages, f'{total_ms:.0f}', f'{longest_ms:.0f}', len(write_ms),
+                         f'{percentile(write_ms, 50):.1f}', f'{percentile(write_ms, 99):.1f}',
+                         f'{max(write_ms):.0f}'))
+    print_table(('impl', 'messages', 'clear ms', 'longest txn ms', 'writes', 'write p50 ms', 'write p99 ms',
+                 'write max ms'), rows)
+    m.message_writer.stop()
+    m.receipts.stop()
+    return rows
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+登录风暴基准：大量用户同时登录时，已连接用户的消息往返延迟。
+
+启动一个 app.py 进程，--probes 个已登录的探测连接每 100ms 发送一条消息并等待服务器回显（receive_msg），
+同时 --storm 个线程在 --seconds 秒内不停登录。对比：
+- inline:      AUTH_HASH_WORKERS=0，bcrypt 在请求协程中计算（旧行为，计算期间 hub 上所有连接停顿）
+- thread pool: bcrypt 在原生线程中计算（默认）
+
+密码哈希使用 --rounds 轮（Flask-Bcrypt 默认 12）。客户端需要 pip install "python-socketio[client]"
+
+用法: python -m benchmarks.bench_login --storm 20 --probes 5 --seconds 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import bcrypt
+import requests
+import socketio
+
+from benchmarks.common import ROOT, load_app, percentile, print_table
+from benchmarks.bench_cluster import wait_for_port, stop_processes
+
+PORT = 5150
+PROBE_INTERVAL = 0.1
+
+
+def seed(m, probes, storm, rounds):
+    """探测用户两两互为好友，风暴用户只用于登录"""
+    password_hash = bcrypt.hashpw(b'pw', bcrypt.gensalt(rounds)).decode()
+    with m.app.app_context():
+        users = [m.User(username=f'probe{k}', password_hash=password_hash) for k in range(probes * 2)]
+        users += [m.User(username=f'storm{k}', password_hash=password_hash) for k in range(storm)]
+        m.db.session.add_all(users)
+        m.db.session.commit()
+        pairs = []
+        for k in range(probes):
+            a, b = users[2 * k], users[2 * k + 1]
+            m.db.session.add(m.Friendship(user_a_id=a.id, user_b_id=b.id, status='Accepted'))
+            m.db.session.commit()
+            m.get_or_create_conversation_id(a.id, b.id)
+            pairs.append((a.id, a.username, b.id))
+    return pairs
+
+
+class Probe:
+    """已登录的连接：发送带时间戳的消息，记录服务器回显的往返延迟"""
+
+    def __init__(self, base_url, user_id, username, receiver_id):
+        http = requests.Session()
+        http.post(base_url + '/api/auth/login', json={'username': username, 'password': 'pw'}).raise_for_status()
+        self.user_id = user_id
+        self.receiver_id = receiver_id
+        self.latencies = []
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('receive_msg', self._on_receive)
+        self.sio.connect(base_url, headers={'Cookie': '; '.join(f'{k}={v}' for k, v in http.cookies.items())},
+                         transports=['websocket'], wait_timeout=10)
+
+    def _on_receive(self, data):
+        if data['sender_id'] == self.user_id:
+            self.latencies.append((time.time() - float(data['content'])) * 1000)
+
+    def run(self, stop):
+        while not stop.is_set():
+            self.sio.emit('send_msg', {'receiver_id': self.receiver_id, 'content': repr(time.time())})
+            time.sleep(PROBE_INTERVAL)
+
+
+def storm_worker(base_url, usernames, stop, results):
+    """不停地登录（每次新会话）"""
+    logins, latencies = 0, []
+    http = requests.Session()
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        resp = http.post(base_url + '/api/auth/login', json={'username': usernames[i % len(usernames)], 'password': 'pw'})
+        if resp.status_code == 200:
+            logins += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+        http.cookies.clear()
+        i += 1
+    results.append((logins, latencies))
+
+
+def run_once(name, workers, db_path, pairs, storm, seconds, log_dir):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + db_path, AUTH_HASH_WORKERS=str(workers),
+               SERVER_HOST='127.0.0.1', SERVER_PORT=str(PORT), SERVER_DEBUG='0')
+    log = open(os.path.join(log_dir, f'{name.replace(" ", "_")}.log'), 'w')
+    procs = [subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)]
+    base_url = f'http://127.0.0.1:{PORT}'
+    probes = []
+    try:
+        wait_for_port('127.0.0.1', PORT)
+        probes = [Probe(base_url, *pair) for pair in pairs]
+        stop = threading.Event()
+        results = []
+        threads = [threading.Thread(target=p.run, args=(stop,)) for p in probes]
+        threads += [threading.Thread(target=storm_worker, args=(base_url, [f'storm{k}' for k in range(storm)], stop, results))
+                    for _ in range(storm)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        time.sleep(0.5)
+    finally:
+        for probe in probes:
+            if probe.sio.connected:
+                probe.sio.disconnect()
+        stop_processes(procs)
+
+    probe_ms = [v for p in probes for v in p.latencies]
+    login_ms = [v for _, latencies in results for v in latencies]
+    logins = sum(n for n, _ in results)
+    return (name, storm, f'{logins / seconds:.1f}', f'{percentile(login_ms, 99):.0f}',
+            len(probe_ms), f'{percentile(probe_ms, 50):.1f}', f'{percentile(probe_ms, 99):.1f}',
+            f'{max(probe_ms or [0]):.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--storm', type=int, default=20, help='并发登录线程数')
+    parser.add_argument('--probes', type=int, default=5, help='测量延迟的已连接用户数')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt 轮数')
+    parser.add_argument('--workers', type=int, default=2, help='thread pool 模式的 AUTH_HASH_WORKERS')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='lightchat-login-')
+    db_path = os.path.join(work_dir, 'bench.db')
+    m = load_app(db_path)
+    pairs = seed(m, args.probes, args.storm, args.rounds)
+    rows = [run_once(name, workers, db_path, pairs, args.storm, args.seconds, work_dir)
+            for name, workers in (('inline', 0), ('thread pool', args.workers))]
+    print_table(('mode', 'storm', 'logins/s', 'login p99 ms', 'probe msgs', 'probe p50 ms', 'probe p99 ms',
+                 'probe max ms'), rows)
+    print(f"服务日志: {work_dir}")
+    return rows
+
+
+if __name__ == '__main__':
+    main()
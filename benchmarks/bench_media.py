@@ -0,0 +1,131 @@
+"""
+图片重复浏览基准：模拟聊天界面反复滚动浏览同一批图片，按浏览器缓存语义统计请求数、传输字节和服务端耗时。
+
+- before: 旧的 send_from_directory 默认响应头（无 max-age，每次浏览都要请求；
+  "无缓存" 行为整图重传，"重新验证" 行为带 If-None-Match 得到 304）
+- after:  /media 路由（内容哈希 ETag + Cache-Control: immutable），聊天界面显示缩略图
+
+用法: python -m benchmarks.bench_media --images 20 --views 10
+"""
+import argparse
+import io
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import load_app, percentile, print_table
+
+
+class BrowserCache:
+    """按 Cache-Control max-age / ETag 行为模拟浏览器缓存"""
+
+    def __init__(self, client, revalidate=True):
+        self.client = client
+        self.revalidate = revalidate
+        self.entries = {}
+        self.requests = 0
+        self.bytes = 0
+        self.latencies = []
+
+    def view(self, url):
+        entry = self.entries.get(url)
+        if entry and entry['expires'] > time.time():
+            return  # 命中新鲜缓存，不发请求
+        headers = {}
+        if entry and self.revalidate and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        start = time.perf_counter()
+        resp = self.client.get(url, headers=headers)
+        data = resp.data
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        self.requests += 1
+        self.bytes += len(data)
+        if not self.revalidate:
+            return
+        match = re.search(r'max-age=(\d+)', resp.headers.get('Cache-Control', ''))
+        max_age = int(match.group(1)) if match else 0
+        if resp.status_code == 200:
+            self.entries[url] = {'etag': resp.headers.get('ETag'), 'expires': time.time() + max_age}
+        elif resp.status_code == 304:
+            entry['expires'] = time.time() + max_age
+
+
+def make_image(size):
+    """生成一张随机噪点 JPEG（压缩率接近照片）"""
+    from PIL import Image
+    img = Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=85)
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--views', type=int, default=10, help='每张图片被浏览的次数')
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=1200)
+    args = parser.parse_args()
+
+    # 上传目录是相对当前目录的路径，放到临时目录中
+    work_dir = tempfile.mkdtemp(prefix='lightchat-media-')
+    os.chdir(work_dir)
+    m = load_app(os.path.join(work_dir, 'bench.db'))
+    from flask import send_from_directory
+
+    # 旧版处理函数，作为对照
+    @m.app.route('/bench/legacy/<filename>')
+    def legacy_image(filename):
+        return send_from_directory(os.path.abspath(m.app.config['UPLOAD_FOLDER']), filename)
+
+    client = m.app.test_client()
+    client.post('/api/auth/register', json={'username': 'viewer', 'password': 'pw'})
+    client.post('/api/auth/login', json={'username': 'viewer', 'password': 'pw'})
+
+    legacy_urls, original_urls, thumb_urls = [], [], []
+    os.makedirs(m.app.config['UPLOAD_FOLDER'], exist_ok=True)
+    for i in range(args.images):
+        data = make_image((args.width, args.height))
+        resp = client.post('/api/upload/image', data={'image': (io.BytesIO(data), f'{i}.jpg')},
+                           content_type='multipart/form-data').json
+        original_urls.append(resp['image_url'])
+        thumb_urls.append(resp['thumbnail_url'])
+        name = f'legacy-{i}.jpg'
+        with open(os.path.join(m.app.config['UPLOAD_FOLDER'], name), 'wb') as f:
+            f.write(data)
+        legacy_urls.append(f'/bench/legacy/{name}')
+    # 等待后台缩略图生成完成
+    for url in thumb_urls:
+        client.get(url)
+
+    scenarios = (
+        ('before: send_from_directory, no cache', legacy_urls, False),
+        ('before: send_from_directory, revalidate', legacy_urls, True),
+        ('after: /media original, immutable', original_urls, True),
+        ('after: /media thumbnail, immutable', thumb_urls, True),
+    )
+    rows = []
+    for name, urls, revalidate in scenarios:
+        cache = BrowserCache(client, revalidate=revalidate)
+        start = time.perf_counter()
+        for _ in range(args.views):
+            for url in urls:
+                cache.view(url)
+        elapsed = (time.perf_counter() - start) * 1000
+        rows.append((name, cache.requests, f'{cache.bytes / 1024 / 1024:.2f}',
+                     f'{percentile(cache.latencies, 50):.2f}', f'{percentile(cache.latencies, 99):.2f}',
+                     f'{elapsed:.0f}'))
+    print_table(('scenario', 'requests', 'MB transferred', 'p50 ms', 'p99 ms', 'total ms'), rows)
+
+    # Range 请求：只取前 64KB
+    resp = client.get(original_urls[0], headers={'Range': 'bytes=0-65535'})
+    print(f"Range 请求: {resp.status_code} {resp.headers.get('Content-Range')} ({len(resp.data)} 字节)")
+    m.message_writer.stop()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return rows
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+运行指标的开销：每个请求 / 事件上指标钩子的耗时，与请求本身的耗时对比。
+
+在临时库上用 Flask / Socket.IO 测试客户端执行（METRICS_ENABLED=1）：
+- GET /api/friends（--friends 个好友）
+- send_msg 事件（写入管道入队，不等待提交）
+- GET /metrics
+各 --requests 次，统计平均 / p50 / p99，以及每次执行的 SQL 条数。
+再单独循环调用同样次数的钩子（请求前后 + 每条 SQL 前后，或事件入口包装），得到每个请求的指标开销。
+不同进程之间的耗时波动（约 ±0.5ms）大于指标本身的开销，因此不对比 METRICS_ENABLED=0 的进程。
+
+用法: python -m benchmarks.bench_metrics --requests 5000
+"""
+import argparse
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from benchmarks.common import QueryCounter, load_app, percentile, print_table
+
+
+def seed(m, friends):
+    from sqlalchemy import insert
+    client = m.app.test_client()
+    client.post('/api/auth/register', json={'username': 'u0', 'password': 'pw'})
+    client.post('/api/auth/login', json={'username': 'u0', 'password': 'pw'})
+    with m.app.app_context():
+        m.db.session.execute(insert(m.User), [
+            {'id': uid, 'username': f'u{uid}', 'password_hash': 'x', 'is_admin': False} for uid in range(2, friends + 2)
+        ])
+        m.db.session.execute(insert(m.Friendship), [
+            {'user_a_id': 1, 'user_b_id': uid, 'status': 'Accepted'} for uid in range(2, friends + 2)
+        ])
+        m.db.session.commit()
+    return client
+
+
+def measure(m, fn, requests):
+    """返回 (各次耗时 ms, 每次的 SQL 条数)"""
+    with m.app.app_context():
+        engine = m.db.engine
+    with QueryCounter(engine) as counter:
+        fn()
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, counter.count
+
+
+def http_hook_us(m, path, queries, requests):
+    """一个 HTTP 请求上的全部指标钩子（请求前后 + 每条 SQL 前后）的耗时（微秒）"""
+    metrics = m.metrics
+    response = m.app.response_class()
+    conn = SimpleNamespace(info={})
+    with m.app.test_request_context(path):
+        start = time.perf_counter()
+        for _ in range(requests):
+            metrics._before_request()
+            for _ in range(queries):
+                metrics._before_cursor_execute(conn, None, 'SELECT 1', None, None, False)
+                metrics._after_cursor_execute(conn, None, 'SELECT 1', None, None, False)
+            metrics._after_request(response)
+            metrics._teardown_request(None)
+        return (time.perf_counter() - start) / requests * 1e6
+
+
+def event_hook_us(m, event, queries, requests):
+    """Socket.IO 事件入口包装（含每条 SQL 前后的钩子）的耗时（微秒）"""
+    metrics = m.metrics
+    conn = SimpleNamespace(info={})
+
+    def handle_event(handler, message, namespace, sid):
+        for _ in range(queries):
+            metrics._before_cursor_execute(conn, None, 'SELECT 1', None, None, False)
+            metrics._after_cursor_execute(conn, None, 'SELECT 1', None, None, False)
+
+    socketio = SimpleNamespace(_handle_event=handle_event)
+    metrics._wrap_socketio(socketio)
+    start = time.perf_counter()
+    for _ in range(requests):
+        socketio._handle_event(None, event, '/', 'sid')
+    wrapped = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(requests):
+        handle_event(None, event, '/', 'sid')
+    return (wrapped - (time.perf_counter() - start)) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--friends', type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ['METRICS_ENABLED'] = '1'
+    m = load_app(os.path.join(tempfile.mkdtemp(prefix='lightchat-metrics-'), 'bench.db'))
+    client = seed(m, args.friends)
+    socket = m.socketio.test_client(m.app, flask_test_client=client)
+    cases = (
+        ('GET /api/friends', lambda: client.get('/api/friends'),
+         lambda q: http_hook_us(m, '/api/friends', q, args.requests)),
+        ('send_msg', lambda: socket.emit('send_msg', {'receiver_id': 2, 'content': 'hello'}),
+         lambda q: event_hook_us(m, 'send_msg', q, args.requests)),
+        ('GET /metrics', lambda: client.get('/metrics'),
+         lambda q: http_hook_us(m, '/metrics', q, args.requests)),
+    )
+    rows = []
+    for name, fn, hook in cases:
+        latencies, queries = measure(m, fn, args.requests)
+        mean = sum(latencies) / len(latencies)
+        overhead = hook(queries)
+        rows.append((name, len(latencies), queries, f'{mean:.3f}', f'{percentile(latencies, 50):.3f}',
+                     f'{percentile(latencies, 99):.3f}', f'{overhead:.1f}', f'{overhead / 10 / mean:.2f}%'))
+    socket.disconnect()
+    m.message_writer.stop()
+    m.receipts.stop()
+    print_table(('request', 'n', 'sql', 'mean ms', 'p50 ms', 'p99 ms', 'metrics us', 'share'), rows)
+    return rows
+
+
+if __name__ == '__main__':
+    main()
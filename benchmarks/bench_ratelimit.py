@@ -0,0 +1,197 @@
+"""
+限流与背压基准：刷屏客户端和不读取的慢连接对正常用户消息延迟、服务端内存的影响。
+
+启动一个 app.py 进程：
+- --probes 对正常用户，每 250ms 发送一条消息并等待服务器回显（receive_msg），记录往返延迟
+- --flooders 个刷屏用户，每个以 --flood-rate 条/秒向自己的好友发送 --size 字节的消息
+- 刷屏用户的好友是慢连接：完成 WebSocket 握手后不再读取，服务端发给它的包全部积压在发送队列中
+对比：
+- unlimited: RATE_LIMIT_SOCKET / RATE_LIMIT_SEND_MSG = 0、OUTBOUND_HARD_LIMIT = 0（旧行为）
+- limited:   默认的限流和出站队列上限
+统计刷屏消息被接受的数量、探测延迟、服务进程的内存峰值（VmHWM），以及 /api/admin/stats 中的限流 / 背压计数。
+
+客户端需要 pip install "python-socketio[client]"（含 websocket-client）
+
+用法: python -m benchmarks.bench_ratelimit --flooders 5 --probes 5 --seconds 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import bcrypt
+import requests
+import socketio
+import websocket
+
+from benchmarks.common import ROOT, NO_RATE_LIMITS, load_app, percentile, print_table
+from benchmarks.bench_cluster import wait_for_port, stop_processes
+from benchmarks.bench_login import Probe
+
+PORT = 5160
+# 正常用户的发送间隔（低于默认的每用户 5 条/秒）
+PROBE_INTERVAL = 0.25
+
+
+def seed(m, probes, flooders):
+    """探测用户两两互为好友；刷屏用户与各自的慢连接用户互为好友；admin 用于读取统计"""
+    password_hash = bcrypt.hashpw(b'pw', bcrypt.gensalt(4)).decode()
+    with m.app.app_context():
+        users = [m.User(username='admin', password_hash=password_hash, is_admin=True)]
+        users += [m.User(username=f'probe{k}', password_hash=password_hash) for k in range(probes * 2)]
+        users += [m.User(username=f'flood{k}', password_hash=password_hash) for k in range(flooders)]
+        users += [m.User(username=f'slow{k}', password_hash=password_hash) for k in range(flooders)]
+        m.db.session.add_all(users)
+        m.db.session.commit()
+        by_name = {u.username: u for u in users}
+        pairs = [(by_name[f'probe{2 * k}'], by_name[f'probe{2 * k + 1}']) for k in range(probes)]
+        floods = [(by_name[f'flood{k}'], by_name[f'slow{k}']) for k in range(flooders)]
+        for a, b in pairs + floods:
+            m.db.session.add(m.Friendship(user_a_id=a.id, user_b_id=b.id, status='Accepted'))
+            m.db.session.commit()
+            m.get_or_create_conversation_id(a.id, b.id)
+        return ([(a.id, a.username, b.id) for a, b in pairs],
+                [(a.username, b.id, b.username) for a, b in floods])
+
+
+def login(base_url, username):
+    http = requests.Session()
+    http.post(base_url + '/api/auth/login', json={'username': username, 'password': 'pw'}).raise_for_status()
+    return http
+
+
+def cookie_header(http):
+    return '; '.join(f'{k}={v}' for k, v in http.cookies.items())
+
+
+class Flooder:
+    """刷屏用户：按固定速率发送消息，统计服务器回显（被接受）的条数和 rate_limited 通知"""
+
+    def __init__(self, base_url, username, receiver_id):
+        self.receiver_id = receiver_id
+        self.sent = 0
+        self.accepted = 0
+        self.notices = 0
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('receive_msg', self._on_receive)
+        self.sio.on('rate_limited', self._on_rate_limited)
+        self.sio.connect(base_url, headers={'Cookie': cookie_header(login(base_url, username))},
+                         transports=['websocket'], wait_timeout=10)
+
+    def _on_receive(self, data):
+        self.accepted += 1
+
+    def _on_rate_limited(self, data):
+        self.notices += 1
+
+    def run(self, stop, rate, size):
+        content = 'x' * size
+        interval = 1.0 / rate
+        next_at = time.perf_counter()
+        while not stop.is_set():
+            self.sio.emit('send_msg', {'receiver_id': self.receiver_id, 'content': content})
+            self.sent += 1
+            next_at += interval
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+
+
+def slow_consumer(base_url, username):
+    """完成 engine.io / Socket.IO 握手后不再读取的 WebSocket 连接"""
+    ws = websocket.create_connection(
+        base_url.replace('http://', 'ws://') + '/socket.io/?EIO=4&transport=websocket',
+        cookie=cookie_header(login(base_url, username)), timeout=10)
+    ws.recv()  # engine.io open
+    ws.send('40')
+    ws.recv()  # Socket.IO connect
+    return ws
+
+
+def probe_loop(probe, stop):
+    while not stop.is_set():
+        probe.sio.emit('send_msg', {'receiver_id': probe.receiver_id, 'content': repr(time.time())})
+        time.sleep(PROBE_INTERVAL)
+
+
+def peak_rss_mb(pid):
+    """进程的内存峰值（Linux /proc）"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def run_once(name, overrides, db_path, pairs, floods, args, log_dir):
+    # load_app 关闭了全部限流：这里只保留按 IP 的登录限流关闭（所有客户端来自本机），其余按 overrides 或默认值
+    env = {k: v for k, v in os.environ.items() if k not in NO_RATE_LIMITS}
+    env.update(DATABASE_URL='sqlite:///' + db_path, SERVER_HOST='127.0.0.1', SERVER_PORT=str(PORT), SERVER_DEBUG='0',
+               RATE_LIMIT_LOGIN='0', **overrides)
+    log = open(os.path.join(log_dir, f'{name}.log'), 'w')
+    procs = [subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)]
+    base_url = f'http://127.0.0.1:{PORT}'
+    probes, flooders, consumers = [], [], []
+    try:
+        wait_for_port('127.0.0.1', PORT)
+        consumers = [slow_consumer(base_url, slow_name) for _, _, slow_name in floods]
+        flooders = [Flooder(base_url, flood_name, slow_id) for flood_name, slow_id, _ in floods]
+        probes = [Probe(base_url, *pair) for pair in pairs]
+        stop = threading.Event()
+        threads = [threading.Thread(target=probe_loop, args=(p, stop)) for p in probes]
+        threads += [threading.Thread(target=f.run, args=(stop, args.flood_rate, args.size)) for f in flooders]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        time.sleep(0.5)
+        stats = login(base_url, 'admin').get(base_url + '/api/admin/stats').json()
+        rss = peak_rss_mb(procs[0].pid)
+    finally:
+        for client in probes + flooders:
+            if client.sio.connected:
+                client.sio.disconnect()
+        for ws in consumers:
+            ws.close()
+        stop_processes(procs)
+
+    probe_ms = [v for p in probes for v in p.latencies]
+    limit, outbound = stats.get('rate_limit', {}), stats.get('outbound', {})
+    return (name, sum(f.sent for f in flooders), sum(f.accepted for f in flooders),
+            limit.get('send_msg_throttled', 0) + limit.get('socket_throttled', 0),
+            outbound.get('max_depth', '-'), outbound.get('slow_disconnects', '-'), f'{rss:.0f}',
+            len(probe_ms), f'{percentile(probe_ms, 50):.1f}', f'{percentile(probe_ms, 99):.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--flooders', type=int, default=5, help='刷屏用户数（每个对应一个慢连接）')
+    parser.add_argument('--flood-rate', type=float, default=50, help='每个刷屏用户每秒发送的消息数')
+    parser.add_argument('--size', type=int, default=2000, help='刷屏消息的字节数')
+    parser.add_argument('--probes', type=int, default=5, help='测量延迟的正常用户对数')
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='lightchat-ratelimit-')
+    db_path = os.path.join(work_dir, 'bench.db')
+    m = load_app(db_path)
+    pairs, floods = seed(m, args.probes, args.flooders)
+    modes = (
+        ('unlimited', {'RATE_LIMIT_SOCKET': '0', 'RATE_LIMIT_SEND_MSG': '0', 'OUTBOUND_HARD_LIMIT': '0'}),
+        ('limited', {}),
+    )
+    rows = [run_once(name, overrides, db_path, pairs, floods, args, work_dir) for name, overrides in modes]
+    print_table(('mode', 'flood sent', 'flood accepted', 'throttled', 'max queue', 'slow disconnects',
+                 'server peak MB', 'probe msgs', 'probe p50 ms', 'probe p99 ms'), rows)
+    print(f"服务日志: {work_dir}")
+    return rows
+
+
+if __name__ == '__main__':
+    main()
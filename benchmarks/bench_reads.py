@@ -0,0 +1,99 @@
+"""
+已读状态基准：旧版每次加载历史都 UPDATE is_read + commit，vs 已读水位在内存中合并后批量落库。
+
+模拟 --users 个用户各自在一个会话中反复打开历史 / 收到新消息并报告已读（共 --events 次）。
+
+用法: python -m benchmarks.bench_reads --users 100 --events 5000
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from benchmarks.common import load_app, QueryCounter, timer, print_table
+from benchmarks.bench_inbox import DUMMY_HASH
+
+
+def seed(m, users, messages):
+    """用户 2k-1 与 2k 互为好友，每个会话 messages 条消息"""
+    from sqlalchemy import insert
+    db = m.db
+    db.session.execute(insert(m.User), [
+        {'id': uid, 'username': f'u{uid}', 'password_hash': DUMMY_HASH, 'is_admin': False}
+        for uid in range(1, users + 1)
+    ])
+    convs = [(uid, uid + 1) for uid in range(1, users, 2)]
+    db.session.execute(insert(m.Conversation), [
+        {'id': i, 'user_one_id': a, 'user_two_id': b} for i, (a, b) in enumerate(convs, 1)
+    ])
+    now = datetime.utcnow()
+    msg_id = 0
+    rows = []
+    for i, (a, b) in enumerate(convs, 1):
+        for n in range(messages):
+            msg_id += 1
+            rows.append({'id': msg_id, 'conversation_id': i, 'sender_id': random.choice((a, b)),
+                         'content': f'message {n}', 'type': 'text', 'is_read': False,
+                         'timestamp': now + timedelta(milliseconds=msg_id)})
+    db.session.execute(insert(m.Message), rows)
+    db.session.commit()
+    from utils.summary import rebuild_summaries
+    rebuild_summaries()
+    return convs
+
+
+def legacy_read(m, conv_id, user_id, message_id):
+    """旧版 get_history 的已读处理"""
+    from models import ConversationMember
+    m.Message.query.filter_by(conversation_id=conv_id, is_read=False)\
+        .filter(m.Message.sender_id != user_id)\
+        .update({'is_read': True})
+    ConversationMember.query.filter_by(conversation_id=conv_id, user_id=user_id)\
+        .update({'unread_count': 0}, synchronize_session=False)
+    m.db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=200, help='每个会话的消息数')
+    parser.add_argument('--events', type=int, default=5000, help='已读事件总数')
+    args = parser.parse_args()
+
+    m = load_app()
+    rows = []
+    with m.app.app_context():
+        convs = seed(m, args.users, args.messages)
+        # 已读事件：随机用户读到所在会话中逐渐增大的消息ID
+        events = []
+        for _ in range(args.events):
+            conv_id = random.randrange(1, len(convs) + 1)
+            user_id = random.choice(convs[conv_id - 1])
+            message_id = (conv_id - 1) * args.messages + random.randint(1, args.messages)
+            events.append((conv_id, user_id, message_id))
+
+        result = {}
+        with QueryCounter(m.db.engine) as counter, timer(result):
+            for event in events:
+                legacy_read(m, *event)
+        rows.append(('legacy UPDATE + commit', args.events, counter.count, args.events,
+                     f"{result['seconds'] * 1000:.0f}"))
+
+        flushes = m.receipts.stats['flushes']
+        result = {}
+        with QueryCounter(m.db.engine) as counter, timer(result):
+            for i, (conv_id, user_id, message_id) in enumerate(events, 1):
+                m.receipts.mark_read(user_id, conv_id, message_id)
+                # 按默认合并间隔估算：每 500 个事件落库一次
+                if i % 500 == 0:
+                    m.receipts.flush()
+            m.receipts.flush()
+        rows.append(('watermark aggregator', args.events, counter.count,
+                     m.receipts.stats['flushes'] - flushes, f"{result['seconds'] * 1000:.0f}"))
+    print_table(('impl', 'events', 'queries', 'commits', 'total ms'), rows)
+    m.receipts.stop()
+    m.message_writer.stop()
+    return rows
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+重连风暴基准：服务重启后所有用户同时重连，补齐离线期间的消息。
+
+- legacy: 旧客户端的做法，刷新会话列表后逐个会话重新加载最新一页历史（查询数随会话数增长）
+- sync:   按投递序号补发（每个用户一次游标主键查询 + 一次 (user_id, seq) 范围查询）
+
+用法: python -m benchmarks.bench_reconnect --users 200 --conversations 20 --offline 5
+"""
+import argparse
+from datetime import datetime
+
+from benchmarks.common import load_app, QueryCounter, timer, print_table
+from benchmarks.bench_inbox import DUMMY_HASH
+
+
+def seed(m, users, conversations, offline):
+    """users 个用户，每人与 conversations 个其他用户有会话；每个会话中给每人留 offline 条未确认消息"""
+    from sqlalchemy import insert
+    db = m.db
+    db.session.execute(insert(m.User), [
+        {'id': uid, 'username': f'u{uid}', 'password_hash': DUMMY_HASH, 'is_admin': False}
+        for uid in range(1, users + 1)
+    ])
+    pairs = set()
+    for uid in range(1, users + 1):
+        for k in range(1, conversations // 2 + 1):
+            other = (uid + k - 1) % users + 1
+            pairs.add((min(uid, other), max(uid, other)))
+    db.session.execute(insert(m.Friendship), [
+        {'user_a_id': a, 'user_b_id': b, 'status': 'Accepted'} for a, b in sorted(pairs)
+    ])
+    db.session.execute(insert(m.Conversation), [
+        {'id': i, 'user_one_id': a, 'user_two_id': b, 'last_message_at': datetime.utcnow()}
+        for i, (a, b) in enumerate(sorted(pairs), 1)
+    ])
+    db.session.commit()
+    # 经写入管道发送，分配投递序号
+    for conv_id, (a, b) in enumerate(sorted(pairs), 1):
+        for i in range(offline):
+            for sender, receiver in ((a, b), (b, a)):
+                msg = m.Message(conversation_id=conv_id, sender_id=sender, content=f'offline {i}',
+                                type='text', is_read=False, timestamp=datetime.utcnow())
+                m.message_writer.submit(msg, [receiver])
+    m.message_writer.flush()
+    return len(pairs)
+
+
+def legacy_reconnect(m, user_id):
+    """刷新会话列表，再逐个会话加载最新一页"""
+    from utils.inbox import build_inbox
+    from utils.history import fetch_page
+    for conv in build_inbox(user_id):
+        if conv['conversation_id']:
+            fetch_page(conv['conversation_id'])
+
+
+def sync_reconnect(m, user_id):
+    from utils.delivery import fetch_pending
+    after, has_more = 0, True
+    while has_more:
+        _, after, has_more = fetch_pending(user_id, after)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--conversations', type=int, default=20, help='每个用户的会话数')
+    parser.add_argument('--offline', type=int, default=5, help='每个会话中的离线消息数')
+    args = parser.parse_args()
+
+    m = load_app()
+    rows = []
+    with m.app.app_context():
+        pairs = seed(m, args.users, args.conversations, args.offline)
+        print(f"{args.users} 个用户, {pairs} 个会话, {pairs * args.offline * 2} 条离线消息")
+        for name, fn in (('legacy', legacy_reconnect), ('sync', sync_reconnect)):
+            m.db.session.expire_all()
+            result = {}
+            with QueryCounter(m.db.engine) as counter, timer(result):
+                for uid in range(1, args.users + 1):
+                    fn(m, uid)
+            rows.append((name, counter.count, f'{counter.count / args.users:.1f}',
+                         f"{result['seconds'] * 1000:.0f}", f"{result['seconds'] * 1000 / args.users:.2f}"))
+    print_table(('impl', 'queries', 'queries/user', 'total ms', 'ms/user'), rows)
+    m.message_writer.stop()
+    return rows
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Redis 访问层基准：好友在线状态逐个查询（每个好友一次往返）vs 管道批量查询（一次往返）。
+
+未指定 --redis-url 时自动启动 benchmarks/mini_redis.py；真实 Redis 的往返延迟更低，但比例关系相同。
+
+用法: python -m benchmarks.bench_redis --friends 10,100,1000 --repeat 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import urlparse
+
+from benchmarks.common import ROOT, percentile, print_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--friends', default='10,100,1000', help='逗号分隔的好友数')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--redis-url', help='使用已有的 Redis（默认启动 mini_redis）')
+    args = parser.parse_args()
+
+    helper = None
+    url = args.redis_url
+    if not url:
+        url = 'redis://127.0.0.1:6399/0'
+        helper = subprocess.Popen([sys.executable, '-m', 'benchmarks.mini_redis', '--port', '6399'],
+                                  cwd=ROOT, stdout=subprocess.DEVNULL)
+        time.sleep(0.5)
+    parsed = urlparse(url)
+    # 必须在导入 utils.redis_helpers 之前设置
+    os.environ['REDIS_HOST'] = parsed.hostname or 'localhost'
+    os.environ['REDIS_PORT'] = str(parsed.port or 6379)
+
+    from utils.redis_helpers import redis_store
+    from utils.presence import Presence, _user_key
+
+    presence = Presence()
+    rows = []
+    try:
+        for count in (int(n) for n in args.friends.split(',')):
+            redis_store.call('flushdb')
+            friend_ids = list(range(1, count + 1))
+            # 一半好友在线
+            for uid in friend_ids[::2]:
+                presence.connect(uid, f'sid-{uid}')
+
+            per_key, pipelined = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                now = time.time()
+                legacy = {uid for uid in friend_ids if redis_store.call('zcount', _user_key(uid), now, '+inf')}
+                per_key.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                batched = presence.online_users(friend_ids)
+                pipelined.append((time.perf_counter() - start) * 1000)
+                assert legacy == batched
+
+            rows.append((count, count, f'{percentile(per_key, 50):.2f}', f'{percentile(per_key, 99):.2f}',
+                         1, f'{percentile(pipelined, 50):.2f}', f'{percentile(pipelined, 99):.2f}'))
+    finally:
+        if helper is not None:
+            helper.kill()
+    print_table(('friends', 'per-key trips', 'per-key p50 ms', 'per-key p99 ms',
+                 'pipelined trips', 'pipelined p50 ms', 'pipelined p99 ms'), rows)
+    stats = redis_store.get_stats()
+    print(f"连接池: {stats['connections']} 个连接, 熔断器状态: {stats['state']}")
+    return rows
+
+
+if __name__ == '__main__':
+    main()
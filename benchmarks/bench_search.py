@@ -0,0 +1,146 @@
+"""
+消息搜索基准：FTS5 全文索引（trigram + 中日韩二元组）vs 在用户会话内 LIKE '%关键词%' 扫描。
+
+生成 --messages 条随机中文文本消息（分布在 --conversations 个会话中），统计：
+- 从 Message 表重建全文索引的耗时
+- 按随机关键词搜索（第一页）的 p50 / p99 延迟，分两类用户：
+  light: 普通用户，只在少数会话中（会话内消息少）
+  heavy: 前 --heavy-users 个用户，参与一半的会话（会话内消息多）
+
+用法: python -m benchmarks.bench_search --messages 2000000 --queries 200
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import load_app, timer, percentile, print_table
+from benchmarks.bench_inbox import DUMMY_HASH
+
+WORDS = ('今天 明天 昨天 晚上 早上 天气 下雨 公园 散步 吃饭 火锅 咖啡 电影 周末 加班 开会 项目 进度 需求 '
+         '上线 测试 服务器 数据库 接口 文档 客户 合同 报价 快递 地铁 机场 航班 酒店 行李 孩子 学校 作业 '
+         '考试 老师 医院 体检 感冒 健身 跑步 游泳 篮球 足球 比赛 音乐 演唱会 门票 生日 礼物 蛋糕 聚会 '
+         '朋友 同事 领导 老板 工资 房租 搬家 装修 猫咪 小狗 记得 一起 已经 还是 可以 没有 知道 觉得 '
+         '真的 好的 收到 谢谢 辛苦了 没问题 哈哈哈 稍等 马上 到了 出发 回家').split()
+
+
+def random_text(rng):
+    return ''.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+
+
+def seed(m, users, heavy_users, conversations, messages, batch_size=50000):
+    """一半会话由 heavy 用户之一与随机用户组成，其余为随机两个普通用户（会话对不重复），消息随机分布到各会话"""
+    from sqlalchemy import insert
+    from utils.summary import rebuild_summaries
+    db = m.db
+    rng = random.Random(42)
+    db.session.execute(insert(m.User), [
+        {'id': uid, 'username': f'u{uid}', 'password_hash': DUMMY_HASH, 'is_admin': False}
+        for uid in range(1, users + 1)
+    ])
+    pairs = set()
+    while len(pairs) < conversations:
+        if len(pairs) % 2:
+            a, b = rng.randint(1, heavy_users), rng.randint(heavy_users + 1, users)
+        else:
+            a, b = rng.sample(range(heavy_users + 1, users + 1), 2)
+        pairs.add((min(a, b), max(a, b)))
+    pairs = sorted(pairs)
+    db.session.execute(insert(m.Conversation), [
+        {'id': i, 'user_one_id': a, 'user_two_id': b} for i, (a, b) in enumerate(pairs, 1)
+    ])
+    db.session.commit()
+
+    start = datetime.utcnow() - timedelta(days=365)
+    for first in range(1, messages + 1, batch_size):
+        rows = []
+        for msg_id in range(first, min(first + batch_size, messages + 1)):
+            conv_id = rng.randrange(1, conversations + 1)
+            rows.append({'id': msg_id, 'conversation_id': conv_id, 'sender_id': rng.choice(pairs[conv_id - 1]),
+                         'content': random_text(rng), 'type': 'text', 'is_read': True,
+                         'timestamp': start + timedelta(seconds=msg_id)})
+        db.session.execute(insert(m.Message), rows)
+        db.session.commit()
+    rebuild_summaries()
+    return pairs
+
+
+def make_queries(rng, user_ids, count):
+    """(用户, 关键词)：两个字的词（走二元组索引）、三个字以上的词、两个词组成的短语、两个关键词"""
+    queries = []
+    for _ in range(count):
+        kind = rng.randrange(4)
+        if kind == 0:
+            term = rng.choice([w for w in WORDS if len(w) == 2])
+        elif kind == 1:
+            term = rng.choice([w for w in WORDS if len(w) >= 3])
+        elif kind == 2:
+            term = rng.choice(WORDS) + rng.choice(WORDS)
+        else:
+            term = rng.choice(WORDS) + rng.choice(WORDS) + ' ' + rng.choice(WORDS) + rng.choice(WORDS)
+        queries.append((rng.choice(user_ids), term))
+    return queries
+
+
+def run_queries(search, queries):
+    latencies, hits = [], 0
+    for user_id, term in queries:
+        start = time.perf_counter()
+        hits += len(search(user_id, term))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=2000000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--heavy-users', type=int, default=10)
+    parser.add_argument('--conversations', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    m = load_app()
+    from models import ConversationMember
+    from utils import search
+    rows = []
+    with m.app.app_context():
+        result = {}
+        with timer(result):
+            seed(m, args.users, args.heavy_users, args.conversations, args.messages)
+        print(f"seeded {args.messages} messages in {result['seconds']:.1f}s")
+        with timer(result):
+            indexed = search.rebuild_index()
+        print(f"indexed {indexed} messages in {result['seconds']:.1f}s")
+
+        def scope(user_id):
+            return [c for (c,) in m.db.session.query(ConversationMember.conversation_id)
+                    .filter_by(user_id=user_id)]
+
+        page = search.DEFAULT_PAGE_SIZE
+        impls = (
+            ('LIKE scan', lambda u, q: search._search_like(scope(u), search.parse_terms(q), page, 0)[:page]),
+            ('FTS5 index', lambda u, q: search._search_fts(scope(u), search.parse_terms(q), page, 0)[:page]),
+            ('search_messages', lambda u, q: search.search_messages(u, q).hits),
+        )
+        rng = random.Random(7)
+        classes = (('light', list(range(args.heavy_users + 1, args.users + 1))),
+                   ('heavy', list(range(1, args.heavy_users + 1))))
+        for users, user_ids in classes:
+            queries = make_queries(rng, user_ids, args.queries)
+            scoped = m.db.session.query(m.db.func.count(m.Message.id)).join(
+                ConversationMember, ConversationMember.conversation_id == m.Message.conversation_id
+            ).filter(ConversationMember.user_id.in_({u for u, _ in queries})).scalar()
+            for name, fn in impls:
+                latencies, hits = run_queries(fn, queries)
+                m.db.session.rollback()
+                rows.append((users, scoped // len({u for u, _ in queries}), name, len(queries), hits,
+                             f'{percentile(latencies, 50):.2f}', f'{percentile(latencies, 99):.2f}'))
+    print_table(('users', 'msgs/user', 'impl', 'queries', 'hits', 'p50 ms', 'p99 ms'), rows)
+    m.receipts.stop()
+    m.message_writer.stop()
+    return rows
+
+
+if __name__ == '__main__':
+    main()
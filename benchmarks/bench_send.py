@@ -0,0 +1,71 @@
+"""
+send_msg 持久化基准：逐条同步提交 vs write-behind 批量提交（以及持久确认模式）的消息吞吐。
+
+并发发送方 (--clients) 越多，持久确认模式下同一批次能合并的消息越多。
+
+用法: python -m benchmarks.bench_send --messages 2000 --clients 20
+"""
+import argparse
+import time
+
+from benchmarks.common import load_app, print_table
+
+MODES = (
+    ('sync (per-message commit)', {'MESSAGE_WRITE_BEHIND': False, 'MESSAGE_DURABLE_ACK': False}),
+    ('write-behind', {'MESSAGE_WRITE_BEHIND': True, 'MESSAGE_DURABLE_ACK': False}),
+    ('write-behind + durable ack', {'MESSAGE_WRITE_BEHIND': True, 'MESSAGE_DURABLE_ACK': True}),
+)
+
+
+def login(m, client, username):
+    client.post('/api/auth/register', json={'username': username, 'password': 'pw'})
+    client.post('/api/auth/login', json={'username': username, 'password': 'pw'})
+
+
+def run(count, clients):
+    m = load_app()
+    from utils.persistence import MessageWriter
+    sender, receiver = m.app.test_client(), m.app.test_client()
+    login(m, sender, 'sender')
+    login(m, receiver, 'receiver')
+    sender.post('/api/friends/add/receiver')
+    per_client = count // clients
+    rows = []
+    for name, overrides in MODES:
+        m.app.config.update(overrides)
+        m.message_writer.stop()
+        m.message_writer = MessageWriter(m.app, m.socketio)
+        sockets = [m.socketio.test_client(m.app, flask_test_client=sender) for _ in range(clients)]
+
+        def send_all(socket):
+            for i in range(per_client):
+                socket.emit('send_msg', {'receiver_id': 2, 'content': f'message {i}'})
+
+        start = time.perf_counter()
+        tasks = [m.socketio.start_background_task(send_all, socket) for socket in sockets]
+        # 先让出一次：eventlet 下尚未开始运行的任务 join() 会直接返回
+        m.socketio.sleep(0)
+        for task in tasks:
+            task.join()
+        acked = time.perf_counter() - start
+        m.message_writer.stop()
+        persisted = time.perf_counter() - start
+        for socket in sockets:
+            socket.disconnect()
+        total = per_client * clients
+        rows.append((name, total, f'{total / acked:.0f}', f'{total / persisted:.0f}',
+                     m.message_writer.stats['batches']))
+    print_table(('mode', 'messages', 'acked msg/s', 'persisted msg/s', 'commits'), rows)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=20)
+    args = parser.parse_args()
+    run(args.messages, args.clients)
+
+
+if __name__ == '__main__':
+    main()
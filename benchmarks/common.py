@@ -0,0 +1,72 @@
+"""基准测试公共工具：临时数据库、SQL 计数、计时"""
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# 基准的客户端都来自本机、发送速率远超真人：关闭限流（经环境变量传给 app 和基准启动的 app.py 进程）
+NO_RATE_LIMITS = {'RATE_LIMIT_SOCKET': '0', 'RATE_LIMIT_SEND_MSG': '0', 'RATE_LIMIT_TYPING': '0',
+                  'RATE_LIMIT_LOGIN': '0', 'RATE_LIMIT_REGISTER': '0', 'RATE_LIMIT_UPLOAD': '0'}
+
+
+def load_app(db_path=None):
+    """在临时 SQLite 库上导入 app（必须在首次 import app 之前调用）"""
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='lightchat-bench-'), 'bench.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    os.environ.update(NO_RATE_LIMITS)
+    import app as app_module
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+    return app_module
+
+
+class QueryCounter:
+    """统计一段代码内执行的 SQL 语句数"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+@contextmanager
+def timer(result, key='seconds'):
+    """把代码块耗时（秒）写入 result[key]"""
+    start = time.perf_counter()
+    yield
+    result[key] = time.perf_counter() - start
+
+
+def percentile(values, pct):
+    """简单的分位数（最近秩）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def print_table(headers, rows):
+    """以等宽表格打印结果"""
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    print('  '.join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print('  '.join(str(c).ljust(w) for c, w in zip(row, widths)))
@@ -0,0 +1,111 @@
+"""
+压测造数：大规模好友关系和长会话，直接批量插入（绕过发送路径），之后重建全文索引和会话摘要。
+
+- friend_graph:       users 个用户，每人平均 friends_per_user 个好友，每对好友一个会话；
+                      相邻编号的用户互为好友（环），保证任意一段连续编号的用户之间都有会话
+- long_conversations: 给指定会话各写入 length 条消息，时间均匀分布在过去 days 天内
+
+也可以单独运行，生成一个可直接用 app.py 打开的库：
+python -m benchmarks.datagen --db /tmp/big.db --users 10000 --friends-per-user 100 --history 5000
+"""
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+
+import bcrypt
+
+# 造数时每批插入的行数
+CHUNK = 20000
+
+
+def password_hash(password='pw', rounds=4):
+    """所有造数用户共用一个低强度的 bcrypt 哈希，压测时可以真实登录"""
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _insert(m, model, rows):
+    from sqlalchemy import insert
+    for start in range(0, len(rows), CHUNK):
+        m.db.session.execute(insert(model), rows[start:start + CHUNK])
+    m.db.session.commit()
+
+
+def username(uid):
+    return f'user{uid}'
+
+
+def friend_graph(m, users, friends_per_user, hashed=None, seed=42):
+    """
+    创建用户 1..users（用户 1 为管理员）和好友关系，返回 {(user_a_id, user_b_id): conversation_id}，
+    其中 user_a_id < user_b_id。需要在应用上下文中调用。
+    """
+    rng = random.Random(seed)
+    hashed = hashed or password_hash()
+    _insert(m, m.User, [
+        {'id': uid, 'username': username(uid), 'password_hash': hashed, 'is_admin': uid == 1}
+        for uid in range(1, users + 1)
+    ])
+    pairs = {(uid, uid + 1) for uid in range(1, users)}
+    target = min(users * friends_per_user // 2, users * (users - 1) // 2)
+    while len(pairs) < target:
+        a, b = rng.sample(range(1, users + 1), 2)
+        pairs.add((min(a, b), max(a, b)))
+    pairs = sorted(pairs)
+    _insert(m, m.Friendship, [{'user_a_id': a, 'user_b_id': b, 'status': 'Accepted'} for a, b in pairs])
+    conversations = {pair: conv_id for conv_id, pair in enumerate(pairs, 1)}
+    _insert(m, m.Conversation, [
+        {'id': conv_id, 'user_one_id': a, 'user_two_id': b} for (a, b), conv_id in conversations.items()
+    ])
+    return conversations
+
+
+def long_conversations(m, conversations, length, days=30, seed=42):
+    """
+    conversations 为 {(user_a_id, user_b_id): conversation_id}，每个会话写入 length 条已读消息；
+    写完后重建全文索引和会话摘要（含未读数）。需要在应用上下文中调用。
+    """
+    from utils.search import rebuild_index
+    from utils.summary import rebuild_summaries
+    rng = random.Random(seed)
+    start = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / max(1, length)
+    rows = []
+    for (a, b), conv_id in conversations.items():
+        for i in range(length):
+            rows.append({'conversation_id': conv_id, 'sender_id': rng.choice((a, b)),
+                         'content': f'history message {i} in conversation {conv_id}', 'type': 'text',
+                         'timestamp': start + step * i, 'is_read': True})
+            if len(rows) >= CHUNK:
+                _insert(m, m.Message, rows)
+                rows = []
+    if rows:
+        _insert(m, m.Message, rows)
+    rebuild_index()
+    rebuild_summaries()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', required=True, help='生成的 SQLite 文件路径（已存在时覆盖）')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--friends-per-user', type=int, default=100)
+    parser.add_argument('--history', type=int, default=1000, help='相邻用户之间的会话各写入的消息数')
+    args = parser.parse_args()
+
+    from benchmarks.common import load_app
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    m = load_app(os.path.abspath(args.db))
+    with m.app.app_context():
+        conversations = friend_graph(m, args.users, args.friends_per_user)
+        ring = {(a, b): conv_id for (a, b), conv_id in conversations.items() if b == a + 1}
+        long_conversations(m, ring, args.history)
+        print(f"{args.users} 个用户（密码 pw，user1 为管理员），{len(conversations)} 对好友，"
+              f"{len(ring)} 个会话各 {args.history} 条消息")
+    m.message_writer.stop()
+    m.receipts.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""
+端到端压测：在临时库上启动 app.py（在线状态走内存回退，不连 Redis），模拟 --users 个并发客户端：
+- 登录（POST /api/auth/login）并建立 WebSocket 连接
+- 每 --send-interval 秒向相邻编号的好友发送一条消息（send_msg），记录服务器回显（send_msg ack）
+  和对方收到（deliver）的延迟
+- 每 --rest-interval 秒轮流请求 GET /api/friends、历史记录最新一页、再往前一页
+库由 benchmarks.datagen 生成：--graph-users 个用户、每人约 --friends-per-user 个好友，
+并发用户相邻之间的会话各有 --history 条历史消息。
+
+统计每种操作的次数、错误数、吞吐量（次/秒）和 mean / p50 / p95 / p99 / max 延迟，
+连同 git 提交、参数和服务端 /api/admin/stats 写入 JSON（默认 benchmarks/results/loadtest-<提交>.json），
+用 --compare 对比两次结果，检查提交之间的性能回退：
+python -m benchmarks.loadtest --compare before.json after.json --fail-over 20  # 任一操作 p95 变慢超过 20% 时退出码为 1
+
+客户端需要 pip install "python-socketio[client]"
+
+用法: python -m benchmarks.loadtest --users 50 --duration 30
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import requests
+import socketio
+
+from benchmarks.common import ROOT, load_app, percentile, print_table
+from benchmarks.bench_cluster import wait_for_port, stop_processes
+from benchmarks import datagen
+
+PORT = 5170
+# 指向没有服务监听的端口，让 app.py 使用在线状态的内存回退
+CLOSED_REDIS_PORT = '1'
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+class Recorder:
+    """按操作名记录延迟（ms）和错误数，多个客户端线程共用"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, op, ms):
+        with self._lock:
+            self.latencies[op].append(ms)
+
+    def error(self, op):
+        with self._lock:
+            self.errors[op] += 1
+
+    def timed(self, op, fn, ok=lambda result: True):
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except Exception:
+            self.error(op)
+            return None
+        if not ok(result):
+            self.error(op)
+            return None
+        self.add(op, (time.perf_counter() - start) * 1000)
+        return result
+
+    def summary(self, seconds):
+        result = {}
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            values = self.latencies.get(op, [])
+            result[op] = {
+                'count': len(values),
+                'errors': self.errors.get(op, 0),
+                'throughput': round(len(values) / seconds, 2),
+                'mean_ms': round(sum(values) / len(values), 3) if values else 0.0,
+                **{f'p{pct}_ms': round(percentile(values, pct), 3) for pct in (50, 95, 99)},
+                'max_ms': round(max(values), 3) if values else 0.0,
+            }
+        return result
+
+
+class LoadClient:
+    """一个并发用户：登录、连接，然后按固定间隔发消息和请求 REST 接口"""
+
+    def __init__(self, base_url, user_id, targets, conversations, recorder):
+        self.base_url = base_url
+        self.user_id = user_id
+        self.targets = targets              # 发送消息的好友（同样是并发用户，能统计送达延迟）
+        self.conversations = conversations  # 与这些好友的会话 ID
+        self.recorder = recorder
+        self.measuring = False
+        self.http = requests.Session()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('receive_msg', self._on_receive)
+        self.sio.on('receive_msg_batch', self._on_receive_batch)
+
+    def connect(self):
+        login = lambda: self.http.post(self.base_url + '/api/auth/login',
+                                       json={'username': datagen.username(self.user_id), 'password': 'pw'})
+        if self.recorder.timed('login', login, lambda r: r.status_code == 200) is None:
+            return
+        cookie = '; '.join(f'{k}={v}' for k, v in self.http.cookies.items())
+        connect = lambda: self.sio.connect(self.base_url, headers={'Cookie': cookie},
+                                           transports=['websocket'], wait_timeout=10)
+        self.recorder.timed('connect', connect, lambda _: self.sio.connected)
+
+    def _on_receive(self, data):
+        if not self.measuring:
+            return
+        try:
+            sent_at = float(data['content'])
+        except (KeyError, TypeError, ValueError):
+            return
+        op = 'send_msg ack' if data.get('sender_id') == self.user_id else 'deliver'
+        self.recorder.add(op, (time.time() - sent_at) * 1000)
+
+    def _on_receive_batch(self, messages):
+        # 同一批次提交的多条消息合并为一帧推送
+        for data in messages:
+            self._on_receive(data)
+
+    def _get(self, op, path, params=None):
+        return self.recorder.timed(op, lambda: self.http.get(self.base_url + path, params=params),
+                                   lambda r: r.status_code == 200)
+
+    def _rest(self, step):
+        conversation_id = self.conversations[step // 3 % len(self.conversations)]
+        kind = step % 3
+        if kind == 0:
+            self._get('GET /api/friends', '/api/friends')
+        elif kind == 1:
+            self._latest = self._get('GET /api/history', f'/api/history/{conversation_id}')
+        elif self._latest is not None:
+            before = self._latest.json().get('before')
+            if before:
+                self._get('GET /api/history?before', f'/api/history/{conversation_id}', {'before': before})
+
+    def run(self, deadline, send_interval, rest_interval):
+        self._latest = None
+        next_send = next_rest = time.perf_counter()
+        sends = rests = 0
+        while time.perf_counter() < deadline:
+            now = time.perf_counter()
+            if now >= next_send:
+                target = self.targets[sends % len(self.targets)]
+                try:
+                    self.sio.emit('send_msg', {'receiver_id': target, 'content': repr(time.time())})
+                except Exception:
+                    self.recorder.error('send_msg ack')
+                sends += 1
+                next_send += send_interval
+            if now >= next_rest:
+                self._rest(rests)
+                rests += 1
+                next_rest += rest_interval
+            time.sleep(max(0.0, min(next_send, next_rest, deadline) - time.perf_counter()))
+
+    def close(self):
+        if self.sio.connected:
+            self.sio.disconnect()
+
+
+def git_info():
+    def git(*cmd):
+        try:
+            return subprocess.run(['git', *cmd], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ''
+    return {'commit': git('rev-parse', '--short', 'HEAD') or 'unknown',
+            'subject': git('log', '-1', '--format=%s'),
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+def seed(db_path, args):
+    """生成压测库，返回 {并发用户 ID: [(好友 ID, 会话 ID)]}：并发用户 u 与 u-1、u+1 互为好友"""
+    m = load_app(db_path)
+    with m.app.app_context():
+        conversations = datagen.friend_graph(m, max(args.graph_users, args.users), args.friends_per_user)
+        active = {(a, b): conv_id for (a, b), conv_id in conversations.items() if b == a + 1 and b <= args.users}
+        datagen.long_conversations(m, active, args.history)
+    m.message_writer.stop()
+    m.receipts.stop()
+    peers = defaultdict(list)
+    for (a, b), conv_id in sorted(active.items()):
+        peers[a].append((b, conv_id))
+        peers[b].append((a, conv_id))
+    return peers
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix='lightchat-loadtest-')
+    db_path = os.path.join(work_dir, 'loadtest.db')
+    seed_start = time.perf_counter()
+    peers = seed(db_path, args)
+    print(f"造数 {time.perf_counter() - seed_start:.1f}s，服务日志: {work_dir}")
+
+    # load_app 已在环境变量中关闭限流（所有客户端来自本机），app.py 进程继承
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + db_path, SERVER_HOST='127.0.0.1', SERVER_PORT=str(PORT),
+               SERVER_DEBUG='0', REDIS_HOST='127.0.0.1', REDIS_PORT=CLOSED_REDIS_PORT)
+    log = open(os.path.join(work_dir, 'server.log'), 'w')
+    procs = [subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)]
+    base_url = f'http://127.0.0.1:{PORT}'
+    recorder = Recorder()
+    clients = [LoadClient(base_url, uid, [p for p, _ in peers[uid]], [c for _, c in peers[uid]], recorder)
+               for uid in range(1, args.users + 1)]
+    try:
+        wait_for_port('127.0.0.1', PORT)
+        # 所有用户同时登录 / 连接，全部就绪后开始计时
+        threads = [threading.Thread(target=c.connect) for c in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        connected = [c for c in clients if c.sio.connected]
+        for client in connected:
+            client.measuring = True
+        start = time.perf_counter()
+        deadline = start + args.duration
+        threads = [threading.Thread(target=c.run, args=(deadline, args.send_interval, args.rest_interval))
+                   for c in connected]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 等待最后一批消息送达
+        time.sleep(1.0)
+        elapsed = time.perf_counter() - start
+        stats = clients[0].http.get(base_url + '/api/admin/stats').json()
+    finally:
+        for client in clients:
+            client.close()
+        stop_processes(procs)
+
+    results = recorder.summary(elapsed)
+    for op in ('login', 'connect'):
+        if op in results:
+            results[op]['throughput'] = None  # 只在开始时发生，吞吐无意义
+    return {
+        'meta': dict(git_info(), timestamp=datetime.now().isoformat(timespec='seconds'),
+                     python=platform.python_version(), platform=platform.platform(),
+                     connected=len(connected), seconds=round(elapsed, 2), args=vars(args)),
+        'results': results,
+        'server_stats': stats,
+    }
+
+
+def print_results(report):
+    meta = report['meta']
+    print(f"提交 {meta['commit']}{'（有未提交修改）' if meta['dirty'] else ''}，"
+          f"{meta['connected']} 个并发用户，{meta['seconds']}s")
+    print_table(('op', 'count', 'errors', 'per sec', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'), [
+        (op, r['count'], r['errors'], '-' if r['throughput'] is None else r['throughput'],
+         r['mean_ms'], r['p50_ms'], r['p95_ms'], r['p99_ms'], r['max_ms'])
+        for op, r in report['results'].items()
+    ])
+
+
+def change(before, after):
+    if not before:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(path_a, path_b, fail_over):
+    """打印两次结果的对比；p95 变慢超过 fail_over% 的操作视为回退，返回回退的操作名"""
+    with open(path_a) as f:
+        a = json.load(f)
+    with open(path_b) as f:
+        b = json.load(f)
+    print(f"A: {a['meta']['commit']} {a['meta'].get('subject', '')}")
+    print(f"B: {b['meta']['commit']} {b['meta'].get('subject', '')}")
+    rows, regressions = [], []
+    for op in sorted(set(a['results']) & set(b['results'])):
+        ra, rb = a['results'][op], b['results'][op]
+        p95 = change(ra['p95_ms'], rb['p95_ms'])
+        regressed = fail_over is not None and p95 is not None and p95 > fail_over
+        if regressed:
+            regressions.append(op)
+        fmt = lambda v: '-' if v is None else f'{v:+.1f}%'
+        rows.append((op, ra['p50_ms'], rb['p50_ms'], fmt(change(ra['p50_ms'], rb['p50_ms'])),
+                     ra['p95_ms'], rb['p95_ms'], fmt(p95), ra['p99_ms'], rb['p99_ms'],
+                     fmt(change(ra['throughput'], rb['throughput'])) if ra['throughput'] is not None else '-',
+                     '回退' if regressed else ''))
+    print_table(('op', 'A p50', 'B p50', 'p50', 'A p95', 'B p95', 'p95', 'A p99', 'B p99', 'per sec', ''), rows)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50, help='并发客户端数')
+    parser.add_argument('--graph-users', type=int, default=1000, help='库中的用户总数')
+    parser.add_argument('--friends-per-user', type=int, default=50)
+    parser.add_argument('--history', type=int, default=2000, help='并发用户之间每个会话的历史消息数')
+    parser.add_argument('--duration', type=float, default=30, help='计时阶段的秒数')
+    parser.add_argument('--send-interval', type=float, default=1.0, help='每个客户端发送消息的间隔（秒）')
+    parser.add_argument('--rest-interval', type=float, default=2.0, help='每个客户端请求 REST 接口的间隔（秒）')
+    parser.add_argument('--output', help='结果 JSON 路径（默认 benchmarks/results/loadtest-<提交>.json）')
+    parser.add_argument('--compare', nargs=2, metavar=('A', 'B'), help='对比两次结果 JSON，不运行压测')
+    parser.add_argument('--fail-over', type=float, help='与 --compare 一起使用：p95 变慢超过该百分比时退出码为 1')
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(*args.compare, args.fail_over)
+        if regressions:
+            print(f"p95 回退超过 {args.fail_over}%: {', '.join(regressions)}")
+            sys.exit(1)
+        return
+    if args.users < 2:
+        parser.error('--users 至少为 2（客户端之间互发消息）')
+
+    report = run(args)
+    print_results(report)
+    output = args.output or os.path.join(RESULTS_DIR, f"loadtest-{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+    print(f"结果已写入 {output}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
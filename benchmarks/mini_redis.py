@@ -0,0 +1,418 @@
+"""
+基准测试 / 本地多进程调试用的最小 Redis 替身（RESP2 协议，单线程 asyncio）。
+
+只实现本项目用到的命令：字符串、计数器、集合、哈希、有序集合、过期、MULTI/EXEC 以及 PUBLISH/SUBSCRIBE
+（Socket.IO 消息队列需要）。不做持久化，不用于生产。
+
+用法: python -m benchmarks.mini_redis --port 6399
+"""
+import argparse
+import asyncio
+import fnmatch
+import time
+
+
+class _Store:
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.channels = {}
+
+    def alive(self, key):
+        expire_at = self.expires.get(key)
+        if expire_at is not None and expire_at <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data[key] if self.alive(key) else default
+
+    def delete(self, key):
+        existed = self.alive(key)
+        self.data.pop(key, None)
+        self.expires.pop(key, None)
+        return existed
+
+
+class _Error(Exception):
+    pass
+
+
+class _RawArray(list):
+    """EXEC 的回复：元素已编码"""
+
+
+# 订阅类命令自行写回复
+_NO_REPLY = object()
+
+
+def _encode(value):
+    if isinstance(value, _RawArray):
+        return b'*%d\r\n' % len(value) + b''.join(value)
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, _Error):
+        return b'-ERR ' + str(value).encode() + b'\r\n'
+    if isinstance(value, bool):
+        return b':%d\r\n' % int(value)
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        return b'+' + value.encode() + b'\r\n'
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    if isinstance(value, (list, tuple, set)):
+        return b'*%d\r\n' % len(value) + b''.join(_encode(v) for v in value)
+    raise TypeError(type(value))
+
+
+def _int(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise _Error('value is not an integer or out of range')
+
+
+class MiniRedis:
+    def __init__(self):
+        self.store = _Store()
+
+    # --- 连接处理 ---
+    async def handle(self, reader, writer):
+        state = {'multi': None, 'subscribed': set(), 'writer': writer}
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                reply = self.execute(state, args)
+                if reply is not _NO_REPLY:
+                    writer.write(reply)
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in state['subscribed']:
+                self.store.channels.get(channel, set()).discard(writer)
+            writer.close()
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.strip().split()
+        count = int(line[1:])
+        args = []
+        for _ in range(count):
+            header = await reader.readline()
+            length = int(header[1:])
+            data = await reader.readexactly(length + 2)
+            args.append(data[:-2])
+        return args
+
+    def execute(self, state, args):
+        name = args[0].decode().upper()
+        if state['multi'] is not None and name not in ('EXEC', 'DISCARD', 'MULTI'):
+            state['multi'].append(args)
+            return _encode('QUEUED')
+        handler = getattr(self, 'cmd_' + name.replace(' ', '_'), None)
+        if handler is None:
+            return _encode(_Error(f"unknown command '{name}'"))
+        try:
+            result = handler(state, *args[1:])
+        except _Error as e:
+            result = e
+        except (TypeError, IndexError):
+            result = _Error(f"wrong number of arguments for '{name}' command")
+        if result is _NO_REPLY:
+            return result
+        return _encode(result)
+
+    # --- 连接 / 事务 ---
+    def cmd_PING(self, state, *args):
+        return args[0] if args else 'PONG'
+
+    def cmd_CLIENT(self, state, *args):
+        return 'OK'
+
+    def cmd_SELECT(self, state, db):
+        return 'OK'
+
+    def cmd_ECHO(self, state, value):
+        return value
+
+    def cmd_FLUSHDB(self, state, *args):
+        self.store.data.clear()
+        self.store.expires.clear()
+        return 'OK'
+
+    cmd_FLUSHALL = cmd_FLUSHDB
+
+    def cmd_MULTI(self, state):
+        state['multi'] = []
+        return 'OK'
+
+    def cmd_DISCARD(self, state):
+        state['multi'] = None
+        return 'OK'
+
+    def cmd_EXEC(self, state):
+        queued, state['multi'] = state['multi'] or [], None
+        replies = [self.execute(state, args) for args in queued]
+        return _RawArray(replies)
+
+    # --- 字符串 / 计数器 ---
+    def cmd_GET(self, state, key):
+        return self.store.get(key)
+
+    def cmd_MGET(self, state, *keys):
+        return [self.store.get(k) for k in keys]
+
+    def cmd_SET(self, state, key, value, *options):
+        options = [o.decode().upper() if isinstance(o, bytes) else o for o in options]
+        expire_at = None
+        if 'NX' in options and self.store.alive(key):
+            return None
+        if 'XX' in options and not self.store.alive(key):
+            return None
+        for flag, scale in (('EX', 1.0), ('PX', 0.001)):
+            if flag in options:
+                expire_at = time.time() + _int(options[options.index(flag) + 1]) * scale
+        self.store.data[key] = value
+        self.store.expires.pop(key, None)
+        if expire_at is not None:
+            self.store.expires[key] = expire_at
+        return 'OK'
+
+    def cmd_SETEX(self, state, key, seconds, value):
+        return self.cmd_SET(state, key, value, b'EX', seconds)
+
+    def cmd_DEL(self, state, *keys):
+        return sum(self.store.delete(k) for k in keys)
+
+    cmd_UNLINK = cmd_DEL
+
+    def cmd_EXISTS(self, state, *keys):
+        return sum(self.store.alive(k) for k in keys)
+
+    def cmd_INCRBY(self, state, key, amount):
+        value = _int(self.store.get(key, b'0')) + _int(amount)
+        self.store.data[key] = str(value).encode()
+        return value
+
+    def cmd_INCR(self, state, key):
+        return self.cmd_INCRBY(state, key, b'1')
+
+    def cmd_DECR(self, state, key):
+        return self.cmd_INCRBY(state, key, b'-1')
+
+    def cmd_EXPIRE(self, state, key, seconds):
+        if not self.store.alive(key):
+            return 0
+        self.store.expires[key] = time.time() + _int(seconds)
+        return 1
+
+    def cmd_PEXPIRE(self, state, key, millis):
+        if not self.store.alive(key):
+            return 0
+        self.store.expires[key] = time.time() + _int(millis) / 1000.0
+        return 1
+
+    def cmd_TTL(self, state, key):
+        if not self.store.alive(key):
+            return -2
+        expire_at = self.store.expires.get(key)
+        return -1 if expire_at is None else int(expire_at - time.time())
+
+    def cmd_KEYS(self, state, pattern):
+        pattern = pattern.decode()
+        return [k for k in list(self.store.data) if self.store.alive(k) and fnmatch.fnmatchcase(k.decode(), pattern)]
+
+    # --- 集合 ---
+    def _set(self, key, create=False):
+        value = self.store.get(key)
+        if value is None:
+            if not create:
+                return set()
+            value = self.store.data[key] = set()
+        if not isinstance(value, set):
+            raise _Error('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def cmd_SADD(self, state, key, *members):
+        target = self._set(key, create=True)
+        before = len(target)
+        target.update(members)
+        return len(target) - before
+
+    def cmd_SREM(self, state, key, *members):
+        target = self._set(key)
+        removed = sum(1 for m in members if m in target)
+        target.difference_update(members)
+        if not target:
+            self.store.delete(key)
+        return removed
+
+    def cmd_SMEMBERS(self, state, key):
+        return sorted(self._set(key))
+
+    def cmd_SCARD(self, state, key):
+        return len(self._set(key))
+
+    def cmd_SISMEMBER(self, state, key, member):
+        return int(member in self._set(key))
+
+    # --- 哈希 ---
+    def _hash(self, key, create=False):
+        value = self.store.get(key)
+        if value is None:
+            if not create:
+                return {}
+            value = self.store.data[key] = {}
+        if not isinstance(value, dict):
+            raise _Error('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def cmd_HSET(self, state, key, *pairs):
+        target = self._hash(key, create=True)
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in target
+            target[field] = value
+        return added
+
+    def cmd_HGET(self, state, key, field):
+        return self._hash(key).get(field)
+
+    def cmd_HMGET(self, state, key, *fields):
+        target = self._hash(key)
+        return [target.get(f) for f in fields]
+
+    def cmd_HGETALL(self, state, key):
+        return [item for pair in self._hash(key).items() for item in pair]
+
+    def cmd_HDEL(self, state, key, *fields):
+        target = self._hash(key)
+        return sum(1 for f in fields if target.pop(f, None) is not None)
+
+    def cmd_HINCRBY(self, state, key, field, amount):
+        target = self._hash(key, create=True)
+        value = _int(target.get(field, b'0')) + _int(amount)
+        target[field] = str(value).encode()
+        return value
+
+    # --- 有序集合 ---
+    def _zset(self, key, create=False):
+        value = self.store.get(key)
+        if value is None:
+            if not create:
+                return {}
+            value = self.store.data[key] = {}
+        if not isinstance(value, dict):
+            raise _Error('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    @staticmethod
+    def _score_range(low, high):
+        def bound(raw):
+            raw = raw.decode()
+            return float(raw.lstrip('(')), raw.startswith('(')
+        (lo, lo_ex), (hi, hi_ex) = bound(low), bound(high)
+
+        def matches(score):
+            return (score > lo if lo_ex else score >= lo) and (score < hi if hi_ex else score <= hi)
+        return matches
+
+    def cmd_ZADD(self, state, key, *args):
+        args = [a for a in args if a.upper() not in (b'NX', b'XX', b'GT', b'LT', b'CH')]
+        target = self._zset(key, create=True)
+        added = 0
+        for score, member in zip(args[::2], args[1::2]):
+            added += member not in target
+            target[member] = float(score)
+        return added
+
+    def cmd_ZREM(self, state, key, *members):
+        target = self._zset(key)
+        removed = sum(1 for m in members if target.pop(m, None) is not None)
+        if not target:
+            self.store.delete(key)
+        return removed
+
+    def cmd_ZCARD(self, state, key):
+        return len(self._zset(key))
+
+    def cmd_ZSCORE(self, state, key, member):
+        score = self._zset(key).get(member)
+        return None if score is None else repr(score).encode()
+
+    def cmd_ZCOUNT(self, state, key, low, high):
+        matches = self._score_range(low, high)
+        return sum(1 for score in self._zset(key).values() if matches(score))
+
+    def cmd_ZRANGEBYSCORE(self, state, key, low, high, *options):
+        matches = self._score_range(low, high)
+        items = sorted((score, member) for member, score in self._zset(key).items() if matches(score))
+        if b'WITHSCORES' in (o.upper() for o in options):
+            return [v for score, member in items for v in (member, repr(score).encode())]
+        return [member for score, member in items]
+
+    def cmd_ZREMRANGEBYSCORE(self, state, key, low, high):
+        matches = self._score_range(low, high)
+        target = self._zset(key)
+        doomed = [member for member, score in target.items() if matches(score)]
+        for member in doomed:
+            del target[member]
+        if not target:
+            self.store.delete(key)
+        return len(doomed)
+
+    # --- 发布 / 订阅 ---
+    def cmd_PUBLISH(self, state, channel, message):
+        receivers = list(self.store.channels.get(channel, ()))
+        for writer in receivers:
+            writer.write(_encode([b'message', channel, message]))
+        return len(receivers)
+
+    def cmd_SUBSCRIBE(self, state, *channels):
+        writer = state['writer']
+        for channel in channels:
+            self.store.channels.setdefault(channel, set()).add(writer)
+            state['subscribed'].add(channel)
+            writer.write(_encode([b'subscribe', channel, len(state['subscribed'])]))
+        return _NO_REPLY
+
+    def cmd_UNSUBSCRIBE(self, state, *channels):
+        writer = state['writer']
+        for channel in channels or list(state['subscribed']):
+            self.store.channels.get(channel, set()).discard(writer)
+            state['subscribed'].discard(channel)
+            writer.write(_encode([b'unsubscribe', channel, len(state['subscribed'])]))
+        return _NO_REPLY
+
+
+async def serve(host='127.0.0.1', port=6399, ready=None):
+    server = MiniRedis()
+    srv = await asyncio.start_server(server.handle, host, port)
+    if ready is not None:
+        ready()
+    async with srv:
+        await srv.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6399)
+    args = parser.parse_args()
+    print(f"mini redis listening on {args.host}:{args.port}", flush=True)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 from app import app, db, User
+from utils.migrations import upgrade
 
-# 使用应用上下文初始化数据库
+# 使用应用上下文初始化数据库（空库直接建表，旧库执行待完成的迁移）
 with app.app_context():
-    db.create_all()
+    upgrade()
     print("数据库初始化完成")
     print("User表结构:", [col.name for col in User.__table__.columns])
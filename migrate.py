@@ -0,0 +1,20 @@
+import argparse
+from app import app
+from utils.migrations import upgrade, current_version, pending_migrations
+
+# 数据库版本迁移（代替 add_type_column.py 等一次性脚本）：
+#   python migrate.py           升级到最新版本
+#   python migrate.py --status  查看当前版本和待执行的迁移
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='数据库版本迁移')
+    parser.add_argument('--status', action='store_true', help='只显示当前版本和待执行的迁移')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.status:
+            print(f"当前版本: {current_version()}")
+            for version, name in pending_migrations():
+                print(f"  待执行: {version:04d}_{name}")
+        else:
+            applied = upgrade()
+            print(f"已执行 {len(applied)} 个迁移，当前版本 {current_version()}")
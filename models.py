@@ -5,11 +5,16 @@ from datetime import datetime
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 
+# 消息ID为 53 位时间有序ID：客户端/服务端数据库用 BIGINT；SQLite 主键必须是 INTEGER 才是 rowid 别名（本身即 64 位）
+MessageId = db.BigInteger().with_variant(db.Integer(), 'sqlite')
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, nullable=False)
     password_hash = db.Column(db.String(60), nullable=False)
     is_admin = db.Column(db.Boolean, default=False, nullable=False) # 添加管理员权限字段
+    # 墓碑：管理员删除用户时先标记，删除任务完成（删除这一行）之前该账号不能登录、请求和连接
+    deleted_at = db.Column(db.DateTime, nullable=True)
     
     def set_password(self, password):
         self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
@@ -20,28 +25,144 @@ class User(db.Model):
     friendships_a = db.relationship('Friendship', foreign_keys='Friendship.user_a_id', backref='user_a', lazy=True)
     friendships_b = db.relationship('Friendship', foreign_keys='Friendship.user_b_id', backref='user_b', lazy=True)
 
+    __table_args__ = (
+        # 管理员目录按是否管理员过滤、按ID翻页（用户名前缀搜索走 username 的唯一索引）
+        db.Index('ix_user_is_admin_id', 'is_admin', 'id'),
+    )
+
 class Friendship(db.Model):
     # 强制 user_a_id < user_b_id 保证唯一性
     user_a_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
     user_b_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
     status = db.Column(db.String(10), default='Accepted') # 简化，假设已是好友
     created_at = db.Column(db.DateTime, default=datetime.utcnow) # 添加创建时间
+
+    __table_args__ = (
+        # 主键以 user_a_id 开头：按 user_b_id 查好友（两个方向的后一半）需要这个索引，否则全表扫描
+        db.Index('ix_friendship_user_b_id', 'user_b_id', 'user_a_id'),
+    )
     
 class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    # user_one_id 和 user_two_id 必须是 Friendship 中的 a/b
-    user_one_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
-    user_two_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    # 单聊：user_one_id 和 user_two_id 必须是 Friendship 中的 a/b；群聊两者为空，成员见 ConversationMember
+    user_one_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=True)
+    user_two_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=True)
     last_message_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 群聊：名称和群主（群主账号删除后为空）
+    is_group = db.Column(db.Boolean, default=False, server_default=db.false(), nullable=False)
+    title = db.Column(db.String(50), nullable=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+
+    __table_args__ = (
+        # 按参与者查会话：(user_one_id, user_two_id) 唯一，并发创建同一会话时由数据库拒绝重复
+        db.Index('ix_conversation_pair', 'user_one_id', 'user_two_id', unique=True),
+        db.Index('ix_conversation_user_two_id', 'user_two_id'),
+    )
     
     # 级联删除消息
     messages = db.relationship('Message', backref='conversation', cascade='all, delete-orphan', lazy='dynamic')
+    # 级联删除摘要和成员计数
+    summary = db.relationship('ConversationSummary', uselist=False, cascade='all, delete-orphan')
+    members = db.relationship('ConversationMember', cascade='all, delete-orphan', lazy=True)
+    # 级联删除归档的消息批次和保留策略
+    archives = db.relationship('MessageArchive', cascade='all, delete-orphan', lazy='dynamic')
+    retention_policy = db.relationship('RetentionPolicy', uselist=False, cascade='all, delete-orphan')
+
+class ConversationSummary(db.Model):
+    # 会话摘要：发送消息时在同一事务内维护，会话列表直接读取，不再扫描 Message 表
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'), primary_key=True)
+    last_message_id = db.Column(MessageId, nullable=True)
+    last_message_preview = db.Column(db.String(200), nullable=True)
+    last_message_type = db.Column(db.String(10), nullable=True)
+    last_sender_id = db.Column(db.Integer, nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=True)
+
+class ConversationMember(db.Model):
+    # 会话参与者及其未读计数（每个参与者一行）；群聊的成员关系也由它表示
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True, index=True)
+    unread_count = db.Column(db.Integer, default=0, nullable=False)
+    # 已读水位：该参与者已读到的最大消息ID，未读数 = 对方发送的 id 大于水位的消息数
+    last_read_message_id = db.Column(MessageId, default=0, nullable=False)
 
 class Message(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(MessageId, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'), nullable=False, index=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     type = db.Column(db.String(10), default='text', nullable=False)  # 添加消息类型字段
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
-    is_read = db.Column(db.Boolean, default=False)
\ No newline at end of file
+    is_read = db.Column(db.Boolean, default=False)  # 旧字段，已读状态改由 ConversationMember.last_read_message_id 表示
+
+    __table_args__ = (
+        # 按会话游标翻页 / 取最后一条消息都按 (conversation_id, timestamp, id) 访问
+        db.Index('ix_message_conversation_timestamp_id', 'conversation_id', 'timestamp', 'id'),
+    )
+
+class DeliveryCursor(db.Model):
+    # 每个用户的投递序号：last_seq 为已分配的最大序号，acked_seq 为客户端确认收到的最大序号
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    last_seq = db.Column(db.Integer, default=0, nullable=False)
+    acked_seq = db.Column(db.Integer, default=0, nullable=False)
+
+class PendingDelivery(db.Model):
+    # 待客户端确认的投递，按 (user_id, seq) 范围查询补发断线期间的消息；确认后删除
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(MessageId, db.ForeignKey('message.id', ondelete='CASCADE'), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'), nullable=False, index=True)
+
+class Job(db.Model):
+    # 后台任务（清空聊天记录 / 删除用户 / 消息归档）：状态和进度持久化，进程崩溃或重启后从当前步骤继续
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)
+    target_id = db.Column(db.Integer, nullable=False)  # 会话ID / 用户ID
+    cutoff_id = db.Column(MessageId, nullable=True)  # 清空聊天记录：只删除这条及之前的消息
+    requested_by = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(10), default='pending', nullable=False)  # pending / running / done / failed
+    step = db.Column(db.Integer, default=0, nullable=False)  # 当前步骤序号
+    progress = db.Column(db.Integer, default=0, nullable=False)  # 已删除 / 归档的消息数
+    cursor = db.Column(db.Integer, default=0, nullable=False)  # 当前步骤内的续传位置（如归档任务处理到的会话ID）
+    total = db.Column(db.Integer, nullable=True)  # 创建时估算的待删除消息数
+    error = db.Column(db.Text, nullable=True)
+    owner = db.Column(db.String(64), nullable=True)  # 执行中的进程
+    lease_until = db.Column(db.DateTime, nullable=True)  # 租约到期后其他进程可接手
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_job_status', 'status'),
+        db.Index('ix_job_kind_target', 'kind', 'target_id'),
+    )
+
+class MessageArchive(db.Model):
+    # 归档的冷消息：同一会话中按 (timestamp, id) 连续的一批消息压缩为一行，
+    # 每个会话的归档消息都早于其仍在 Message 表中的消息，历史记录翻过热表后从这里继续读取
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'), nullable=False)
+    first_id = db.Column(MessageId, nullable=False)
+    first_at = db.Column(db.DateTime, nullable=False)
+    last_id = db.Column(MessageId, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    codec = db.Column(db.String(10), default='zlib', nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (
+        # 按会话和批次的起止位置翻页；按 last_at 找超过删除期限的批次
+        db.Index('ix_message_archive_conversation_first', 'conversation_id', 'first_at', 'first_id'),
+        db.Index('ix_message_archive_last_at', 'last_at'),
+    )
+
+class RetentionPolicy(db.Model):
+    # 单个会话的保留策略，覆盖全局配置（RETENTION_ARCHIVE_AFTER_DAYS / RETENTION_DELETE_AFTER_DAYS）
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'), primary_key=True)
+    archive_after_days = db.Column(db.Integer, nullable=True)  # None 使用全局配置，0 表示不归档
+    delete_after_days = db.Column(db.Integer, nullable=True)  # None 使用全局配置，0 表示永久保留归档
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class StatCounter(db.Model):
+    # 维护的计数（用户数、管理员数），与对应的写入在同一事务内增减，管理员目录读取它而不是 COUNT(*)
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
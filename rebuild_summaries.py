@@ -0,0 +1,10 @@
+from app import app
+from utils.summary import rebuild_summaries
+from utils.migrations import upgrade
+
+# 从 Message 表重建会话摘要和未读计数（崩溃恢复、数据迁移或升级到摘要表后运行一次）
+if __name__ == "__main__":
+    with app.app_context():
+        upgrade()
+        count = rebuild_summaries()
+        print(f"已重建 {count} 个会话的摘要和未读计数")
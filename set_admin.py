@@ -1,5 +1,6 @@
 from models import db, User
 from app import app
+from utils.directory import adjust_counts
 
 def set_admin_user():
     with app.app_context():
@@ -14,6 +15,7 @@ def set_admin_user():
         if existing_user:
             # 如果存在，将其设置为管理员
             existing_user.is_admin = True
+            adjust_counts(admins=1)
             db.session.commit()
             print(f"已将现有用户 {existing_user.username} (ID: {existing_user.id}) 设置为管理员")
         else:
@@ -21,6 +23,7 @@ def set_admin_user():
             admin_user = User(username='admin', is_admin=True)
             admin_user.set_password('admin123456')
             db.session.add(admin_user)
+            adjust_counts(users=1, admins=1)
             db.session.commit()
             print(f"已创建管理员用户: admin (ID: {admin_user.id})")
 
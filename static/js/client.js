@@ -1,20 +1,61 @@
 // 全局状态
 let socket = null;
+// 在线心跳
+const HEARTBEAT_INTERVAL_MS = 30000;
+let heartbeatTimer = null;
+// 投递序号：已连续收到的最大序号，以及收到但前面还有缺口的序号
+const ACK_DELAY_MS = 500;
+const GAP_SYNC_DELAY_MS = 3000;
+let deliverySeq = 0;
+let receivedSeqs = new Set();
+let ackTimer = null;
+let gapTimer = null;
 let currentUserId = null;
 let currentUserName = null;
 let currentConversationId = null;
 let currentReceiverId = null; 
+// 当前会话是否为群聊，以及群成员 ID -> 用户名（群消息气泡显示发送者）
+let currentIsGroup = false;
+let groupMemberNames = {};
+// 账号已删除的发送者（其群聊消息保留）显示的名称
+const DELETED_USER_NAME = '已删除的用户';
 let currentUserIsAdmin = false;
+// 历史消息分页状态：更早一页的游标，以及是否正在加载
+let historyBeforeCursor = null;
+let historyLoading = false;
+// 会话列表：登录 / 重连时从 /api/friends 完整加载，之后按服务端推送的 conversation_updated 增量原地更新
+let conversations = [];
+// 输入状态：最多每 2 秒发送一次（服务端同样按窗口合并），对方的提示显示 3 秒
+const TYPING_SEND_INTERVAL_MS = 2000;
+const TYPING_DISPLAY_MS = 3000;
+let lastTypingSentAt = 0;
+let typingTimer = null;
+let rateLimitTimer = null;
+// 管理员面板的用户目录：按页加载（键集分页），next_cursor 为 null 时没有更多
+const USER_PAGE_SIZE = 50;
+const USER_SEARCH_DELAY_MS = 300;
+let userDirectoryCursor = null;
+let userDirectoryHasMore = false;
+let userDirectoryLoading = false;
+let userDirectoryGeneration = 0;
+let userSearchTimer = null;
+// 消息负载编码：连接时协商，receive_msg / receive_msg_batch / sync 和历史记录的消息为按字段号排列的数组
+// （msgpack 为二进制，未加载 msgpack 库时用 JSON 数组）；字段顺序与服务端 utils/codec.py 的 MESSAGE_FIELDS 一致
+const PAYLOAD_ENCODING = window.MessagePack ? 'msgpack' : 'compact';
+const MESSAGE_FIELDS = ['id', 'conversation_id', 'sender_id', 'type', 'content', 'timestamp', 'seq', 'thumbnail_url'];
+// send_msg_batch 一次最多的消息数（服务端 SEND_MSG_BATCH_MAX）
+const SEND_BATCH_MAX = 20;
 
 // DOM元素引用（在DOMContentLoaded中初始化）
 let messageArea, messageInput, sendButton, conversationList, contactNameDisplay;
 let loginScreen, chatApp, loginButton, loginUsername, loginPassword;
-let logoutButton, searchFriendInput, addFriendButton;
+let logoutButton, searchFriendInput, addFriendButton, createGroupButton;
 // 注册相关元素
 let loginTab, registerTab, loginForm, registerForm, registerButton;
 let registerUsername, registerPassword, registerConfirmPassword;
 // 管理员相关元素
 let adminPanelButton, adminPanel, closeAdminPanelButton, userTableBody;
+let userTableContainer, userTableStatus, userCounts, userSearchInput, userAdminFilter, userOnlineFilter;
 // 清空聊天记录按钮
 let clearChatButton;
 // 图片上传元素
@@ -36,6 +77,7 @@ document.addEventListener('DOMContentLoaded', () => {
     logoutButton = document.getElementById('logout-button');
     searchFriendInput = document.getElementById('search-friend');
     addFriendButton = document.getElementById('add-friend-button');
+    createGroupButton = document.getElementById('create-group-button');
     
     // 初始化注册相关DOM元素
     loginTab = document.getElementById('login-tab');
@@ -52,6 +94,12 @@ document.addEventListener('DOMContentLoaded', () => {
     adminPanel = document.getElementById('admin-panel');
     closeAdminPanelButton = document.getElementById('close-admin-panel');
     userTableBody = document.getElementById('user-table-body');
+    userTableContainer = document.getElementById('user-table-container');
+    userTableStatus = document.getElementById('user-table-status');
+    userCounts = document.getElementById('user-counts');
+    userSearchInput = document.getElementById('user-search');
+    userAdminFilter = document.getElementById('user-admin-filter');
+    userOnlineFilter = document.getElementById('user-online-filter');
     
     // 初始化清空聊天记录按钮
     clearChatButton = document.getElementById('clear-chat-button');
@@ -66,6 +114,7 @@ document.addEventListener('DOMContentLoaded', () => {
     loginButton.addEventListener('click', handleLogin);
     logoutButton.addEventListener('click', handleLogout);
     addFriendButton.addEventListener('click', handleAddFriend);
+    createGroupButton.addEventListener('click', handleCreateGroup);
     clearChatButton.addEventListener('click', handleClearChat);
     
     // 注册相关事件监听
@@ -88,6 +137,26 @@ document.addEventListener('DOMContentLoaded', () => {
     // 管理员面板相关事件监听
     adminPanelButton.addEventListener('click', openAdminPanel);
     closeAdminPanelButton.addEventListener('click', closeAdminPanel);
+    // 用户目录：搜索 / 过滤条件变化时从第一页重新加载，滚动到底部时加载下一页
+    userSearchInput.addEventListener('input', () => {
+        clearTimeout(userSearchTimer);
+        userSearchTimer = setTimeout(resetUserDirectory, USER_SEARCH_DELAY_MS);
+    });
+    userAdminFilter.addEventListener('change', resetUserDirectory);
+    userOnlineFilter.addEventListener('change', resetUserDirectory);
+    userTableContainer.addEventListener('scroll', () => {
+        if (userTableContainer.scrollTop + userTableContainer.clientHeight >= userTableContainer.scrollHeight - 50) {
+            loadUserPage();
+        }
+    });
+    userTableBody.addEventListener('click', handleUserTableClick);
+    
+    // 滚动到顶部附近时加载更早的历史消息
+    messageArea.addEventListener('scroll', () => {
+        if (messageArea.scrollTop < 50) {
+            loadOlderHistory();
+        }
+    });
     
     // 消息发送事件监听
     sendButton.addEventListener('click', handleSendMessage);
@@ -97,8 +166,16 @@ document.addEventListener('DOMContentLoaded', () => {
             handleSendMessage();
         }
     });
+    messageInput.addEventListener('input', sendTyping);
 });
 
+// 用户输入的文本（群名称、用户名、消息预览）插入 innerHTML 模板前转义
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text == null ? '' : String(text);
+    return div.innerHTML.replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+}
+
 // --- 注册相关功能 ---
 function switchTab(tabName) {
     // 重置所有标签和表单
@@ -209,8 +286,10 @@ async function handleLogin() {
                 adminPanelButton.classList.add('hidden');
             }
             
-            // 初始化Socket和加载会话
+            // 初始化Socket和加载会话（投递序号以服务端记录的确认位置为准）
             if (socket) socket.disconnect();
+            deliverySeq = 0;
+            receivedSeqs = new Set();
             initSocket();
             await loadConversations();
             
@@ -247,10 +326,17 @@ async function handleLogout() {
             currentUserName = null;
             currentConversationId = null;
             currentReceiverId = null;
+            currentIsGroup = false;
+            groupMemberNames = {};
+            historyBeforeCursor = null;
+            conversations = [];
+            deliverySeq = 0;
+            receivedSeqs = new Set();
             
             // 清空界面
             conversationList.innerHTML = '';
             messageArea.innerHTML = '';
+            clearTyping();
             contactNameDisplay.textContent = '请先登录并选择会话';
             
             // 禁用发送按钮
@@ -269,21 +355,160 @@ async function handleLogout() {
 
 function initSocket() {
     // 连接 SocketIO，使用当前页面的主机和端口
-    socket = io(); 
+    socket = io({ auth: { encoding: PAYLOAD_ENCODING } }); 
+    let connectedBefore = false;
     
     socket.on('connect', () => {
+        // 重连：断线期间错过的会话列表增量无法补发，完整重新加载一次（消息本身由 sync 补发）
+        if (connectedBefore) {
+            loadConversations();
+            // 群消息没有投递序号，断线期间的消息不会经 sync 补发：重新加载当前群聊的最新一页
+            if (currentIsGroup) reloadCurrentHistory();
+        }
+        connectedBefore = true;
+        // 定时心跳，刷新服务端在线状态（服务端 PRESENCE_TTL 默认 90 秒）
+        clearInterval(heartbeatTimer);
+        heartbeatTimer = setInterval(() => socket.emit('heartbeat'), HEARTBEAT_INTERVAL_MS);
     });
 
     socket.on('disconnect', () => {
+        clearInterval(heartbeatTimer);
+        heartbeatTimer = null;
+    });
+
+    socket.on('receive_msg', data => handleIncomingMessage(decodeMessage(unpack(data))));
+    // 同一批次提交的多条消息合并为一帧
+    socket.on('receive_msg_batch', data => unpack(data).forEach(raw => handleIncomingMessage(decodeMessage(raw))));
+    // 连接后服务端补发上次确认之后的消息
+    socket.on('sync', data => handleSync(decodeSync(unpack(data))));
+    socket.on('receipt', handleReceipt);
+    socket.on('typing', handleTyping);
+    socket.on('conversation_updated', handleConversationUpdated);
+    socket.on('conversation_removed', handleConversationRemoved);
+    // 发送过于频繁时服务端丢弃消息并告知需要等待的时间
+    socket.on('rate_limited', handleRateLimited);
+}
+
+// --- 消息负载解码 ---
+// msgpack 编码的负载为二进制；服务端不支持紧凑编码时仍是 JSON 对象，按类型判断，三种编码都能处理
+function unpack(data) {
+    return data instanceof ArrayBuffer || ArrayBuffer.isView(data) ? MessagePack.decode(data) : data;
+}
+
+// 紧凑数组 -> 与 JSON 编码相同的消息对象；时间戳为 UTC 毫秒，还原为服务端 JSON 中不带时区的 ISO 格式
+function decodeMessage(raw) {
+    if (!Array.isArray(raw)) return raw;
+    const message = {};
+    raw.forEach((value, i) => { if (value !== null && value !== undefined) message[MESSAGE_FIELDS[i]] = value; });
+    message.timestamp = new Date(message.timestamp).toISOString().slice(0, -1);
+    return message;
+}
+
+function decodeSync(raw) {
+    if (!Array.isArray(raw)) return raw;
+    const [messages, last_seq, has_more] = raw;
+    return { messages: messages.map(decodeMessage), last_seq, has_more };
+}
+
+// --- 投递确认 ---
+// 记录收到的序号，推进连续序号并延迟合并发送 ack
+function trackDelivery(seq) {
+    if (seq <= deliverySeq) return;
+    receivedSeqs.add(seq);
+    while (receivedSeqs.has(deliverySeq + 1)) {
+        receivedSeqs.delete(deliverySeq + 1);
+        deliverySeq++;
+    }
+    scheduleAck();
+    // 中间有缺口（推送丢失）时稍后主动补拉
+    clearTimeout(gapTimer);
+    gapTimer = receivedSeqs.size ? setTimeout(() => socket.emit('sync', { after_seq: deliverySeq }), GAP_SYNC_DELAY_MS) : null;
+}
+
+function scheduleAck() {
+    if (ackTimer) return;
+    ackTimer = setTimeout(() => {
+        ackTimer = null;
+        if (socket && deliverySeq > 0) socket.emit('ack', { seq: deliverySeq });
+    }, ACK_DELAY_MS);
+}
+
+// 一次补发的一批消息：逐条渲染，会话列表只刷新一次
+function handleSync(payload) {
+    payload.messages.forEach(msg => renderIncoming(msg));
+    // 服务端已给出截至 last_seq 的全部待确认消息（中间的缺口是已被清空的消息），直接推进
+    if (payload.last_seq > deliverySeq) {
+        deliverySeq = payload.last_seq - 1;
+        trackDelivery(payload.last_seq);
+        receivedSeqs.forEach(seq => { if (seq <= deliverySeq) receivedSeqs.delete(seq); });
+    }
+    if (payload.has_more) {
+        socket.emit('sync', { after_seq: payload.last_seq });
+    } else if (payload.messages.length) {
+        loadConversations();
+    }
+}
+
+// 送达 / 已读回执：更新当前会话中自己发出的消息状态
+function handleReceipt(receipt) {
+    // 群聊的已读回执发给整个群房间，自己的已读不用于更新自己消息的状态
+    if (receipt.conversation_id !== currentConversationId || receipt.user_id === currentUserId) return;
+    const label = receipt.status === 'read' ? '已读' : '已送达';
+    messageArea.querySelectorAll('[data-mine="1"]').forEach(el => {
+        if (Number(el.dataset.messageId) > receipt.message_id) return;
+        const status = el.querySelector('.message-status');
+        if (status && status.textContent !== '已读') status.textContent = label;
     });
+}
 
-    socket.on('receive_msg', handleIncomingMessage);
+// --- 输入状态 / 限流提示 ---
+function sendTyping() {
+    const now = Date.now();
+    if (!socket || !currentReceiverId || !messageInput.value || now - lastTypingSentAt < TYPING_SEND_INTERVAL_MS) return;
+    lastTypingSentAt = now;
+    socket.emit('typing', { receiver_id: currentReceiverId });
+}
+
+function handleTyping(data) {
+    if (data.conversation_id !== currentConversationId) return;
+    const name = contactNameDisplay.dataset.name || contactNameDisplay.textContent;
+    contactNameDisplay.dataset.name = name;
+    contactNameDisplay.textContent = `${name}（正在输入…）`;
+    clearTimeout(typingTimer);
+    typingTimer = setTimeout(clearTyping, TYPING_DISPLAY_MS);
+}
+
+function clearTyping() {
+    clearTimeout(typingTimer);
+    typingTimer = null;
+    if (contactNameDisplay.dataset.name) {
+        contactNameDisplay.textContent = contactNameDisplay.dataset.name;
+        delete contactNameDisplay.dataset.name;
+    }
+}
+
+function handleRateLimited(data) {
+    if (data.event !== 'send_msg') return;
+    const placeholder = messageInput.dataset.placeholder || messageInput.placeholder;
+    messageInput.dataset.placeholder = placeholder;
+    messageInput.placeholder = `发送过于频繁，请 ${Math.ceil(data.retry_after)} 秒后再试（上一条消息未发送）`;
+    clearTimeout(rateLimitTimer);
+    rateLimitTimer = setTimeout(() => {
+        messageInput.placeholder = messageInput.dataset.placeholder;
+        delete messageInput.dataset.placeholder;
+    }, Math.max(1000, data.retry_after * 1000));
+}
+
+// 告诉服务端已读到当前会话中对方的某条消息（服务端合并后批量前移已读水位；加载最新一页历史时由服务端自动记录）
+function reportRead(message) {
+    if (socket && message.sender_id !== currentUserId) {
+        socket.emit('read', { conversation_id: message.conversation_id, message_id: message.id });
+    }
 }
 
 
 // --- 核心逻辑：会话/消息 ---
 async function loadConversations() {
-    conversationList.innerHTML = '';
     const response = await fetch('/api/friends');
     
     // 检查响应是否成功
@@ -291,13 +516,62 @@ async function loadConversations() {
         return;
     }
     
-    const conversations = await response.json();
+    const data = await response.json();
     
     // 确保返回的是数组
-    if (!Array.isArray(conversations)) {
+    if (!Array.isArray(data)) {
         return;
     }
     
+    conversations = data;
+    renderConversations();
+}
+
+// 会话列表增量：更新对应会话的预览 / 未读数并重新排序，不请求服务器；列表中找不到该会话（刚创建 / 刚入群）时完整加载
+function handleConversationUpdated(delta) {
+    const conv = conversations.find(c => c.conversation_id === delta.conversation_id);
+    if (!conv) {
+        loadConversations();
+        return;
+    }
+    // 群聊增量不带各成员的未读数，按其中他人发送的消息条数自行累加
+    const { new_message_senders: senders, ...fields } = delta;
+    Object.assign(conv, fields);
+    if (senders) {
+        conv.unread_count += senders.filter(id => id !== currentUserId).length;
+    }
+    conversations.sort(compareConversations);
+    renderConversations();
+}
+
+// 与服务端 /api/friends 的顺序一致：最后一条消息时间倒序（没有消息的排在最后），再按好友ID
+function compareConversations(a, b) {
+    if (a.last_message_at !== b.last_message_at) {
+        if (!a.last_message_at) return 1;
+        if (!b.last_message_at) return -1;
+        return a.last_message_at < b.last_message_at ? 1 : -1;
+    }
+    // 时间相同时好友在前（按好友ID），群聊在后（按会话ID）
+    if (a.is_group !== b.is_group) return a.is_group ? 1 : -1;
+    return a.is_group ? a.conversation_id - b.conversation_id : a.receiver_id - b.receiver_id;
+}
+
+// 被移出群聊 / 主动退群：从列表中移除，正在查看时清空聊天窗口
+function handleConversationRemoved(data) {
+    conversations = conversations.filter(c => c.conversation_id !== data.conversation_id);
+    if (data.conversation_id === currentConversationId) {
+        currentConversationId = null;
+        currentIsGroup = false;
+        groupMemberNames = {};
+        messageArea.innerHTML = '';
+        historyBeforeCursor = null;
+        contactNameDisplay.textContent = '请选择会话';
+    }
+    renderConversations();
+}
+
+function renderConversations() {
+    conversationList.innerHTML = '';
     conversations.forEach(conv => {
         const item = document.createElement('div');
         item.className = 'p-3 hover:bg-gray-200 border-b cursor-pointer';
@@ -306,12 +580,12 @@ async function loadConversations() {
         }
         item.innerHTML = `
             <div class="flex justify-between items-center">
-                <span class="font-semibold">${conv.receiver_name}</span>
-                ${conv.unread_count > 0 ? `<span class="bg-red-500 text-white text-xs font-bold px-2 py-0.5 rounded-full">${conv.unread_count}</span>` : ''}
+                <span class="font-semibold">${conv.online ? '<span class="inline-block w-2 h-2 bg-green-500 rounded-full mr-1"></span>' : ''}${conv.is_group ? '<i class="fas fa-users text-gray-500 mr-1"></i>' : ''}${escapeHtml(conv.receiver_name)}</span>
+                ${conv.unread_count > 0 && conv.conversation_id !== currentConversationId ? `<span class="bg-red-500 text-white text-xs font-bold px-2 py-0.5 rounded-full">${conv.unread_count}</span>` : ''}
             </div>
-            <p class="text-sm text-gray-500 truncate">${conv.last_message_content}</p>
+            <p class="text-sm text-gray-500 truncate">${escapeHtml(conv.last_message_content)}</p>
         `;
-        item.onclick = () => switchConversation(conv.conversation_id, conv.receiver_id, conv.receiver_name);
+        item.onclick = () => switchConversation(conv.conversation_id, conv.receiver_id, conv.receiver_name, conv.is_group);
         conversationList.appendChild(item);
     });
 }
@@ -345,7 +619,41 @@ async function handleAddFriend() {
     }
 }
 
-async function switchConversation(cid, rid, rname) {
+// 创建群聊：输入群名和以逗号分隔的好友用户名（只能拉好友入群）
+async function handleCreateGroup() {
+    const title = prompt('群聊名称');
+    if (!title || !title.trim()) return;
+    const names = prompt('邀请的好友（用户名，以逗号分隔）') || '';
+    const friendIds = {};
+    conversations.forEach(c => { if (!c.is_group) friendIds[c.receiver_name] = c.receiver_id; });
+    const userIds = [];
+    for (const name of names.split(/[,，]/).map(n => n.trim()).filter(Boolean)) {
+        if (!(name in friendIds)) {
+            alert(`${name} 不是你的好友`);
+            return;
+        }
+        userIds.push(friendIds[name]);
+    }
+
+    try {
+        const response = await fetch('/api/groups', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ title: title.trim(), user_ids: userIds })
+        });
+        const data = await response.json();
+        if (response.ok) {
+            // 成员（包括自己）会收到 conversation_updated，列表据此重新加载
+            switchConversation(data.conversation_id, null, data.title, true);
+        } else {
+            alert(`创建群聊失败: ${data.message}`);
+        }
+    } catch (error) {
+        alert('创建群聊时发生错误');
+    }
+}
+
+async function switchConversation(cid, rid, rname, isGroup = false) {
     if (currentConversationId) {
         // 移除旧的高亮
         document.querySelectorAll('.bg-blue-200').forEach(el => el.classList.remove('bg-blue-200'));
@@ -353,6 +661,9 @@ async function switchConversation(cid, rid, rname) {
 
     currentConversationId = cid;
     currentReceiverId = rid;
+    currentIsGroup = isGroup;
+    groupMemberNames = {};
+    clearTyping();
     contactNameDisplay.textContent = rname;
     
     // 标记当前选中项高亮
@@ -361,37 +672,110 @@ async function switchConversation(cid, rid, rname) {
         selectedItem.classList.add('bg-blue-200');
     }
 
-    // 加载历史消息
+    // 加载最新一页历史消息（尚未建立会话的好友没有历史，首条消息发送时由服务端创建会话）
     messageArea.innerHTML = '';
+    historyBeforeCursor = null;
+    if (!cid) return;
+    if (isGroup) await loadGroupMembers(cid);
+    await reloadCurrentHistory();
+}
+
+// 重新加载当前会话的最新一页历史
+async function reloadCurrentHistory() {
+    const cid = currentConversationId;
     try {
-        const response = await fetch(`/api/history/${cid}`);
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const history = await response.json();
-        // 确保history是数组
-        if (Array.isArray(history)) {
-            history.forEach(msg => appendMessage(msg, msg.sender_id === currentUserId));
-        }
+        const page = await fetchHistoryPage(cid, null);
+        if (cid !== currentConversationId || !page) return;
+        messageArea.innerHTML = '';
+        page.messages.forEach(msg => appendMessage(msg, msg.sender_id === currentUserId));
+        historyBeforeCursor = page.before;
+    } catch (error) {
+    }
+}
+
+// 群成员用户名（消息气泡显示发送者）
+async function loadGroupMembers(cid) {
+    try {
+        const response = await fetch(`/api/groups/${cid}`);
+        if (!response.ok) return;
+        const group = await response.json();
+        if (cid !== currentConversationId) return;
+        group.members.forEach(m => { groupMemberNames[m.id] = m.username; });
+    } catch (error) {
+    }
+}
+
+// 获取一页历史消息；before 为空时获取最新一页
+async function fetchHistoryPage(cid, before) {
+    const url = before
+        ? `/api/history/${cid}?format=${PAYLOAD_ENCODING}&before=${encodeURIComponent(before)}`
+        : `/api/history/${cid}?format=${PAYLOAD_ENCODING}`;
+    const response = await fetch(url);
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    const page = response.headers.get('Content-Type') === 'application/x-msgpack'
+        ? MessagePack.decode(await response.arrayBuffer())
+        : await response.json();
+    // 确保返回的是分页结构
+    if (!page || !Array.isArray(page.messages)) return null;
+    page.messages = page.messages.map(decodeMessage);
+    // 群聊中已不是成员的发送者：退群的成员带用户名，已删除的用户为 null
+    Object.entries(page.senders || {}).forEach(([id, name]) => {
+        if (cid === currentConversationId) groupMemberNames[id] = name || DELETED_USER_NAME;
+    });
+    return page;
+}
+
+// 无限滚动：按需加载更早的一页并插入到顶部，保持当前可视位置不变
+async function loadOlderHistory() {
+    const cid = currentConversationId;
+    if (!cid || !historyBeforeCursor || historyLoading) return;
+    historyLoading = true;
+    try {
+        const page = await fetchHistoryPage(cid, historyBeforeCursor);
+        if (cid !== currentConversationId || !page) return;
+        const previousHeight = messageArea.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        page.messages.forEach(msg => fragment.appendChild(createMessageBubble(msg, msg.sender_id === currentUserId)));
+        messageArea.insertBefore(fragment, messageArea.firstChild);
+        messageArea.scrollTop += messageArea.scrollHeight - previousHeight;
+        historyBeforeCursor = page.before;
     } catch (error) {
+    } finally {
+        historyLoading = false;
     }
 }
 
 function handleIncomingMessage(data) {
     // 1. 渲染消息
-    const isCurrentChat = data.conversation_id === currentConversationId;
-    if (isCurrentChat) {
-        appendMessage(data, data.sender_id === currentUserId);
-    } 
+    const isCurrentChat = renderIncoming(data);
+    // 带序号的是发给自己的投递，需要确认
+    if (data.seq) trackDelivery(data.seq);
     
-    // 2. 更新列表
-    loadConversations(); // 重新加载会话列表以更新未读计数和最新消息
+    // 2. 会话列表的未读计数和最新消息由提交后推送的 conversation_updated 增量更新
     
     // 3. 消息通知（可选：如果不是当前聊天，弹窗/声音提示）
     if (!isCurrentChat && data.sender_id !== currentUserId) {
     }
 }
 
+// 渲染实时推送或补发的消息，返回是否属于当前会话
+function renderIncoming(data) {
+    // 当前选中的好友还没有会话时，用首条消息带回的会话ID补上
+    if (!currentConversationId && currentReceiverId &&
+        (data.sender_id === currentReceiverId || data.sender_id === currentUserId)) {
+        currentConversationId = data.conversation_id;
+    }
+    const isCurrentChat = data.conversation_id === currentConversationId;
+    // 同一条消息可能既被推送又被补发，按消息ID去重
+    if (isCurrentChat && !messageArea.querySelector(`[data-message-id="${data.id}"]`)) {
+        appendMessage(data, data.sender_id === currentUserId);
+        reportRead(data);
+    }
+    return isCurrentChat;
+}
+
 // --- 管理员功能 ---
 function openAdminPanel() {
     if (!currentUserIsAdmin) {
@@ -402,8 +786,8 @@ function openAdminPanel() {
     // 显示管理员面板
     adminPanel.classList.remove('hidden');
     
-    // 加载所有用户信息
-    loadAllUsers();
+    // 加载用户目录的第一页
+    resetUserDirectory();
 }
 
 function closeAdminPanel() {
@@ -411,63 +795,94 @@ function closeAdminPanel() {
     adminPanel.classList.add('hidden');
 }
 
-async function loadAllUsers() {
+function resetUserDirectory() {
+    // 清空列表后从第一页加载；进行中的请求结果按代数丢弃
+    userDirectoryGeneration++;
+    userDirectoryCursor = null;
+    userDirectoryHasMore = true;
+    userDirectoryLoading = false;
+    userTableBody.innerHTML = '';
+    userTableContainer.scrollTop = 0;
+    loadUserPage();
+}
+
+async function loadUserPage() {
+    if (userDirectoryLoading || !userDirectoryHasMore) return;
+    userDirectoryLoading = true;
+    const generation = userDirectoryGeneration;
+    const params = new URLSearchParams({ limit: USER_PAGE_SIZE });
+    const prefix = userSearchInput.value.trim();
+    if (prefix) params.set('q', prefix);
+    if (userAdminFilter.value) params.set('admin', userAdminFilter.value);
+    if (userOnlineFilter.value) params.set('online', userOnlineFilter.value);
+    if (userDirectoryCursor) params.set('cursor', userDirectoryCursor);
+    userTableStatus.textContent = '加载中...';
     try {
-        const response = await fetch('/api/admin/users', {
+        const response = await fetch(`/api/admin/users?${params}`, {
             method: 'GET'
         });
+        if (generation !== userDirectoryGeneration) return;
         
         if (response.ok) {
-            const users = await response.json();
-            
-            // 清空用户列表
-            userTableBody.innerHTML = '';
-            
-            // 渲染用户列表
-            users.forEach(user => {
-                const row = document.createElement('tr');
-                row.innerHTML = `
-                    <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${user.id}</td>
-                    <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${user.username}</td>
-                    <td class="px-6 py-4 whitespace-nowrap">
-                        <span class="px-2 inline-flex text-xs leading-5 font-semibold rounded-full ${user.is_admin ? 'bg-green-100 text-green-800' : 'bg-gray-100 text-gray-800'}">
-                            ${user.is_admin ? '是' : '否'}
-                        </span>
-                    </td>
-                    <td class="px-6 py-4 whitespace-nowrap text-sm font-medium">
-                        <button class="text-blue-600 hover:text-blue-900 toggle-admin-btn" data-user-id="${user.id}" data-current-admin="${user.is_admin}">
-                            ${user.is_admin ? '取消管理员' : '设置为管理员'}
-                        </button>
-                        <button class="ml-2 text-red-600 hover:text-red-900 delete-user-btn" data-user-id="${user.id}" data-username="${user.username}">
-                            删除用户
-                        </button>
-                    </td>
-                `;
-                userTableBody.appendChild(row);
-            });
-            
-            // 添加切换管理员状态的事件监听
-            document.querySelectorAll('.toggle-admin-btn').forEach(btn => {
-                btn.addEventListener('click', (e) => {
-                    const userId = e.target.dataset.userId;
-                    toggleAdminStatus(userId);
-                });
-            });
-            
-            // 添加删除用户的事件监听
-            document.querySelectorAll('.delete-user-btn').forEach(btn => {
-                btn.addEventListener('click', (e) => {
-                    const userId = e.target.dataset.userId;
-                    const username = e.target.dataset.username;
-                    deleteUser(userId, username);
-                });
-            });
+            const data = await response.json();
+            data.users.forEach(appendUserRow);
+            userDirectoryCursor = data.next_cursor;
+            userDirectoryHasMore = data.has_more;
+            userCounts.textContent = `共 ${data.counts.users} 个用户，${data.counts.admins} 个管理员`;
+            userTableStatus.textContent = userDirectoryHasMore ? '' : (userTableBody.children.length ? '没有更多用户' : '没有匹配的用户');
         } else {
             const error = await response.json();
+            userDirectoryHasMore = false;
+            userTableStatus.textContent = '';
             alert(`加载用户列表失败: ${error.message}`);
         }
     } catch (error) {
+        userDirectoryHasMore = false;
+        userTableStatus.textContent = '';
         alert('加载用户列表时发生错误');
+    } finally {
+        if (generation === userDirectoryGeneration) {
+            userDirectoryLoading = false;
+            // 列表还没有填满可滚动区域（或按在线状态过滤时一页为空）时继续加载下一页
+            if (userDirectoryHasMore && userTableContainer.scrollHeight <= userTableContainer.clientHeight + 50) {
+                loadUserPage();
+            }
+        }
+    }
+}
+
+function appendUserRow(user) {
+    const row = document.createElement('tr');
+    row.innerHTML = `
+        <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${user.id}</td>
+        <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">
+            <span class="inline-block w-2 h-2 mr-2 rounded-full ${user.online ? 'bg-green-500' : 'bg-gray-300'}" title="${user.online ? '在线' : '离线'}"></span>${user.username}
+        </td>
+        <td class="px-6 py-4 whitespace-nowrap">
+            <span class="px-2 inline-flex text-xs leading-5 font-semibold rounded-full ${user.is_admin ? 'bg-green-100 text-green-800' : 'bg-gray-100 text-gray-800'}">
+                ${user.is_admin ? '是' : '否'}
+            </span>
+        </td>
+        <td class="px-6 py-4 whitespace-nowrap text-sm font-medium">
+            <button class="text-blue-600 hover:text-blue-900 toggle-admin-btn" data-user-id="${user.id}" data-current-admin="${user.is_admin}">
+                ${user.is_admin ? '取消管理员' : '设置为管理员'}
+            </button>
+            <button class="ml-2 text-red-600 hover:text-red-900 delete-user-btn" data-user-id="${user.id}" data-username="${user.username}">
+                删除用户
+            </button>
+        </td>
+    `;
+    userTableBody.appendChild(row);
+}
+
+function handleUserTableClick(e) {
+    // 切换管理员状态 / 删除用户（事件委托，按页追加的行不必各自绑定）
+    const button = e.target.closest('button');
+    if (!button) return;
+    if (button.classList.contains('toggle-admin-btn')) {
+        toggleAdminStatus(button.dataset.userId);
+    } else if (button.classList.contains('delete-user-btn')) {
+        deleteUser(button.dataset.userId, button.dataset.username);
     }
 }
 
@@ -481,7 +896,7 @@ async function toggleAdminStatus(userId) {
             const data = await response.json();
             
             // 重新加载用户列表以显示更新后的状态
-            loadAllUsers();
+            resetUserDirectory();
         } else {
             const error = await response.json();
             alert(`更新管理员状态失败: ${error.message}`);
@@ -503,11 +918,17 @@ async function deleteUser(userId, username) {
         });
         
         if (response.ok) {
+            // 删除由后台任务分段执行（202），完成后再刷新用户列表
             const data = await response.json();
-            alert(data.message);
+            const job = await waitForJob(data.job);
+            if (job.status === 'failed') {
+                alert(`删除用户失败: ${job.error}`);
+            } else {
+                alert('用户已删除');
+            }
             
             // 重新加载用户列表
-            loadAllUsers();
+            resetUserDirectory();
         } else {
             // 尝试解析JSON错误响应，如果失败则显示通用错误
             try {
@@ -522,6 +943,17 @@ async function deleteUser(userId, username) {
     }
 }
 
+// 轮询后台任务直到完成或失败
+async function waitForJob(job, interval = 1000) {
+    while (job.status === 'pending' || job.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, interval));
+        const response = await fetch(`/api/jobs/${job.id}`);
+        if (!response.ok) break;
+        job = await response.json();
+    }
+    return job;
+}
+
 // --- 清空聊天记录功能 ---
 async function handleClearChat() {
     if (!currentConversationId) {
@@ -540,7 +972,8 @@ async function handleClearChat() {
         });
         
         if (response.ok) {
-            const data = await response.json();
+            // 服务端已清空会话摘要，消息由后台任务删除（202）
+            await response.json();
             
             // 清空消息区域
             messageArea.innerHTML = '';
@@ -558,55 +991,60 @@ async function handleClearChat() {
 
 // --- 图片上传处理 ---
 async function handleImageUpload(e) {
-    const file = e.target.files[0];
-    if (!file || !currentConversationId) return;
+    const files = Array.from(e.target.files);
+    if (!files.length || !(currentReceiverId || currentIsGroup)) return;
+    const target = recipientOf();
 
     try {
-        // 创建FormData对象上传图片
-        const formData = new FormData();
-        formData.append('image', file);
+        // 逐张上传图片到服务器
+        const images = [];
+        for (const file of files) {
+            // 创建FormData对象上传图片
+            const formData = new FormData();
+            formData.append('image', file);
 
-        // 上传图片到服务器
-        const response = await fetch('/api/upload/image', {
-            method: 'POST',
-            body: formData
-        });
+            const response = await fetch('/api/upload/image', {
+                method: 'POST',
+                body: formData
+            });
 
-        if (response.ok) {
+            if (!response.ok) {
+                const error = await response.json();
+                alert(`图片上传失败: ${error.message}`);
+                break;
+            }
             const data = await response.json();
-            const imageUrl = data.image_url;
-
-            // 发送图片消息
-            const messageData = {
-                receiver_id: currentReceiverId,
-                content: imageUrl,
-                type: 'image'
-            };
-            
-            socket.emit('send_msg', messageData);
-            
-            // 清空文件输入
-            imageUpload.value = '';
+            images.push({ content: data.image_url, type: 'image' });
+        }
+
+        // 发送图片消息：一张用 send_msg，多张合并为 send_msg_batch（每批最多 SEND_BATCH_MAX 条）
+        if (images.length === 1) {
+            socket.emit('send_msg', { ...target, ...images[0] });
         } else {
-            const error = await response.json();
-            alert(`图片上传失败: ${error.message}`);
-            // 清空文件输入
-            imageUpload.value = '';
+            for (let i = 0; i < images.length; i += SEND_BATCH_MAX) {
+                socket.emit('send_msg_batch', { ...target, messages: images.slice(i, i + SEND_BATCH_MAX) });
+            }
         }
     } catch (error) {
         alert('图片上传时发生错误');
+    } finally {
         // 清空文件输入
         imageUpload.value = '';
     }
 }
 
 // --- 消息发送 ---
+// 单聊按接收方发送，群聊按会话ID发送
+function recipientOf() {
+    return currentIsGroup ? { conversation_id: currentConversationId } : { receiver_id: currentReceiverId };
+}
+
 function handleSendMessage() {
     const content = messageInput.value.trim();
-    if (!content || !currentConversationId) return;
+    if (!content || !(currentReceiverId || currentIsGroup)) return;
 
     const messageData = {
-        receiver_id: currentReceiverId,
+        ...recipientOf(),
         content: content,
         type: 'text'
     };
@@ -617,8 +1055,18 @@ function handleSendMessage() {
 
 // --- UI 渲染逻辑 (气泡样式) ---
 function appendMessage(message, is_mine) {
+    messageArea.appendChild(createMessageBubble(message, is_mine));
+    // 滚动到底部
+    messageArea.scrollTop = messageArea.scrollHeight; 
+}
+
+function createMessageBubble(message, is_mine) {
     const bubble = document.createElement('div');
     bubble.className = is_mine ? 'flex justify-end' : 'flex justify-start';
+    bubble.dataset.messageId = message.id;
+    if (is_mine) bubble.dataset.mine = '1';
+    // 自己发出的消息显示送达 / 已读状态
+    const status = is_mine ? '<span class="message-status mr-1"></span>' : '';
     
     const contentClasses = is_mine
         ? 'bg-blue-500 text-white p-3 rounded-xl rounded-br-none max-w-xs md:max-w-md shadow-md'
@@ -634,9 +1082,9 @@ function appendMessage(message, is_mine) {
             
         messageContent = `
             <div class="${imgContainerClasses}">
-                <img src="${message.content}" alt="Image" class="max-w-64 max-h-64 rounded-lg shadow-sm hover:shadow-md transition-shadow duration-200 cursor-pointer object-cover" onclick="viewImage('${message.content}')">
+                <img src="${message.thumbnail_url || message.content}" alt="Image" loading="lazy" class="max-w-64 max-h-64 rounded-lg shadow-sm hover:shadow-md transition-shadow duration-200 cursor-pointer object-cover" onclick="viewImage('${message.content}')">
                 <div class="text-xs mt-1 ${is_mine ? 'text-blue-200' : 'text-gray-500'} text-right px-2 py-1">
-                    ${new Date(message.timestamp).toLocaleTimeString()}
+                    ${status}${new Date(message.timestamp).toLocaleTimeString()}
                 </div>
             </div>
         `;
@@ -646,20 +1094,22 @@ function appendMessage(message, is_mine) {
             <div class="${contentClasses}">
                 ${message.content}
                 <div class="text-xs mt-1 ${is_mine ? 'text-blue-200' : 'text-gray-500'} text-right">
-                    ${new Date(message.timestamp).toLocaleTimeString()}
+                    ${status}${new Date(message.timestamp).toLocaleTimeString()}
                 </div>
             </div>
         `;
     }
     
+    // 群聊中他人的消息显示发送者
+    const senderName = currentIsGroup && !is_mine
+        ? `<span class="text-xs text-gray-500 mb-1">${escapeHtml(groupMemberNames[message.sender_id] || message.sender_id)}</span>`
+        : '';
     bubble.innerHTML = `
         <div class="flex flex-col">
-            ${messageContent}
+            ${senderName}${messageContent}
         </div>
     `;
-    messageArea.appendChild(bubble);
-    // 滚动到底部
-    messageArea.scrollTop = messageArea.scrollHeight; 
+    return bubble;
 }
 
 // 图片查看功能
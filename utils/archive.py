@@ -0,0 +1,185 @@
+import json
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import takewhile
+from sqlalchemy import func, tuple_
+from models import db, Message, MessageArchive, RetentionPolicy, PendingDelivery
+from utils.search import unindex_messages
+
+# 归档中读出的消息（只读），字段与 Message 相同，可直接用于 message_to_dict / encode_cursor
+ArchivedMessage = namedtuple('ArchivedMessage', ['id', 'conversation_id', 'sender_id', 'content', 'type', 'timestamp'])
+
+# 归档写入一次、偶尔读取，用最高压缩级别
+COMPRESSION_LEVEL = 9
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+# --- 编码 ---
+def _deltas(values):
+    return [b - a for a, b in zip([0] + values[:-1], values)]
+
+
+def _undeltas(deltas):
+    values, total = [], 0
+    for d in deltas:
+        total += d
+        values.append(total)
+    return values
+
+
+def pack(messages):
+    """
+    把一批消息按列编码后压缩：同一列的值放在一起压缩率更高；
+    消息ID和时间戳（微秒）单调递增，存相邻差值
+    """
+    columns = {
+        'id': _deltas([m.id for m in messages]),
+        'ts': _deltas([(m.timestamp - _EPOCH) // timedelta(microseconds=1) for m in messages]),
+        'sender_id': [m.sender_id for m in messages],
+        'type': [m.type for m in messages],
+        'content': [m.content for m in messages],
+    }
+    return zlib.compress(json.dumps(columns, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+                         COMPRESSION_LEVEL)
+
+
+def unpack(archive):
+    """解压一个归档批次，返回按 (timestamp, id) 正序排列的 ArchivedMessage 列表"""
+    if archive.codec != 'zlib':
+        raise ValueError(f"未知的归档编码: {archive.codec}")
+    columns = json.loads(zlib.decompress(archive.payload))
+    return [
+        ArchivedMessage(message_id, archive.conversation_id, sender_id, content, msg_type,
+                        _EPOCH + timedelta(microseconds=micros))
+        for message_id, micros, sender_id, msg_type, content in zip(
+            _undeltas(columns['id']), _undeltas(columns['ts']),
+            columns['sender_id'], columns['type'], columns['content'])
+    ]
+
+
+# --- 读取（历史记录翻过热表后调用） ---
+def _key(message):
+    return message.timestamp, message.id
+
+
+def read_before(conversation_id, key, limit):
+    """归档中早于 key=(timestamp, id) 的最多 limit 条消息，按时间倒序；key 为 None 时从最新的消息开始"""
+    messages = []
+    while len(messages) < limit:
+        query = MessageArchive.query.filter(MessageArchive.conversation_id == conversation_id)
+        if key is not None:
+            query = query.filter(tuple_(MessageArchive.first_at, MessageArchive.first_id) < tuple_(*key))
+        archive = query.order_by(MessageArchive.first_at.desc(), MessageArchive.first_id.desc()).first()
+        if archive is None:
+            break
+        batch = [m for m in reversed(unpack(archive)) if key is None or _key(m) < key]
+        messages.extend(batch[:limit - len(messages)])
+        key = (archive.first_at, archive.first_id)
+    return messages
+
+
+def read_after(conversation_id, key, limit):
+    """归档中晚于 key=(timestamp, id) 的最多 limit 条消息，按时间正序"""
+    base = MessageArchive.query.filter(MessageArchive.conversation_id == conversation_id)
+    first = tuple_(MessageArchive.first_at, MessageArchive.first_id)
+    messages = []
+    # 游标所在的批次（各批次范围不重叠）：只有它还有更晚的消息时才解压
+    head = base.filter(first <= tuple_(*key)).order_by(MessageArchive.first_at.desc(),
+                                                        MessageArchive.first_id.desc()).first()
+    if head is not None and (head.last_at, head.last_id) > key:
+        messages = [m for m in unpack(head) if _key(m) > key]
+    while len(messages) < limit:
+        archive = base.filter(first > tuple_(*key)).order_by(MessageArchive.first_at.asc(),
+                                                              MessageArchive.first_id.asc()).first()
+        if archive is None:
+            break
+        messages.extend(unpack(archive))
+        key = (archive.first_at, archive.first_id)
+    return messages[:limit]
+
+
+def latest_archived(conversation_id):
+    """会话归档中的最后一条消息（热表中没有消息时用于重建摘要），没有归档时返回 None"""
+    archive = MessageArchive.query.filter_by(conversation_id=conversation_id)\
+        .order_by(MessageArchive.first_at.desc(), MessageArchive.first_id.desc()).first()
+    return unpack(archive)[-1] if archive is not None else None
+
+
+# --- 保留策略 ---
+def load_policies(config):
+    """
+    返回 (全局归档天数, 全局删除天数, {会话ID: (归档天数, 删除天数)})。
+    会话策略中为 None 的项已替换为全局值；天数为 0 表示不归档 / 不删除。
+    """
+    archive_days = config.get('RETENTION_ARCHIVE_AFTER_DAYS', 0)
+    delete_days = config.get('RETENTION_DELETE_AFTER_DAYS', 0)
+    overrides = {
+        policy.conversation_id: (
+            archive_days if policy.archive_after_days is None else policy.archive_after_days,
+            delete_days if policy.delete_after_days is None else policy.delete_after_days,
+        )
+        for policy in RetentionPolicy.query.all()
+    }
+    return archive_days, delete_days, overrides
+
+
+def retention_enabled(config):
+    """全局或任一会话配置了归档 / 删除期限"""
+    archive_days, delete_days, overrides = load_policies(config)
+    return bool(archive_days or delete_days or any(a or d for a, d in overrides.values()))
+
+
+def policy_to_dict(policy):
+    return {
+        'conversation_id': policy.conversation_id,
+        'archive_after_days': policy.archive_after_days,
+        'delete_after_days': policy.delete_after_days,
+        'updated_at': policy.updated_at.isoformat()
+    }
+
+
+# --- 归档 ---
+def archive_conversation(conversation_id, cutoff_at, limit, batch_size):
+    """
+    把会话中早于 cutoff_at 的消息按 (timestamp, id) 顺序每 batch_size 条压缩为一个批次（不提交），
+    最多归档 limit 条（至少一批），返回归档的消息数。
+    - 只归档满批：不足一批的冷消息留在热表中，攒满后再归档（每个会话最多留下 batch_size - 1 条）
+    - 归档的总是会话最早的一段消息，热表中剩下的都比归档晚，历史记录可以先读热表再接着读归档
+    - 仍在待确认投递中的消息（离线用户尚未收到）及其之后的消息不归档，补发时仍从 Message 表读取
+    """
+    count = max(1, limit // batch_size) * batch_size
+    rows = db.session.query(Message.id, Message.sender_id, Message.content, Message.type, Message.timestamp)\
+        .filter(Message.conversation_id == conversation_id, Message.timestamp < cutoff_at)\
+        .order_by(Message.timestamp.asc(), Message.id.asc()).limit(count).all()
+    pending = db.session.query(func.min(PendingDelivery.message_id))\
+        .filter(PendingDelivery.conversation_id == conversation_id).scalar()
+    if pending is not None:
+        rows = list(takewhile(lambda row: row.id < pending, rows))
+    rows = rows[:len(rows) // batch_size * batch_size]
+    if not rows:
+        return 0
+
+    ids = [row.id for row in rows]
+    unindex_messages(ids)
+    deleted = Message.query.filter(Message.id.in_(ids)).delete(synchronize_session=False)
+    if deleted != len(ids):
+        # 另一个进程同时归档 / 删除了这些消息：放弃本段，避免写入重复的批次
+        raise RuntimeError(f"会话 {conversation_id} 的消息已被其他任务修改")
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        db.session.add(MessageArchive(
+            conversation_id=conversation_id,
+            first_id=batch[0].id, first_at=batch[0].timestamp,
+            last_id=batch[-1].id, last_at=batch[-1].timestamp,
+            message_count=len(batch), codec='zlib', payload=pack(batch)
+        ))
+    return len(rows)
+
+
+def get_stats():
+    batches, messages, size = db.session.query(
+        func.count(MessageArchive.id), func.sum(MessageArchive.message_count),
+        func.sum(func.length(MessageArchive.payload))).one()
+    return {'batches': batches, 'messages': messages or 0, 'bytes': size or 0}
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict, Counter, namedtuple
+from models import db, User, bcrypt
+from utils.green import create_semaphore, run_blocking
+
+# 鉴权所需的用户信息，请求中代替 User 对象使用
+Principal = namedtuple('Principal', ['id', 'username', 'is_admin'])
+
+
+class AuthService:
+    """
+    鉴权层：
+    - 按用户ID缓存 Principal（进程内 LRU + 短 TTL），管理员接口不再每次查 User 表；
+      修改管理员权限 / 删除用户时调用 invalidate（多进程部署时经集群广播到各进程），TTL 兜底
+    - bcrypt 校验 / 生成哈希在原生线程中执行（并发数 AUTH_HASH_WORKERS），登录高峰时不阻塞 hub 上的其他连接
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.socketio = None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        self.socketio = socketio
+        self.ttl = app.config.get('AUTH_CACHE_TTL', 30)
+        self.maxsize = app.config.get('AUTH_CACHE_SIZE', 10000)
+        workers = app.config.get('AUTH_HASH_WORKERS', 2)
+        self._hash_slots = create_semaphore(socketio, workers) if workers > 0 else None
+
+    # --- Principal 缓存 ---
+    def get_principal(self, user_id):
+        """返回用户的 Principal，用户不存在或正在删除时返回 None（不缓存不存在的用户）"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._data.move_to_end(user_id)
+                self.stats['hits'] += 1
+                return entry[0]
+        self.stats['misses'] += 1
+        row = db.session.query(User.id, User.username, User.is_admin)\
+            .filter(User.id == user_id, User.deleted_at.is_(None)).first()
+        if row is None:
+            return None
+        principal = Principal(row.id, row.username, bool(row.is_admin))
+        self.remember(principal)
+        return principal
+
+    def remember(self, principal):
+        """写入缓存（登录成功时直接放入，省去下一次请求的查询）"""
+        with self._lock:
+            self._data[principal.id] = (principal, time.monotonic() + self.ttl)
+            self._data.move_to_end(principal.id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._data.pop(user_id, None)
+        self.stats['invalidations'] += 1
+
+    # --- 密码 ---
+    def _blocking(self, fn, *args):
+        if self._hash_slots is None:
+            # AUTH_HASH_WORKERS=0：在请求协程中直接计算（旧行为，仅用于对比）
+            return fn(*args)
+        with self._hash_slots:
+            return run_blocking(self.socketio, fn, *args)
+
+    def check_password(self, password_hash, password):
+        self.stats['password_checks'] += 1
+        return self._blocking(bcrypt.check_password_hash, password_hash, password)
+
+    def hash_password(self, password):
+        return self._blocking(bcrypt.generate_password_hash, password).decode('utf-8')
+
+    def get_stats(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            'size': len(self._data),
+            'hits': self.stats['hits'],
+            'misses': self.stats['misses'],
+            'invalidations': self.stats['invalidations'],
+            'password_checks': self.stats['password_checks'],
+            'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else 0.0
+        }
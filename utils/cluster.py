@@ -0,0 +1,88 @@
+import json
+import logging
+import uuid
+from collections import Counter
+import redis
+
+logger = logging.getLogger(__name__)
+
+# 进程间广播使用的 Redis 频道
+CHANNEL = 'lightchat:cluster'
+
+
+class ClusterBus:
+    """
+    进程间事件广播（如缓存失效）：
+    - 配置 SOCKETIO_MESSAGE_QUEUE 为 redis:// 地址时，经 Redis 发布/订阅通知其他进程
+    - 未配置时只在本进程内执行处理函数
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.socketio = None
+        self._redis = None
+        self._handlers = {}
+        self._task = None
+        # 用于忽略自己发出的广播（本进程已在 publish 时直接执行）
+        self.origin = uuid.uuid4().hex
+        self.stats = Counter()
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        self.socketio = socketio
+        url = app.config.get('SOCKETIO_MESSAGE_QUEUE')
+        if not url:
+            return
+        if not url.startswith(('redis://', 'rediss://', 'unix://')):
+            logger.warning(f"进程间广播仅支持 Redis 消息队列，当前为 {url}，缓存失效不会同步到其他进程")
+            return
+        self._redis = redis.Redis.from_url(url)
+        self._task = socketio.start_background_task(self._listen)
+
+    @property
+    def enabled(self):
+        return self._redis is not None
+
+    def on(self, name):
+        """注册事件处理函数（装饰器）"""
+        def decorator(handler):
+            self._handlers[name] = handler
+            return handler
+        return decorator
+
+    def publish(self, name, *args):
+        """在本进程执行处理函数，并广播给其他进程"""
+        self._dispatch(name, args)
+        if self._redis is None:
+            return
+        try:
+            self._redis.publish(CHANNEL, json.dumps({'origin': self.origin, 'name': name, 'args': args}))
+            self.stats['published'] += 1
+        except Exception as e:
+            self.stats['publish_errors'] += 1
+            logger.error(f"广播 {name} 失败: {e}")
+
+    def _dispatch(self, name, args):
+        handler = self._handlers.get(name)
+        if handler is None:
+            logger.warning(f"未注册的集群事件: {name}")
+            return
+        try:
+            handler(*args)
+        except Exception as e:
+            logger.error(f"处理集群事件 {name} 失败: {e}")
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                for item in pubsub.listen():
+                    event = json.loads(item['data'])
+                    if event.get('origin') == self.origin:
+                        continue
+                    self.stats['received'] += 1
+                    self._dispatch(event['name'], event.get('args', []))
+            except Exception as e:
+                logger.error(f"集群广播订阅中断，1 秒后重连: {e}")
+                self.socketio.sleep(1)
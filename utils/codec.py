@@ -0,0 +1,146 @@
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from engineio import packet as eio_packet
+from socketio import packet as sio_packet
+from utils.outbound import check_socketio_internals
+
+try:
+    import msgpack
+except ImportError:  # 未安装 msgpack 时只提供 compact（JSON 数组）编码，请求 msgpack 的连接退回 compact
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# 连接可协商的编码：json（默认，字典）、compact（JSON 数组）、msgpack（compact 数组再按 msgpack 打包为二进制）
+ENCODINGS = ('json', 'compact', 'msgpack')
+# 紧凑编码的消息字段顺序（下标即字段号），末尾为空的字段省略；timestamp 为 UTC 毫秒整数
+MESSAGE_FIELDS = ('id', 'conversation_id', 'sender_id', 'type', 'content', 'timestamp', 'seq', 'thumbnail_url')
+# 携带消息的事件，只有这些事件按连接的编码重新编码，其他事件（回执、会话列表增量等）照常发送 JSON
+MESSAGE_EVENTS = frozenset(('receive_msg', 'receive_msg_batch', 'sync'))
+
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def compact_message(dto):
+    """消息 DTO（message_to_dict 的结果）-> 按 MESSAGE_FIELDS 排列的数组"""
+    row = [dto.get(field) for field in MESSAGE_FIELDS]
+    row[5] = (datetime.fromisoformat(dto['timestamp']) - EPOCH) // MILLISECOND
+    while row[-1] is None:
+        row.pop()
+    return row
+
+
+def compact_payload(event, data):
+    """MESSAGE_EVENTS 中事件的紧凑负载"""
+    if event == 'receive_msg':
+        return compact_message(data)
+    if event == 'receive_msg_batch':
+        return [compact_message(dto) for dto in data]
+    # sync: [消息数组, last_seq, has_more]
+    return [[compact_message(dto) for dto in data['messages']], data['last_seq'], data['has_more']]
+
+
+def encode(payload, encoding):
+    """按编码打包紧凑负载：msgpack 为 bytes（Socket.IO 以二进制附件发送），compact 原样发送"""
+    return msgpack.packb(payload) if encoding == 'msgpack' else payload
+
+
+def negotiate(requested):
+    """客户端请求的编码 -> 实际使用的编码（未知编码为 json，未安装 msgpack 时 msgpack 退回 compact）"""
+    if requested not in ENCODINGS:
+        return 'json'
+    if requested == 'msgpack' and msgpack is None:
+        return 'compact'
+    return requested
+
+
+class _EncodedText(str):
+    """已编码的 JSON 包文本，带上原始 Socket.IO 包：发给紧凑编码的连接时据此重新编码，不必再解析 JSON"""
+
+
+class SocketCodec:
+    """
+    按连接协商的紧凑负载编码（连接时 auth / 查询参数 encoding=compact|msgpack）：
+    - emit 照常调用，携带消息的事件（MESSAGE_EVENTS）编码 JSON 时在包文本上记下原始数据
+    - 逐连接发包时，紧凑编码的连接改发紧凑编码的包；同一次 emit（如发到房间）只重新编码一次
+    - 字段名换成数组下标、时间戳换成毫秒整数，msgpack 再省去 JSON 的引号和分隔符
+    通过替换 Socket.IO 服务端的 packet_class 和逐连接发包的方法实现（经消息队列转发的跨进程推送同样经过这里）；
+    python-socketio 版本不提供这些方法时启动失败（见 check_socketio_internals）。
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.socketio = None
+        self._encodings = {}  # eio sid -> 非 json 的编码
+        self._eio_sids = {}  # sid -> eio sid（断开时清除）
+        self.enabled = False
+        self.stats = Counter()
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        self.socketio = socketio
+        if not app.config.get('SOCKET_COMPACT_ENCODING', True):
+            return
+        server = socketio.server
+        check_socketio_internals(server, ('packet_class', '_send_eio_packet', 'manager.eio_sid_from_sid'))
+        self.enabled = True
+        base = server.packet_class
+
+        class CodecPacket(base):
+            def encode(pkt):
+                encoded = super().encode()
+                if isinstance(encoded, str) and pkt.packet_type == sio_packet.EVENT \
+                        and pkt.data and pkt.data[0] in MESSAGE_EVENTS:
+                    encoded = _EncodedText(encoded)
+                    encoded.packet = pkt
+                return encoded
+
+        self._packet_class = base
+        server.packet_class = CodecPacket
+        send_eio_packet = server._send_eio_packet
+
+        def send(eio_sid, pkt):
+            encoding = self._encodings.get(eio_sid)
+            source = getattr(pkt.data, 'packet', None) if encoding else None
+            if source is None:
+                return send_eio_packet(eio_sid, pkt)
+            for compact in self._encode_packet(source, encoding):
+                send_eio_packet(eio_sid, compact)
+
+        server._send_eio_packet = send
+
+    def accept(self, sid, requested, namespace='/'):
+        """连接建立时记录协商结果，返回实际使用的编码"""
+        encoding = negotiate(requested) if self.enabled else 'json'
+        if encoding != 'json':
+            eio_sid = self.socketio.server.manager.eio_sid_from_sid(sid, namespace)
+            self._eio_sids[sid] = eio_sid
+            self._encodings[eio_sid] = encoding
+        self.stats[f'{encoding}_connections'] += 1
+        return encoding
+
+    def forget(self, sid):
+        """连接断开时清除"""
+        eio_sid = self._eio_sids.pop(sid, None)
+        if eio_sid is not None:
+            self._encodings.pop(eio_sid, None)
+
+    def _encode_packet(self, source, encoding):
+        """原始包按编码重新编码后的 Engine.IO 包（缓存在原始包上，房间内的连接共用）"""
+        cache = source.__dict__.setdefault('_codec_cache', {})
+        packets = cache.get(encoding)
+        if packets is None:
+            event, data = source.data[0], source.data[1]
+            pkt = self._packet_class(sio_packet.EVENT, namespace=source.namespace,
+                                     data=[event, encode(compact_payload(event, data), encoding)])
+            encoded = pkt.encode()
+            packets = cache[encoding] = [eio_packet.Packet(eio_packet.MESSAGE, p)
+                                         for p in (encoded if isinstance(encoded, list) else [encoded])]
+            self.stats[f'{encoding}_packets'] += 1
+        return packets
+
+    def get_stats(self):
+        return dict(self.stats, enabled=self.enabled, msgpack=msgpack is not None,
+                    compact_connections_open=len(self._encodings))
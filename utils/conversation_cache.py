@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict, Counter
+from utils.redis_helpers import cache_get, cache_set, cache_delete
+
+# Redis 中会话映射的过期时间（秒）
+REDIS_TTL = 24 * 3600
+
+
+class ConversationCache:
+    """
+    (user_one_id, user_two_id) -> conversation_id 的进程内 LRU 缓存，可选 Redis 作为二级缓存。
+    键总是按 (较小ID, 较大ID) 排序。
+    """
+
+    def __init__(self, maxsize=10000, use_redis=True):
+        self.maxsize = maxsize
+        self.use_redis = use_redis
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    @staticmethod
+    def _key(user_one_id, user_two_id):
+        return min(user_one_id, user_two_id), max(user_one_id, user_two_id)
+
+    @staticmethod
+    def _redis_key(pair):
+        return f"conv:{pair[0]}:{pair[1]}"
+
+    def get(self, user_one_id, user_two_id):
+        """查找会话ID，未命中返回 None"""
+        pair = self._key(user_one_id, user_two_id)
+        with self._lock:
+            conv_id = self._data.get(pair)
+            if conv_id is not None:
+                self._data.move_to_end(pair)
+                self.stats['hits'] += 1
+                return conv_id
+        if self.use_redis:
+            value = cache_get(self._redis_key(pair))
+            if value is not None:
+                self.stats['redis_hits'] += 1
+                self._remember(pair, int(value))
+                return int(value)
+        self.stats['misses'] += 1
+        return None
+
+    def set(self, user_one_id, user_two_id, conversation_id):
+        pair = self._key(user_one_id, user_two_id)
+        self._remember(pair, conversation_id)
+        if self.use_redis:
+            cache_set(self._redis_key(pair), conversation_id, REDIS_TTL)
+
+    def invalidate(self, user_one_id, user_two_id):
+        """删除某对用户的缓存（删除好友 / 清空记录 / 删除用户时调用）"""
+        pair = self._key(user_one_id, user_two_id)
+        with self._lock:
+            self._data.pop(pair, None)
+        if self.use_redis:
+            cache_delete(self._redis_key(pair))
+        self.stats['invalidations'] += 1
+
+    def invalidate_user(self, user_id, partner_ids=()):
+        """删除某用户参与的全部缓存；partner_ids 用于同时清理 Redis 中的键"""
+        with self._lock:
+            pairs = [pair for pair in self._data if user_id in pair]
+            for pair in pairs:
+                del self._data[pair]
+        if self.use_redis:
+            cache_delete(*(self._redis_key(self._key(user_id, p)) for p in partner_ids))
+        self.stats['invalidations'] += len(pairs)
+
+    def get_stats(self):
+        """命中率统计"""
+        lookups = self.stats['hits'] + self.stats['redis_hits'] + self.stats['misses']
+        hits = self.stats['hits'] + self.stats['redis_hits']
+        return {
+            'size': len(self._data),
+            'hits': self.stats['hits'],
+            'redis_hits': self.stats['redis_hits'],
+            'misses': self.stats['misses'],
+            'invalidations': self.stats['invalidations'],
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0
+        }
+
+    def _remember(self, pair, conversation_id):
+        with self._lock:
+            self._data[pair] = conversation_id
+            self._data.move_to_end(pair)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
@@ -0,0 +1,70 @@
+import logging
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(config):
+    """
+    按数据库类型生成 SQLAlchemy 引擎参数（连接池大小、溢出、获取超时对两种数据库都生效）：
+    - SQLite（单机）：连接级 busy timeout，写锁被占用时等待而不是立即报 database is locked
+    - 客户端/服务端数据库（PostgreSQL / MySQL 等）：另设连接回收时间，并在取出连接前 pre-ping，
+      数据库重启或连接被中间件断开后自动换新连接
+    """
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+    if is_sqlite(config['SQLALCHEMY_DATABASE_URI']):
+        options['connect_args'] = {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0}
+    else:
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+        options['pool_pre_ping'] = True
+    return options
+
+
+def sqlite_pragmas(config):
+    """每个新 SQLite 连接执行的 PRAGMA（WAL：读写互不阻塞，只有写者之间串行）"""
+    return {
+        'journal_mode': 'WAL' if config['SQLITE_WAL'] else 'DELETE',
+        # WAL 下 NORMAL 只在检查点时 fsync，掉电可能丢最后几个事务但不会损坏数据库
+        'synchronous': config['SQLITE_SYNCHRONOUS'],
+        'busy_timeout': config['SQLITE_BUSY_TIMEOUT_MS'],
+        # 负数表示 KiB
+        'cache_size': -config['SQLITE_CACHE_SIZE_KB'],
+        'temp_store': 'MEMORY',
+        'mmap_size': config['SQLITE_MMAP_SIZE'],
+    }
+
+
+def configure_engine(engine, config):
+    """为引擎注册连接初始化（SQLite 设置 PRAGMA；其他数据库无需处理）"""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def init_app(app, db):
+    """代替 db.init_app(app)：按数据库类型填入引擎参数，再为创建好的引擎注册连接初始化"""
+    options = engine_options(app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine, app.config)
+        logger.info(f"数据库: {db.engine.url.render_as_string(hide_password=True)} ({db.engine.dialect.name})")
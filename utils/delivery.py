@@ -0,0 +1,25 @@
+from models import db, Message, DeliveryCursor, PendingDelivery
+
+# 一次 sync 补发的最大条数，超过时客户端按 last_seq 继续请求
+SYNC_BATCH_SIZE = 200
+
+
+def fetch_pending(user_id, after_seq=0, limit=SYNC_BATCH_SIZE):
+    """
+    取某用户序号大于 after_seq 的待确认消息：一次主键查询游标 + 一次 (user_id, seq) 范围查询，
+    与会话数量无关。返回 ([(seq, Message)], last_seq, has_more)；
+    last_seq 为本批最后一条的序号，没有更多时为已分配的最大序号（跳过已被清空的消息）。
+    """
+    cursor = db.session.get(DeliveryCursor, user_id)
+    if cursor is None:
+        return [], 0, False
+    floor = max(after_seq or 0, cursor.acked_seq)
+    rows = db.session.query(PendingDelivery.seq, Message)\
+        .join(Message, Message.id == PendingDelivery.message_id)\
+        .filter(PendingDelivery.user_id == user_id, PendingDelivery.seq > floor)\
+        .order_by(PendingDelivery.seq.asc())\
+        .limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    last_seq = rows[-1][0] if has_more else max(cursor.last_seq, floor)
+    return rows, last_seq, has_more
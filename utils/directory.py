@@ -0,0 +1,136 @@
+from sqlalchemy import func, insert, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, User, StatCounter
+from utils.history import InvalidCursor
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# 按在线状态过滤时逐批查询在线状态（Redis 一次管道），一页最多检查的用户数；检查完仍不满一页时返回已找到的和游标
+ONLINE_SCAN_BATCH = 500
+ONLINE_SCAN_LIMIT = 5000
+# 用户名前缀范围的上界（大于任何实际字符），username >= q AND username < q + _PREFIX_END 走唯一索引
+_PREFIX_END = '\U0010ffff'
+
+# 维护的计数 -> 重新计算的查询（计数行不存在或对账时使用）
+COUNTERS = {
+    'users': lambda: db.session.query(func.count(User.id)),
+    'admins': lambda: db.session.query(func.count(User.id)).filter(User.is_admin == True),  # noqa: E712
+}
+
+
+# 支持 INSERT ... ON CONFLICT DO NOTHING 的数据库；其他数据库（MySQL）用 INSERT IGNORE
+_INSERT_IGNORE = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+
+
+def _increment(name, delta):
+    return db.session.execute(update(StatCounter).where(StatCounter.name == name)
+                              .values(value=StatCounter.value + delta)).rowcount
+
+
+def _insert_if_missing(name, value):
+    """插入计数行，已存在时什么都不做（不报主键冲突）；返回是否插入"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect in _INSERT_IGNORE:
+        statement = _INSERT_IGNORE[dialect](StatCounter).values(name=name, value=value)\
+            .on_conflict_do_nothing(index_elements=['name'])
+    else:
+        statement = insert(StatCounter).values(name=name, value=value).prefix_with('IGNORE', dialect='mysql')
+    return db.session.execute(statement).rowcount > 0
+
+
+def adjust_counts(**deltas):
+    """
+    在当前事务内增减计数（不提交），如 adjust_counts(users=1, admins=1)，与增删用户 / 修改权限一起提交。
+    计数行由迁移 / 建库时写入；不存在时（直接 db.create_all 建的库）按 User 表初始化，其中已包含本事务的修改。
+    两个首次写入并发时只有一个能插入，另一个等它提交后按已插入的行增减
+    """
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        if _increment(name, delta):
+            continue
+        db.session.flush()
+        if not _insert_if_missing(name, COUNTERS[name]().scalar()):
+            # 并发的另一个事务已插入计数行（按它提交时的 User 表计算，不含本事务的修改）
+            _increment(name, delta)
+
+
+def get_counts():
+    """{计数名: 值}，一次主键查询；还没有计数行时按 User 表计算（只会发生在还没有用户变动的新库上）"""
+    counts = dict(db.session.query(StatCounter.name, StatCounter.value))
+    for name, count in COUNTERS.items():
+        if name not in counts:
+            counts[name] = count().scalar()
+    return counts
+
+
+def rebuild_counts():
+    """按 User 表重新计算全部计数（迁移或对账时运行，不提交），返回 {计数名: 值}"""
+    counts = {name: count().scalar() for name, count in COUNTERS.items()}
+    for name, value in counts.items():
+        db.session.merge(StatCounter(name=name, value=value))
+    return counts
+
+
+def parse_flag(value):
+    """查询参数 '1' / 'true' -> True，'0' / 'false' -> False，其他（未指定）-> None"""
+    if value in ('1', 'true'):
+        return True
+    if value in ('0', 'false'):
+        return False
+    return None
+
+
+def list_users(presence, prefix=None, admin=None, online=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    管理员目录的一页，键集分页，返回 (用户列表, next_cursor)；没有更多时 next_cursor 为 None。
+    - 不带 prefix 按ID排序，游标为最后一个ID；带 prefix 时按用户名前缀（区分大小写）搜索并按用户名排序，游标为最后一个用户名
+    - admin 为 True / False 时只返回管理员 / 非管理员
+    - online 为 True / False 时逐批查询在线状态后过滤：检查了 ONLINE_SCAN_LIMIT 个用户仍不满一页时返回已找到的，
+      next_cursor 指向检查到的位置（之后的页可能为空）
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = db.session.query(User.id, User.username, User.is_admin)
+    if admin is not None:
+        query = query.filter(User.is_admin == admin)
+    if prefix:
+        query = query.filter(User.username >= prefix, User.username < prefix + _PREFIX_END)
+        column, key = User.username, (lambda row: row.username)
+        after = cursor
+    else:
+        column, key = User.id, (lambda row: row.id)
+        try:
+            after = int(cursor) if cursor is not None else None
+        except ValueError:
+            raise InvalidCursor(cursor)
+    query = query.order_by(column)
+
+    def fetch(after, count):
+        return (query if after is None else query.filter(column > after)).limit(count).all()
+
+    def to_dict(row, is_online):
+        return {'id': row.id, 'username': row.username, 'is_admin': row.is_admin, 'online': is_online}
+
+    if online is None:
+        rows = fetch(after, limit + 1)
+        page = rows[:limit]
+        online_ids = presence.online_users([row.id for row in page]) if page else set()
+        next_cursor = str(key(page[-1])) if len(rows) > limit else None
+        return [to_dict(row, row.id in online_ids) for row in page], next_cursor
+
+    # 与不过滤时一样多找一个符合条件的用户：找到才说明还有下一页，恰好填满一页时不返回游标
+    page, scanned = [], 0
+    while scanned < ONLINE_SCAN_LIMIT:
+        rows = fetch(after, ONLINE_SCAN_BATCH)
+        online_ids = presence.online_users([row.id for row in rows]) if rows else set()
+        for row in rows:
+            scanned += 1
+            if (row.id in online_ids) == online:
+                if len(page) == limit:
+                    return page, str(after)
+                page.append(to_dict(row, online))
+            after = key(row)
+        if len(rows) < ONLINE_SCAN_BATCH:
+            return page, None
+    return page, str(after)
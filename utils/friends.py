@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict, Counter
+from models import db, User, Friendship
+
+
+def load_friends(user_id):
+    """从数据库读取用户的好友 {friend_id: username}（两个方向各走一个索引，一次查询）"""
+    as_a = db.session.query(Friendship.user_b_id, User.username)\
+        .join(User, User.id == Friendship.user_b_id)\
+        .filter(Friendship.user_a_id == user_id, Friendship.status == 'Accepted')
+    as_b = db.session.query(Friendship.user_a_id, User.username)\
+        .join(User, User.id == Friendship.user_a_id)\
+        .filter(Friendship.user_b_id == user_id, Friendship.status == 'Accepted')
+    return dict(as_a.union_all(as_b).all())
+
+
+class FriendGraph:
+    """
+    好友关系邻接表的进程内 LRU 缓存（user_id -> {friend_id: username}）：
+    发送消息校验接收方、建群校验成员、添加好友查重都不再查库；
+    添加 / 删除好友、删除用户时经集群广播（friend_graph）让双方的缓存在各进程失效。
+    返回的字典由缓存共用，调用方不要修改。
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def friends(self, user_id):
+        """用户的好友 {friend_id: username}，未命中时查询一次"""
+        with self._lock:
+            friends = self._data.get(user_id)
+            if friends is not None:
+                self._data.move_to_end(user_id)
+                self.stats['hits'] += 1
+                return friends
+        self.stats['misses'] += 1
+        friends = load_friends(user_id)
+        with self._lock:
+            self._data[user_id] = friends
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return friends
+
+    def is_friend(self, user_id, other_id):
+        return other_id in self.friends(user_id)
+
+    def are_friends(self, user_id, candidate_ids):
+        """candidate_ids 中与 user_id 互为好友的ID集合"""
+        friends = self.friends(user_id)
+        return {i for i in candidate_ids if i in friends}
+
+    def online_friends(self, user_id, presence):
+        """在线的好友ID集合（一次批量查询在线状态）"""
+        friends = self.friends(user_id)
+        return presence.online_users(list(friends)) if friends else set()
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._data.pop(user_id, None)
+        self.stats['invalidations'] += len(user_ids)
+
+    def get_stats(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            'size': len(self._data),
+            'hits': self.stats['hits'],
+            'misses': self.stats['misses'],
+            'invalidations': self.stats['invalidations'],
+            'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,48 @@
+import threading
+
+
+class _GreenEvent:
+    """eventlet 协程事件，接口与 threading.Event 一致（未 monkey_patch 时 threading.Event 会阻塞整个 hub）"""
+
+    def __init__(self):
+        from eventlet.event import Event
+        self._event = Event()
+
+    def set(self):
+        if not self._event.ready():
+            self._event.send(True)
+
+    def is_set(self):
+        return self._event.ready()
+
+    def clear(self):
+        if self._event.ready():
+            self._event.reset()
+
+    def wait(self, timeout=None):
+        if self._event.ready():
+            return True
+        return self._event.wait(timeout) is True
+
+
+def create_event(socketio):
+    """按 SocketIO 的异步模式创建可等待的事件"""
+    if socketio.async_mode == 'eventlet':
+        return _GreenEvent()
+    return threading.Event()
+
+
+def create_semaphore(socketio, value):
+    """按 SocketIO 的异步模式创建信号量，用于限制并发"""
+    if socketio.async_mode == 'eventlet':
+        from eventlet.semaphore import Semaphore
+        return Semaphore(value)
+    return threading.BoundedSemaphore(value)
+
+
+def run_blocking(socketio, fn, *args):
+    """在原生线程中执行阻塞 / CPU 密集的函数：当前协程等待结果，hub 上的其他请求照常处理"""
+    if socketio.async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    return fn(*args)
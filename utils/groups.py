@@ -0,0 +1,113 @@
+import threading
+from collections import OrderedDict, Counter
+from sqlalchemy import insert
+from models import db, User, Conversation, ConversationMember, ConversationSummary
+
+
+def group_room(conversation_id):
+    """群聊的 Socket.IO 房间名，成员的所有连接都会加入：一次 emit 即发给全部在线成员（多进程时经消息队列转发）"""
+    return f"group:{conversation_id}"
+
+
+class GroupMembers:
+    """
+    群成员列表的进程内 LRU 缓存（conversation_id -> frozenset(user_id)）：
+    发送消息、读取历史时校验成员身份不再查库；成员变化时经集群广播（group_membership）让各进程失效。
+    只缓存群聊，单聊的查询每次返回 None（一次主键查询）。
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def get(self, conversation_id):
+        """群聊的成员ID集合；不是群聊或会话不存在时返回 None"""
+        with self._lock:
+            members = self._data.get(conversation_id)
+            if members is not None:
+                self._data.move_to_end(conversation_id)
+                self.stats['hits'] += 1
+                return members
+        self.stats['misses'] += 1
+        if not db.session.query(Conversation.is_group).filter_by(id=conversation_id).scalar():
+            return None
+        members = frozenset(user_id for (user_id,) in db.session.query(ConversationMember.user_id)
+                            .filter_by(conversation_id=conversation_id))
+        with self._lock:
+            self._data[conversation_id] = members
+            self._data.move_to_end(conversation_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return members
+
+    def invalidate(self, conversation_id):
+        with self._lock:
+            self._data.pop(conversation_id, None)
+        self.stats['invalidations'] += 1
+
+    def get_stats(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            'size': len(self._data),
+            'hits': self.stats['hits'],
+            'misses': self.stats['misses'],
+            'invalidations': self.stats['invalidations'],
+            'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else 0.0
+        }
+
+
+def user_group_ids(user_id):
+    """用户所在的全部群聊ID（连接时加入对应房间）"""
+    return [conv_id for (conv_id,) in db.session.query(ConversationMember.conversation_id)
+            .join(Conversation, Conversation.id == ConversationMember.conversation_id)
+            .filter(ConversationMember.user_id == user_id, Conversation.is_group == True)]  # noqa: E712
+
+
+def add_members(conversation_id, user_ids):
+    """
+    添加群成员（不提交），已是成员的跳过，返回新加入的ID。
+    新成员的已读水位设为当前最后一条消息：加入前的消息不计入未读，历史记录仍可查看。
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return []
+    existing = {i for (i,) in db.session.query(ConversationMember.user_id).filter(
+        ConversationMember.conversation_id == conversation_id, ConversationMember.user_id.in_(user_ids))}
+    added = [user_id for user_id in user_ids if user_id not in existing]
+    if added:
+        watermark = db.session.query(ConversationSummary.last_message_id)\
+            .filter_by(conversation_id=conversation_id).scalar() or 0
+        db.session.execute(insert(ConversationMember), [
+            {'conversation_id': conversation_id, 'user_id': user_id, 'unread_count': 0,
+             'last_read_message_id': watermark}
+            for user_id in added
+        ])
+    return added
+
+
+def create_group(owner_id, title, member_ids):
+    """创建群聊（不提交），群主同时是成员"""
+    conv = Conversation(is_group=True, title=title, owner_id=owner_id)
+    db.session.add(conv)
+    db.session.flush()
+    add_members(conv.id, [owner_id, *member_ids])
+    return conv
+
+
+def remove_member(conversation_id, user_id):
+    """移除群成员（不提交），返回是否移除"""
+    return ConversationMember.query.filter_by(conversation_id=conversation_id, user_id=user_id)\
+        .delete(synchronize_session=False) > 0
+
+
+def group_to_dict(conv, member_ids):
+    members = db.session.query(User.id, User.username).filter(User.id.in_(list(member_ids))).order_by(User.id)
+    return {
+        'conversation_id': conv.id,
+        'title': conv.title,
+        'owner_id': conv.owner_id,
+        'member_count': len(member_ids),
+        'members': [{'id': user_id, 'username': username} for user_id, username in members]
+    }
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+from sqlalchemy import tuple_
+from models import Message
+from utils.archive import read_before, read_after
+from utils.media import thumbnail_url_for
+
+# 每页默认 / 最大条数
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class InvalidCursor(ValueError):
+    """游标格式错误"""
+
+
+def encode_cursor(message):
+    """(timestamp, id) -> 游标字符串 '<微秒时间戳>_<id>'"""
+    micros = (message.timestamp - _EPOCH) // timedelta(microseconds=1)
+    return f"{micros}_{message.id}"
+
+
+def decode_cursor(cursor):
+    """游标字符串 -> (timestamp, id)"""
+    try:
+        micros, message_id = cursor.split('_', 1)
+        return _EPOCH + timedelta(microseconds=int(micros)), int(message_id)
+    except (ValueError, AttributeError, OverflowError):
+        raise InvalidCursor(cursor)
+
+
+def message_to_dict(msg):
+    """消息 DTO（历史记录和实时推送共用）；图片消息的 content 为原图地址，另带缩略图地址"""
+    dto = {
+        'id': msg.id,
+        'conversation_id': msg.conversation_id,
+        'sender_id': msg.sender_id,
+        'content': msg.content,
+        'type': msg.type,
+        'timestamp': msg.timestamp.isoformat()
+    }
+    if msg.type == 'image':
+        dto['thumbnail_url'] = thumbnail_url_for(msg.content)
+    return dto
+
+
+def fetch_page(conversation_id, before=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    基于 (timestamp, id) 的游标分页，走 (conversation_id, timestamp, id) 复合索引，
+    翻页耗时与会话长度无关。
+    - 默认返回最新的一页；before 返回更早的一页；after 返回更新的一页
+    - 返回的消息按时间正序排列
+    - 归档的消息（utils/archive.py）都早于热表中的消息：向前翻页读完热表后接着读归档，
+      after 游标落在归档范围内时先读归档再读热表，调用方无需区分
+    返回 (messages, has_more)，has_more 表示翻页方向上是否还有更多消息。
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    key = tuple_(Message.timestamp, Message.id)
+    query = Message.query.filter(Message.conversation_id == conversation_id)
+
+    # 多取一条用于判断是否还有下一页
+    if after is not None:
+        cursor = decode_cursor(after)
+        messages = read_after(conversation_id, cursor, limit + 1)
+        if len(messages) <= limit:
+            if messages:
+                cursor = (messages[-1].timestamp, messages[-1].id)
+            messages += query.filter(key > tuple_(*cursor))\
+                .order_by(Message.timestamp.asc(), Message.id.asc()).limit(limit + 1 - len(messages)).all()
+    else:
+        cursor = decode_cursor(before) if before is not None else None
+        if cursor is not None:
+            query = query.filter(key < tuple_(*cursor))
+        messages = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+        if len(messages) <= limit:
+            # 热表已读完，接着读归档中更早的消息
+            if messages:
+                cursor = (messages[-1].timestamp, messages[-1].id)
+            messages += read_before(conversation_id, cursor, limit + 1 - len(messages))
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after is None:
+        messages.reverse()
+    return messages, has_more
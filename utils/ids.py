@@ -0,0 +1,40 @@
+import threading
+import time
+
+# 自定义纪元：2024-01-01 00:00:00 UTC（毫秒）
+EPOCH_MS = 1704067200000
+WORKER_BITS = 4
+SEQUENCE_BITS = 8
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+
+
+class IdGenerator:
+    """
+    服务端分配的消息ID：时间有序的 53 位整数（毫秒 41 位 + 进程号 4 位 + 序号 8 位），
+    不超过 JavaScript 的安全整数范围，且大于自增主键产生的旧ID。
+    消息写库前即可确定ID，多进程部署时每个进程需配置不同的 WORKER_ID。
+    """
+
+    def __init__(self, worker_id=0):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id 必须在 0 到 {MAX_WORKER_ID} 之间")
+        self.worker_id = worker_id
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            now = int(time.time() * 1000) - EPOCH_MS
+            # 时钟回拨时沿用上一毫秒，保证单调递增
+            if now <= self._last_ms:
+                now = self._last_ms
+                self._sequence = (self._sequence + 1) & SEQUENCE_MASK
+                if self._sequence == 0:
+                    # 本毫秒序号用尽，借用下一毫秒
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (now << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
@@ -0,0 +1,106 @@
+from datetime import datetime
+from sqlalchemy import and_, or_, func, literal
+from models import db, User, Conversation, ConversationSummary, ConversationMember, Friendship
+from utils.summary import make_preview
+
+# 无消息时的默认预览文本
+EMPTY_PREVIEW = 'No messages yet.'
+
+
+def _friend_ids_subquery(user_id):
+    """用户的所有好友ID（两个方向分别走索引，再 UNION ALL）"""
+    as_a = db.session.query(Friendship.user_b_id.label('friend_id'))\
+        .filter(Friendship.user_a_id == user_id, Friendship.status == 'Accepted')
+    as_b = db.session.query(Friendship.user_a_id.label('friend_id'))\
+        .filter(Friendship.user_b_id == user_id, Friendship.status == 'Accepted')
+    return as_a.union_all(as_b).subquery('friends')
+
+
+def build_inbox(user_id):
+    """
+    一次集合查询返回好友列表 + 会话 + 最后一条消息 + 未读数，再一次查询取用户所在的群聊，按最后消息时间合并。
+    预览和未读数读取维护好的会话摘要（utils/summary.py），代价为 O(好友数 + 群数) 行，不扫描 Message 表。
+    只读：会话不存在时 conversation_id 返回 None，不会在 GET 中写库。
+    """
+    friends = _friend_ids_subquery(user_id)
+
+    rows = db.session.query(
+        User.id, User.username,
+        Conversation.id.label('conversation_id'),
+        Conversation.last_message_at,
+        ConversationSummary.last_message_preview,
+        ConversationSummary.last_message_at.label('summary_at'),
+        func.coalesce(ConversationMember.unread_count, literal(0)).label('unread_count')
+    ).select_from(friends)\
+        .join(User, User.id == friends.c.friend_id)\
+        .outerjoin(Conversation, or_(
+            and_(Conversation.user_one_id == user_id, Conversation.user_two_id == User.id),
+            and_(Conversation.user_one_id == User.id, Conversation.user_two_id == user_id)
+        ))\
+        .outerjoin(ConversationSummary, ConversationSummary.conversation_id == Conversation.id)\
+        .outerjoin(ConversationMember, and_(
+            ConversationMember.conversation_id == Conversation.id,
+            ConversationMember.user_id == user_id
+        ))\
+        .order_by(
+            func.coalesce(ConversationSummary.last_message_at, Conversation.last_message_at).desc(),
+            User.id.asc()
+        ).all()
+
+    groups = db.session.query(
+        Conversation.id, Conversation.title, Conversation.last_message_at,
+        ConversationSummary.last_message_preview,
+        ConversationSummary.last_message_at.label('summary_at'),
+        ConversationMember.unread_count
+    ).join(ConversationMember, and_(
+        ConversationMember.conversation_id == Conversation.id,
+        ConversationMember.user_id == user_id
+    )).outerjoin(ConversationSummary, ConversationSummary.conversation_id == Conversation.id)\
+        .filter(Conversation.is_group == True).order_by(Conversation.id).all()  # noqa: E712
+
+    entries = [(row.summary_at or row.last_message_at, {
+        'conversation_id': row.conversation_id,
+        'receiver_id': row.id,
+        'receiver_name': row.username,
+        'is_group': False,
+        'last_message_content': row.last_message_preview or EMPTY_PREVIEW,
+        'unread_count': row.unread_count
+    }) for row in rows]
+    if groups:
+        entries.extend((row.summary_at or row.last_message_at, {
+            'conversation_id': row.id,
+            'receiver_id': None,
+            'receiver_name': row.title,
+            'is_group': True,
+            'last_message_content': row.last_message_preview or EMPTY_PREVIEW,
+            'unread_count': row.unread_count
+        }) for row in groups)
+        # 稳定排序：时间相同的好友保持按ID的顺序
+        entries.sort(key=lambda entry: entry[0] or datetime.min, reverse=True)
+    # last_message_at 为排序键：客户端按它对 conversation_updated 增量重新排序
+    return [dict(entry, last_message_at=_isoformat(at)) for at, entry in entries]
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def conversation_delta(message, unread_count=None, senders=None):
+    """
+    会话列表的增量（conversation_updated）：会话中提交了新消息后推给每个参与者，
+    字段与 build_inbox 的列表项一致，客户端原地更新预览、未读数并按 last_message_at 重新排序，不再重新请求 /api/friends。
+    单聊带该参与者的 unread_count；群聊经群房间一次推给全体成员，改为带本批消息的发送者
+    （new_message_senders，每条消息一项），由客户端把不是自己发送的条数累加到未读数上。
+    """
+    delta = {
+        'conversation_id': message.conversation_id,
+        'last_message_id': message.id,
+        'last_sender_id': message.sender_id,
+        'last_message_content': make_preview(message.content, message.type) or EMPTY_PREVIEW,
+        'last_message_at': _isoformat(message.timestamp),
+    }
+    if unread_count is not None:
+        delta['unread_count'] = unread_count
+    if senders is not None:
+        delta['new_message_senders'] = senders
+    return delta
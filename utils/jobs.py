@@ -0,0 +1,426 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import func, and_, or_, update
+from models import (db, Job, User, Friendship, Conversation, ConversationSummary, ConversationMember, Message,
+                    DeliveryCursor, PendingDelivery, MessageArchive, RetentionPolicy)
+from utils.archive import archive_conversation, load_policies
+from utils.green import create_event
+from utils.search import unindex_messages, compact_index
+from utils.summary import refresh_conversation
+from utils.groups import user_group_ids
+from utils.directory import adjust_counts
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = ('pending', 'running')
+# 保留任务每段最多检查的会话数（每段一个事务，提交时续租）
+RETENTION_CONVERSATIONS_PER_STEP = 100
+
+
+# --- 各类任务的步骤 ---
+# 每个步骤在当前事务中最多处理 limit 行并返回处理的行数，由执行器提交；返回 0 且没有前移 job.cursor 表示该步骤已完成
+# （只检查、没有处理任何行的一段可以只前移 cursor）。
+# 步骤须可重复执行：进程在提交前崩溃时，接手的进程会从同一步骤重新开始。
+def _delete_messages(message_ids, conversation_ids):
+    """删除一批消息及其索引行、待确认投递（投递按 conversation_id 索引定位）"""
+    unindex_messages(message_ids)
+    PendingDelivery.query.filter(PendingDelivery.conversation_id.in_(conversation_ids),
+                                 PendingDelivery.message_id.in_(message_ids))\
+        .delete(synchronize_session=False)
+    Message.query.filter(Message.id.in_(message_ids)).delete(synchronize_session=False)
+
+
+def _delete_archives(query, limit, batch_size):
+    """删除一段归档批次：每个批次相当于 batch_size 条消息，按 limit 条消息折算批次数"""
+    ids = [i for (i,) in query.with_entities(MessageArchive.id).limit(max(1, limit // batch_size))]
+    if ids:
+        MessageArchive.query.filter(MessageArchive.id.in_(ids)).delete(synchronize_session=False)
+    return len(ids)
+
+
+def _user_conversations(user_id):
+    return db.session.query(Conversation.id).filter(
+        or_(Conversation.user_one_id == user_id, Conversation.user_two_id == user_id))
+
+
+def clear_messages(runner, job, limit):
+    """清空聊天记录：按消息ID从小到大删除 cutoff_id 及之前的消息"""
+    ids = [i for (i,) in db.session.query(Message.id)
+           .filter(Message.conversation_id == job.target_id, Message.id <= job.cutoff_id)
+           .order_by(Message.id).limit(limit)]
+    if ids:
+        _delete_messages(ids, [job.target_id])
+    return len(ids)
+
+
+def clear_archives(runner, job, limit):
+    """删除会话中 cutoff_id 及之前的归档批次（归档的消息都早于热表中的消息）"""
+    return _delete_archives(MessageArchive.query.filter(MessageArchive.conversation_id == job.target_id,
+                                                        MessageArchive.last_id <= job.cutoff_id),
+                            limit, runner.app.config.get('ARCHIVE_BATCH_SIZE', 256))
+
+
+def clear_summary(runner, job, limit):
+    """按剩余消息（清空期间新发的）重建摘要和未读数"""
+    refresh_conversation(job.target_id)
+    conversation = db.session.get(Conversation, job.target_id)
+    if conversation is not None and not conversation.is_group:
+        runner.publish('conversation_pair', conversation.user_one_id, conversation.user_two_id)
+    return 0
+
+
+def user_messages(runner, job, limit):
+    """删除用户：先删除其所有会话中的消息（双方发送的）"""
+    conversation_ids = [i for (i,) in _user_conversations(job.target_id)]
+    if not conversation_ids:
+        return 0
+    ids = [i for (i,) in db.session.query(Message.id)
+           .filter(Message.conversation_id.in_(conversation_ids)).limit(limit)]
+    if ids:
+        _delete_messages(ids, conversation_ids)
+    return len(ids)
+
+
+def user_archives(runner, job, limit):
+    return _delete_archives(MessageArchive.query.filter(MessageArchive.conversation_id.in_(
+        _user_conversations(job.target_id))), limit, runner.app.config.get('ARCHIVE_BATCH_SIZE', 256))
+
+
+def user_conversations(runner, job, limit):
+    """删除会话（消息已清空）及其摘要、成员、保留策略、其他人的待确认投递"""
+    rows = _user_conversations(job.target_id).add_columns(Conversation.user_one_id, Conversation.user_two_id)\
+        .limit(limit).all()
+    if not rows:
+        return 0
+    conversation_ids = [conv_id for conv_id, _, _ in rows]
+    for model in (PendingDelivery, ConversationMember, ConversationSummary, RetentionPolicy):
+        model.query.filter(model.conversation_id.in_(conversation_ids)).delete(synchronize_session=False)
+    Conversation.query.filter(Conversation.id.in_(conversation_ids)).delete(synchronize_session=False)
+    partner_ids = [u2 if u1 == job.target_id else u1 for _, u1, u2 in rows]
+    runner.publish('conversation_user', job.target_id, partner_ids)
+    return len(rows)
+
+
+def user_friendships(runner, job, limit):
+    user_id = job.target_id
+    friend_ids = [i for (i,) in db.session.query(Friendship.user_b_id)
+                  .filter(Friendship.user_a_id == user_id).limit(limit)]
+    if friend_ids:
+        Friendship.query.filter(Friendship.user_a_id == user_id, Friendship.user_b_id.in_(friend_ids))\
+            .delete(synchronize_session=False)
+        runner.publish('friend_graph', user_id, *friend_ids)
+        return len(friend_ids)
+    friend_ids = [i for (i,) in db.session.query(Friendship.user_a_id)
+                  .filter(Friendship.user_b_id == user_id).limit(limit)]
+    if friend_ids:
+        Friendship.query.filter(Friendship.user_b_id == user_id, Friendship.user_a_id.in_(friend_ids))\
+            .delete(synchronize_session=False)
+        runner.publish('friend_graph', user_id, *friend_ids)
+    return len(friend_ids)
+
+
+def user_deliveries(runner, job, limit):
+    """该用户自己的待确认投递，按序号分段删除"""
+    seqs = [s for (s,) in db.session.query(PendingDelivery.seq)
+            .filter(PendingDelivery.user_id == job.target_id).order_by(PendingDelivery.seq).limit(limit)]
+    if seqs:
+        PendingDelivery.query.filter(PendingDelivery.user_id == job.target_id, PendingDelivery.seq <= seqs[-1])\
+            .delete(synchronize_session=False)
+    return len(seqs)
+
+
+def user_account(runner, job, limit):
+    # 退出所在的群聊（群聊本身和其中的消息保留），群主为空
+    group_ids = user_group_ids(job.target_id)
+    Conversation.query.filter_by(owner_id=job.target_id).update({'owner_id': None}, synchronize_session=False)
+    ConversationMember.query.filter_by(user_id=job.target_id).delete(synchronize_session=False)
+    for conv_id in group_ids:
+        runner.publish('group_membership', conv_id, [job.target_id], False)
+    DeliveryCursor.query.filter_by(user_id=job.target_id).delete(synchronize_session=False)
+    was_admin = db.session.query(User.is_admin).filter_by(id=job.target_id).scalar()
+    if User.query.filter_by(id=job.target_id).delete(synchronize_session=False):
+        adjust_counts(users=-1, admins=-1 if was_admin else 0)
+    runner.publish('user_principal', job.target_id)
+    return 0
+
+
+def retention_archive(runner, job, limit):
+    """
+    消息归档：按会话ID顺序（job.cursor 记录处理到的会话）把超过归档期限的消息压缩写入 message_archive。
+    只设置了会话策略时只检查这些会话，否则检查全部会话。
+    每段最多检查 RETENTION_CONVERSATIONS_PER_STEP 个会话、归档一个会话中最多 limit 条消息，由执行器提交并续租，
+    会话很多时不会在一段中超过租约
+    """
+    config = runner.app.config
+    default_days, _, overrides = load_policies(config)
+    batch_size = config.get('ARCHIVE_BATCH_SIZE', 256)
+    now = datetime.utcnow()
+    if default_days:
+        conv_ids = [i for (i,) in db.session.query(Conversation.id).filter(Conversation.id > job.cursor)
+                    .order_by(Conversation.id).limit(RETENTION_CONVERSATIONS_PER_STEP)]
+    else:
+        conv_ids = sorted(i for i, (days, _) in overrides.items()
+                          if days and i > job.cursor)[:RETENTION_CONVERSATIONS_PER_STEP]
+    for conv_id in conv_ids:
+        days = overrides[conv_id][0] if conv_id in overrides else default_days
+        if days:
+            archived = archive_conversation(conv_id, now - timedelta(days=days), limit, batch_size)
+            if archived:
+                # 该会话可能还有冷消息，下一段从它继续（cursor 停在它之前）
+                return archived
+        job.cursor = conv_id
+    # 这些会话都没有可归档的消息：cursor 已前移，下一段继续检查之后的会话；没有会话时步骤完成
+    return 0
+
+
+def retention_purge(runner, job, limit):
+    """删除超过删除期限的归档批次（按批次中最后一条消息的时间），并重建因此失效的会话摘要"""
+    config = runner.app.config
+    _, default_days, overrides = load_policies(config)
+    now = datetime.utcnow()
+    by_days = defaultdict(list)
+    for conv_id, (_, days) in overrides.items():
+        if days:
+            by_days[days].append(conv_id)
+    conditions = [and_(MessageArchive.conversation_id.in_(conv_ids),
+                       MessageArchive.last_at < now - timedelta(days=days)) for days, conv_ids in by_days.items()]
+    if default_days:
+        conditions.append(and_(MessageArchive.conversation_id.notin_(list(overrides)),
+                               MessageArchive.last_at < now - timedelta(days=default_days)))
+    if not conditions:
+        return 0
+    batch_size = config.get('ARCHIVE_BATCH_SIZE', 256)
+    rows = db.session.query(MessageArchive.id, MessageArchive.conversation_id, MessageArchive.last_id)\
+        .filter(or_(*conditions)).limit(max(1, limit // batch_size)).all()
+    if not rows:
+        return 0
+    MessageArchive.query.filter(MessageArchive.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+    # 会话的消息都已过期删除时，摘要仍指向被删除的消息：按剩余消息重建
+    purged = defaultdict(int)
+    for _, conv_id, last_id in rows:
+        purged[conv_id] = max(purged[conv_id], last_id)
+    summaries = db.session.query(ConversationSummary.conversation_id, ConversationSummary.last_message_id)\
+        .filter(ConversationSummary.conversation_id.in_(list(purged))).all()
+    for conv_id, last_message_id in summaries:
+        if last_message_id is not None and last_message_id <= purged[conv_id]:
+            refresh_conversation(conv_id)
+            conversation = db.session.get(Conversation, conv_id)
+            if not conversation.is_group:
+                runner.publish('conversation_pair', conversation.user_one_id, conversation.user_two_id)
+    return len(rows)
+
+
+def retention_index(runner, job, limit):
+    """归档移出的消息只在全文索引中留下删除标记：分段合并索引释放空间（仅在本次归档了消息时执行）"""
+    if not job.progress:
+        return 0
+    return 1 if compact_index() else 0
+
+
+# 任务类型 -> [(步骤名, 函数)]
+JOB_STEPS = {
+    'clear_history': [('messages', clear_messages), ('archives', clear_archives), ('summary', clear_summary)],
+    'delete_user': [('messages', user_messages), ('archives', user_archives), ('conversations', user_conversations),
+                    ('friendships', user_friendships), ('deliveries', user_deliveries),
+                    ('account', user_account)],
+    # 定期执行（JobRunner.schedule）：归档冷消息、合并全文索引，再删除过期的归档
+    'retention': [('messages', retention_archive), ('index', retention_index), ('archives', retention_purge)],
+}
+
+
+def job_to_dict(job):
+    steps = JOB_STEPS[job.kind]
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'target_id': job.target_id,
+        'status': job.status,
+        'step': steps[job.step][0] if job.step < len(steps) else None,
+        'progress': job.progress,
+        'total': job.total,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+class JobRunner:
+    """
+    后台执行破坏性操作（清空聊天记录、删除用户）和定期维护（消息归档）：
+    - 请求只创建 Job 行（202），由后台任务按步骤分段删除，每段 JOB_CHUNK_SIZE 行一个短事务，
+      不再在一个请求 / 一个事务里长时间持有写锁
+    - 每段提交时同时记录进度和步骤，并续租；进程崩溃后租约（JOB_LEASE_SECONDS）到期，
+      本进程重启或其他进程接手，从记录的步骤继续
+    - 多进程部署时每个进程都运行执行器，按租约抢占任务，同一任务同时只有一个进程执行
+    - schedule 注册的定期任务由执行器按间隔创建（已有未完成的同类任务时不重复创建）
+    - 执行器在进程收到第一个请求时启动（gunicorn 等不经过 app.py 入口的部署同样生效），
+      重启前留下的任务在租约到期后继续执行
+    """
+
+    def __init__(self, app=None, socketio=None, publish=None):
+        self.app = None
+        self.socketio = None
+        # 集群广播（cluster_bus.publish），用于缓存失效；未提供时不广播
+        self.publish = publish or (lambda name, *args: None)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._task = None
+        self._running = False
+        self._schedule = []
+        self.stats = Counter()
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        self.app = app
+        self.socketio = socketio
+        self.chunk_size = app.config.get('JOB_CHUNK_SIZE', 500)
+        self.chunk_pause = app.config.get('JOB_CHUNK_PAUSE_MS', 20) / 1000.0
+        self.poll_interval = app.config.get('JOB_POLL_INTERVAL', 2)
+        self.lease = timedelta(seconds=app.config.get('JOB_LEASE_SECONDS', 60))
+        app.before_request(self._ensure_started)
+        atexit.register(self.stop)
+
+    # --- 创建任务（在请求中调用） ---
+    def enqueue(self, kind, target_id, requested_by=None, cutoff_id=None, total=None):
+        """
+        创建任务并提交。没有 cutoff_id 的任务（删除用户）在同一目标已有未完成的同类任务时直接返回该任务；
+        清空聊天记录每次都新建（各自删除到请求时的最后一条消息）
+        """
+        if cutoff_id is None:
+            existing = Job.query.filter(Job.kind == kind, Job.target_id == target_id, Job.status.in_(ACTIVE)).first()
+            if existing is not None:
+                return existing
+        job = Job(kind=kind, target_id=target_id, requested_by=requested_by, cutoff_id=cutoff_id, total=total)
+        db.session.add(job)
+        db.session.commit()
+        self.stats['enqueued'] += 1
+        self._ensure_started()
+        self._wakeup.set()
+        return job
+
+    def schedule(self, kind, interval, when=None):
+        """每 interval 秒创建一次 kind 任务（执行器启动后立即检查一次）；when 返回 False 时跳过本次"""
+        self._schedule.append({'kind': kind, 'interval': interval, 'when': when, 'due': 0})
+
+    def _enqueue_due(self):
+        now = time.monotonic()
+        for entry in self._schedule:
+            if entry['due'] > now:
+                continue
+            entry['due'] = now + entry['interval']
+            if entry['when'] is None or entry['when']():
+                self.enqueue(entry['kind'], 0)
+
+    # --- 执行 ---
+    def _ensure_started(self):
+        if self._task is None:
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._task is not None:
+                return
+            self._wakeup = create_event(self.socketio)
+            self._running = True
+            self._task = self.socketio.start_background_task(self._run)
+
+    def stop(self):
+        self._running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _run(self):
+        while self._running:
+            try:
+                with self.app.app_context():
+                    self._enqueue_due()
+                    while self._running and self.run_next():
+                        pass
+            except Exception as e:
+                logger.error(f"后台任务执行器出错: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def run_next(self):
+        """领取并执行一个任务，没有可执行的任务时返回 False"""
+        job = self._claim()
+        if job is None:
+            return False
+        self._execute(job)
+        return True
+
+    def _claim(self):
+        now = datetime.utcnow()
+        candidates = db.session.query(Job.id).filter(
+            Job.status.in_(ACTIVE), or_(Job.lease_until.is_(None), Job.lease_until < now)
+        ).order_by(Job.id).limit(5).all()
+        for (job_id,) in candidates:
+            # 条件更新抢占：其他进程已领取（租约未到期）时影响 0 行
+            claimed = db.session.execute(update(Job).where(
+                Job.id == job_id, Job.status.in_(ACTIVE),
+                or_(Job.lease_until.is_(None), Job.lease_until < now)
+            ).values(status='running', owner=self.owner, lease_until=now + self.lease, updated_at=now)).rowcount
+            db.session.commit()
+            if claimed:
+                return db.session.get(Job, job_id)
+        return None
+
+    def _execute(self, job):
+        steps = JOB_STEPS.get(job.kind)
+        if steps is None:
+            self._fail(job, f"未知的任务类型: {job.kind}")
+            return
+        logger.info(f"开始执行任务 {job.id} ({job.kind} {job.target_id})，步骤 {job.step}")
+        while job.step < len(steps):
+            name, fn = steps[job.step]
+            try:
+                cursor = job.cursor
+                done = fn(self, job, self.chunk_size)
+                job.progress += done if name == 'messages' else 0
+                if not done and job.cursor == cursor:
+                    job.step += 1
+                    job.cursor = 0
+                now = datetime.utcnow()
+                job.updated_at = now
+                job.lease_until = now + self.lease
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self._fail(job, f"{name}: {e}")
+                return
+            self.stats['chunks'] += 1
+            # 两段之间暂停：其他进程的写入在 SQLite 忙等待中按退避间隔重试，立即开始下一段会一直抢在它们前面
+            self.socketio.sleep(self.chunk_pause)
+            if not self._running:
+                # 正常退出：释放租约，重启后立即继续
+                job.lease_until = None
+                db.session.commit()
+                return
+        job.status = 'done'
+        job.finished_at = datetime.utcnow()
+        job.lease_until = None
+        db.session.commit()
+        self.stats['done'] += 1
+        logger.info(f"任务 {job.id} ({job.kind}) 已完成，处理 {job.progress} 条消息")
+
+    def _fail(self, job, error):
+        job = db.session.get(Job, job.id)
+        job.status = 'failed'
+        job.error = error[:1000]
+        job.finished_at = datetime.utcnow()
+        job.lease_until = None
+        db.session.commit()
+        self.stats['failed'] += 1
+        logger.error(f"任务 {job.id} 失败: {error}")
+
+    def get_stats(self):
+        counts = dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+        return dict(self.stats, **{f'jobs_{status}': n for status, n in counts.items()})
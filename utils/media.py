@@ -0,0 +1,251 @@
+import atexit
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+from collections import Counter
+from flask import request, current_app
+from werkzeug.utils import send_file
+from utils.green import create_event, create_semaphore, run_blocking
+
+try:
+    from PIL import Image
+except ImportError:  # 未安装 Pillow 时不生成缩略图，缩略图地址回退为原图
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# 流式写入的块大小
+CHUNK_SIZE = 64 * 1024
+# 等待进行中的缩略图任务的超时（秒）
+THUMBNAIL_WAIT_TIMEOUT = 10
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+# /media/<sha256>.<ext>
+_MEDIA_URL_RE = re.compile(r'^/media/([0-9a-f]{64})\.([a-z0-9]+)$')
+
+
+def _shard(digest):
+    """按哈希前 4 位分两级目录，避免单个目录下文件过多"""
+    return os.path.join(digest[:2], digest[2:4])
+
+
+def _render_thumbnail(src, dst, size):
+    """生成不超过 size x size 的 JPEG 缩略图（在原生线程中执行）"""
+    with Image.open(src) as img:
+        img.draft('RGB', (size, size))  # JPEG 解码时直接按比例缩小，减少内存和耗时
+        img.thumbnail((size, size))
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = f"{dst}.{os.getpid()}.tmp"
+        img.save(tmp, 'JPEG', quality=80, optimize=True)
+        os.replace(tmp, dst)
+
+
+class StoredMedia:
+    """保存结果"""
+    __slots__ = ('digest', 'ext', 'size', 'deduplicated')
+
+    def __init__(self, digest, ext, size, deduplicated):
+        self.digest = digest
+        self.ext = ext
+        self.size = size
+        self.deduplicated = deduplicated
+
+    @property
+    def url(self):
+        return f"/media/{self.digest}.{self.ext}"
+
+    @property
+    def thumbnail_url(self):
+        return f"/media/thumbs/{self.digest}.jpg"
+
+
+class MediaStore:
+    """
+    按内容寻址的图片存储：
+    - 上传按块流式写入临时文件，边写边计算 SHA-256；相同内容只保存一份
+    - 原图保存在 MEDIA_FOLDER/ab/cd/<sha256>.<ext>，缩略图在 THUMBNAIL_FOLDER/ab/cd/<sha256>.jpg
+    - 缩略图由后台任务在原生线程中生成（并发数 MEDIA_THUMBNAIL_WORKERS），不占用请求协程
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.socketio = None
+        self._inflight = {}
+        self.stats = Counter()
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        self.socketio = socketio
+        self.root = app.config['MEDIA_FOLDER']
+        self.thumb_root = app.config['THUMBNAIL_FOLDER']
+        self.thumb_size = app.config.get('THUMBNAIL_SIZE', 320)
+        self.allowed = app.config['ALLOWED_EXTENSIONS']
+        self._tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        os.makedirs(self.thumb_root, exist_ok=True)
+        self._slots = create_semaphore(socketio, app.config.get('MEDIA_THUMBNAIL_WORKERS', 2))
+        self.max_age = app.config.get('MEDIA_CACHE_MAX_AGE', 365 * 24 * 3600)
+        self.accel = app.config.get('MEDIA_ACCEL') or None
+        self.accel_root = app.config.get('MEDIA_ACCEL_ROOT') or os.path.dirname(self.root)
+        self.accel_prefix = app.config.get('MEDIA_ACCEL_PREFIX', '/_media/')
+        if self.accel not in (None, 'nginx', 'sendfile'):
+            logger.warning(f"未知的 MEDIA_ACCEL={self.accel}，由应用直接发送文件")
+            self.accel = None
+        atexit.register(self._cleanup_tmp)
+
+    # --- 路径 ---
+    def original_path(self, digest, ext):
+        """原图路径；digest / ext 不合法时返回 None"""
+        if not _DIGEST_RE.match(digest) or ext not in self.allowed:
+            return None
+        return os.path.join(self.root, _shard(digest), f"{digest}.{ext}")
+
+    def thumbnail_path(self, digest):
+        if not _DIGEST_RE.match(digest):
+            return None
+        return os.path.join(self.thumb_root, _shard(digest), f"{digest}.jpg")
+
+    # --- 写入 ---
+    def save(self, stream, ext):
+        """把上传流保存到存储中，返回 StoredMedia；并在后台生成缩略图"""
+        ext = ext.lower()
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self._tmp_dir, prefix=f"{os.getpid()}-")
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            digest = hasher.hexdigest()
+            path = self.original_path(digest, ext)
+            deduplicated = os.path.exists(path)
+            if deduplicated:
+                os.remove(tmp)
+                self.stats['dedup_hits'] += 1
+                self.stats['bytes_deduplicated'] += size
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+                self.stats['bytes_written'] += size
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.stats['uploads'] += 1
+
+        media = StoredMedia(digest, ext, size, deduplicated)
+        if not os.path.exists(self.thumbnail_path(digest)):
+            self._schedule_thumbnail(digest, path)
+        return media
+
+    # --- 读取 ---
+    def send(self, path, etag=True):
+        """
+        发送媒体文件：文件内容不可变，带强 ETag（传入内容哈希）和一年的 Cache-Control: immutable，
+        支持 If-None-Match / If-Modified-Since 条件请求和 Range 请求。
+        MEDIA_ACCEL 为 nginx / sendfile 时只返回 X-Accel-Redirect / X-Sendfile 头，由前端代理发送文件内容。
+        """
+        if self.accel == 'nginx':
+            response = current_app.response_class(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+            if isinstance(etag, str):
+                response.set_etag(etag)
+            response.last_modified = os.path.getmtime(path)
+            response = response.make_conditional(request)
+            if response.status_code != 304:
+                rel = os.path.relpath(os.path.abspath(path), os.path.abspath(self.accel_root))
+                response.headers['X-Accel-Redirect'] = self.accel_prefix + rel.replace(os.sep, '/')
+            self.stats['accel_redirects'] += 1
+        else:
+            response = send_file(os.path.abspath(path), request.environ, etag=etag, max_age=self.max_age,
+                                 use_x_sendfile=self.accel == 'sendfile',
+                                 response_class=current_app.response_class)
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        response.cache_control.immutable = True
+        self.stats[f'served_{response.status_code}'] += 1
+        return response
+
+    # --- 缩略图 ---
+    def ensure_thumbnail(self, digest, ext=None):
+        """
+        返回缩略图路径；不存在时等待进行中的任务，或就地生成（旧图片 / 任务失败）。
+        无法生成（未安装 Pillow、原图不存在）时返回 None。
+        """
+        thumb = self.thumbnail_path(digest)
+        if thumb is None:
+            return None
+        if os.path.exists(thumb):
+            return thumb
+        done = self._inflight.get(digest)
+        if done is not None:
+            done.wait(THUMBNAIL_WAIT_TIMEOUT)
+            return thumb if os.path.exists(thumb) else None
+        src = self.find_original(digest, ext)
+        if src is None:
+            return None
+        self._generate(digest, src)
+        return thumb if os.path.exists(thumb) else None
+
+    def find_original(self, digest, ext=None):
+        for candidate in ([ext] if ext else sorted(self.allowed)):
+            path = self.original_path(digest, candidate)
+            if path and os.path.exists(path):
+                return path
+        return None
+
+    def _schedule_thumbnail(self, digest, src):
+        if Image is None or digest in self._inflight:
+            return
+        self._inflight[digest] = create_event(self.socketio)
+        self.socketio.start_background_task(self._generate, digest, src)
+
+    def _generate(self, digest, src):
+        if Image is None:
+            return
+        done = self._inflight.setdefault(digest, create_event(self.socketio))
+        try:
+            with self._slots:
+                run_blocking(self.socketio, _render_thumbnail, src, self.thumbnail_path(digest), self.thumb_size)
+            self.stats['thumbnails'] += 1
+        except Exception as e:
+            self.stats['thumbnail_failures'] += 1
+            logger.warning(f"生成缩略图失败 {digest}: {e}")
+        finally:
+            self._inflight.pop(digest, None)
+            done.set()
+
+    def _cleanup_tmp(self):
+        """删除本进程遗留的临时文件（多进程共用目录，只清理自己的）"""
+        prefix = f"{os.getpid()}-"
+        if not os.path.isdir(self._tmp_dir):
+            return
+        for name in os.listdir(self._tmp_dir):
+            if not name.startswith(prefix):
+                continue
+            try:
+                os.remove(os.path.join(self._tmp_dir, name))
+            except OSError:
+                pass
+
+
+def thumbnail_url_for(url):
+    """按内容寻址的原图地址 -> 缩略图地址；旧的（非内容寻址的）图片没有缩略图，返回原图地址"""
+    match = _MEDIA_URL_RE.match(url or '')
+    if not match:
+        return url
+    return f"/media/thumbs/{match.group(1)}.jpg"
@@ -0,0 +1,266 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from flask import g, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 单个请求 / 事件执行的 SQL 条数
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 当前 HTTP 请求 / Socket.IO 事件的 SQL 计数（eventlet 下每个协程有独立的 context）
+_scope = ContextVar('lightchat_metrics_scope', default=None)
+
+
+class _Scope:
+    __slots__ = ('handler', 'queries', 'db_seconds')
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增计数器，按标签值分别计数"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labels, k), v) for k, v in sorted(self._values.items())]
+
+
+class Histogram:
+    """累积直方图：每组标签值记录各桶计数、总和和次数"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # 标签值 -> [各桶计数..., 总和, 次数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        samples = []
+        for label_values, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                samples.append((f'{self.name}_bucket',
+                                _labels(self.labels, label_values, f'le="{_number(float(bound))}"'), cumulative))
+            samples.append((f'{self.name}_bucket', _labels(self.labels, label_values, 'le="+Inf"'), entry[-1]))
+            samples.append((f'{self.name}_sum', _labels(self.labels, label_values), entry[-2]))
+            samples.append((f'{self.name}_count', _labels(self.labels, label_values), entry[-1]))
+        return samples
+
+
+class Callback:
+    """抓取时才计算的指标：fn() 返回数值，或 {标签值元组: 数值}"""
+
+    def __init__(self, name, help, fn, type='gauge', labels=()):
+        self.name, self.help, self.fn, self.type, self.labels = name, help, fn, type, tuple(labels)
+
+    def samples(self):
+        value = self.fn()
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            return [(self.name, '', value)]
+        return [(self.name, _labels(self.labels, k if isinstance(k, tuple) else (k,)), v)
+                for k, v in sorted(value.items()) if isinstance(v, (int, float))]
+
+
+class Metrics:
+    """
+    Prometheus 文本格式的运行指标（/metrics），不依赖 prometheus_client：
+    - 每个路由 / Socket.IO 事件的耗时直方图，以及每个请求 / 事件执行的 SQL 条数和耗时
+    - 每条 SQL 的耗时直方图（按语句类型），超过 SLOW_QUERY_MS 的 SQL 记录警告日志
+    - Redis 每条命令的耗时和错误数
+    - 连接数、在线用户数等由 gauge() / counter() 注册的回调在抓取时计算
+    计数都在本进程内：多进程部署时 Prometheus 分别抓取每个进程。
+    """
+
+    def __init__(self, app=None, socketio=None, db=None):
+        self._metrics = []
+        self.enabled = False
+        self.http_duration = self._add(Histogram(
+            'lightchat_http_request_duration_seconds', 'HTTP 请求耗时', ('route', 'method')))
+        self.http_requests = self._add(Counter(
+            'lightchat_http_requests_total', 'HTTP 请求数', ('route', 'method', 'status')))
+        self.event_duration = self._add(Histogram(
+            'lightchat_socketio_event_duration_seconds', 'Socket.IO 事件处理耗时', ('event',)))
+        self.event_errors = self._add(Counter(
+            'lightchat_socketio_event_errors_total', 'Socket.IO 事件处理抛出的异常数', ('event',)))
+        self.handler_queries = self._add(Histogram(
+            'lightchat_handler_db_queries', '每个请求 / 事件执行的 SQL 条数', ('handler',), QUERY_COUNT_BUCKETS))
+        self.handler_db_time = self._add(Histogram(
+            'lightchat_handler_db_seconds', '每个请求 / 事件的 SQL 总耗时', ('handler',)))
+        self.query_duration = self._add(Histogram(
+            'lightchat_db_query_duration_seconds', '单条 SQL 耗时', ('statement',)))
+        self.slow_queries = self._add(Counter(
+            'lightchat_db_slow_queries_total', '超过 SLOW_QUERY_MS 的 SQL 条数'))
+        self.redis_duration = self._add(Histogram(
+            'lightchat_redis_command_duration_seconds', 'Redis 命令耗时', ('command',)))
+        self.redis_errors = self._add(Counter(
+            'lightchat_redis_errors_total', 'Redis 命令失败数', ('command',)))
+        if app is not None:
+            self.init_app(app, socketio, db)
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, fn, labels=()):
+        return self._add(Callback(name, help, fn, 'gauge', labels))
+
+    def counter(self, name, help, fn, labels=()):
+        """已有的只增计数（如各组件的 stats）在抓取时读取"""
+        return self._add(Callback(name, help, fn, 'counter', labels))
+
+    def init_app(self, app, socketio, db):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        if not self.enabled:
+            return
+        self.slow_query_seconds = app.config.get('SLOW_QUERY_MS', 0) / 1000.0
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+        self._wrap_socketio(socketio)
+
+    # --- HTTP ---
+    def _before_request(self):
+        rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g._metrics = (_scope.set(_Scope(f'{request.method} {rule}')), rule, time.perf_counter())
+
+    def _after_request(self, response):
+        token, rule, start = g.get('_metrics', (None, None, None))
+        if token is not None:
+            self.http_duration.observe(time.perf_counter() - start, rule, request.method)
+            self.http_requests.inc(rule, request.method, str(response.status_code))
+            self._observe_scope(token.var.get())
+        return response
+
+    def _teardown_request(self, exc):
+        token = g.pop('_metrics', (None,))[0]
+        if token is not None:
+            _scope.reset(token)
+
+    # --- Socket.IO ---
+    def _wrap_socketio(self, socketio):
+        # Flask-SocketIO 的每个事件处理函数都经 _handle_event 调用（其中建立请求上下文）
+        handle_event = getattr(socketio, '_handle_event', None)
+        if handle_event is None:
+            logger.warning("当前 Flask-SocketIO 版本不支持统一的事件入口，未统计 Socket.IO 事件耗时")
+            return
+
+        def timed(handler, message, namespace, sid, *args):
+            scope = _Scope(f'socket {message}')
+            token = _scope.set(scope)
+            start = time.perf_counter()
+            try:
+                return handle_event(handler, message, namespace, sid, *args)
+            except Exception:
+                self.event_errors.inc(message)
+                raise
+            finally:
+                self.event_duration.observe(time.perf_counter() - start, message)
+                self._observe_scope(scope)
+                _scope.reset(token)
+
+        socketio._handle_event = timed
+
+    def _observe_scope(self, scope):
+        self.handler_queries.observe(scope.queries, scope.handler)
+        self.handler_db_time.observe(scope.db_seconds, scope.handler)
+
+    # --- SQL ---
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        kind = statement.lstrip()[:6].lower()
+        self.query_duration.observe(elapsed, kind if kind in ('select', 'insert', 'update', 'delete') else 'other')
+        scope = _scope.get()
+        if scope is not None:
+            scope.queries += 1
+            scope.db_seconds += elapsed
+        if self.slow_query_seconds and elapsed >= self.slow_query_seconds:
+            self.slow_queries.inc()
+            handler = scope.handler if scope is not None else '后台任务'
+            logger.warning(f"慢查询 {elapsed * 1000:.1f}ms（{handler}）: {' '.join(statement.split())[:500]}")
+
+    # --- Redis（由 RedisStore.on_record 回调） ---
+    def record_redis(self, command, seconds, error):
+        self.redis_duration.observe(seconds, command)
+        if error:
+            self.redis_errors.inc(command)
+
+    # --- 输出 ---
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.error(f"采集指标 {metric.name} 失败: {e}")
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(f'{name}{labels} {_number(value)}' for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,312 @@
+import logging
+from datetime import datetime
+from sqlalchemy import inspect, text, select, update, func
+from sqlalchemy.schema import CreateTable
+from models import (db, User, Friendship, Conversation, ConversationSummary, ConversationMember, Message,
+                    DeliveryCursor, PendingDelivery, Job, MessageArchive, RetentionPolicy, StatCounter)
+# 导入时注册全文索引表的建表事件（db.create_all 建 message 表时一并创建）
+from utils.search import create_index as create_search_index, rebuild_index, BIGRAM_TABLE
+
+logger = logging.getLogger(__name__)
+
+# 已执行的迁移，每个版本一行
+schema_version = db.Table(
+    'schema_version',
+    db.Column('version', db.Integer, primary_key=True),
+    db.Column('name', db.String(100), nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+# (版本号, 名称, 函数)，按版本号升序执行
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """注册一个迁移。迁移需可重复执行：旧库可能已由 db.create_all() 建好了部分表 / 索引"""
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+# --- 辅助函数（都在当前事务的连接上执行） ---
+def _inspector():
+    return inspect(db.session.connection())
+
+
+def has_table(table):
+    return _inspector().has_table(table)
+
+
+def has_column(table, column):
+    return any(c['name'] == column for c in _inspector().get_columns(table))
+
+
+def add_column(table, column, ddl):
+    """缺少字段时 ALTER TABLE 添加，ddl 为字段类型及约束"""
+    if has_column(table, column):
+        return False
+    quoted = db.session.get_bind().dialect.identifier_preparer.quote(table)  # user 在 PostgreSQL 中是保留字
+    db.session.execute(text(f"ALTER TABLE {quoted} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def create_table(model):
+    """创建模型对应的表（含表上的索引），已存在时跳过；返回是否新建"""
+    if has_table(model.__tablename__):
+        return False
+    model.__table__.create(db.session.connection())
+    return True
+
+
+def create_index(index):
+    """创建索引，已存在时跳过"""
+    existing = {i['name'] for i in _inspector().get_indexes(index.table.name)}
+    if index.name in existing:
+        return False
+    index.create(db.session.connection())
+    return True
+
+
+def _index(table, name):
+    return next(i for i in table.indexes if i.name == name)
+
+
+def drop_not_null(model, *columns):
+    """
+    去掉字段的 NOT NULL 约束（模型中已改为 nullable），已可为空时跳过。
+    SQLite 不支持修改字段，按当前模型重建表：新建临时表、复制数据、删除旧表后改名，再重建索引。
+    本项目未开启 SQLite 外键约束（PRAGMA foreign_keys），删除旧表不会级联删除引用它的行。
+    """
+    table = model.__table__
+    existing = {c['name']: c for c in _inspector().get_columns(table.name)}
+    if not any(not existing[name]['nullable'] for name in columns if name in existing):
+        return False
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for name in columns:
+            db.session.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {name} DROP NOT NULL"))
+        return True
+    if dialect != 'sqlite':
+        for name in columns:
+            ddl = table.c[name].type.compile(dialect=db.session.get_bind().dialect)
+            db.session.execute(text(f"ALTER TABLE {table.name} MODIFY {name} {ddl} NULL"))
+        return True
+    temp = f'_{table.name}_new'
+    create = str(CreateTable(table).compile(dialect=db.session.get_bind().dialect))
+    db.session.execute(text(create.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {temp} ', 1)))
+    names = ', '.join(c.name for c in table.columns if c.name in existing)
+    db.session.execute(text(f"INSERT INTO {temp} ({names}) SELECT {names} FROM {table.name}"))
+    db.session.execute(text(f"DROP TABLE {table.name}"))
+    db.session.execute(text(f"ALTER TABLE {temp} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(db.session.connection())
+    return True
+
+
+# --- 迁移 ---
+@migration(1, 'message_type')
+def add_message_type():
+    # 原 add_type_column.py
+    add_column('message', 'type', "VARCHAR(10) NOT NULL DEFAULT 'text'")
+
+
+@migration(2, 'conversation_summaries')
+def add_conversation_summaries():
+    created = create_table(ConversationSummary)
+    created = create_table(ConversationMember) or created
+    return 'rebuild_summaries' if created else None
+
+
+def merge_duplicate_conversations():
+    """
+    合并参与者相同的重复单聊会话（旧版本不限制唯一，两人同时发第一条消息时可能各建一个），返回合并掉的会话数。
+    保留ID最小的会话：其余会话的消息和成员改为指向它（成员已存在时删除重复的成员行），删除其余会话的摘要和会话本身；
+    摘要和未读计数需之后重建
+    """
+    groups = db.session.execute(
+        select(Conversation.user_one_id, Conversation.user_two_id)
+        .where(Conversation.user_one_id.isnot(None), Conversation.user_two_id.isnot(None))
+        .group_by(Conversation.user_one_id, Conversation.user_two_id)
+        .having(func.count(Conversation.id) > 1)
+    ).all()
+    merged = 0
+    for user_one_id, user_two_id in groups:
+        ids = db.session.execute(
+            select(Conversation.id, Conversation.last_message_at)
+            .where(Conversation.user_one_id == user_one_id, Conversation.user_two_id == user_two_id)
+            .order_by(Conversation.id)
+        ).all()
+        keep, extras = ids[0].id, [row.id for row in ids[1:]]
+        last_message_at = max((row.last_message_at for row in ids if row.last_message_at), default=None)
+        db.session.execute(update(Message).where(Message.conversation_id.in_(extras)).values(conversation_id=keep))
+        for extra in extras:
+            kept_members = select(ConversationMember.user_id).where(ConversationMember.conversation_id == keep)
+            db.session.execute(ConversationMember.__table__.delete().where(
+                ConversationMember.conversation_id == extra, ConversationMember.user_id.in_(kept_members)))
+            db.session.execute(update(ConversationMember).where(ConversationMember.conversation_id == extra)
+                               .values(conversation_id=keep))
+        db.session.execute(ConversationSummary.__table__.delete()
+                           .where(ConversationSummary.conversation_id.in_(extras)))
+        db.session.execute(Conversation.__table__.delete().where(Conversation.id.in_(extras)))
+        db.session.execute(update(Conversation).where(Conversation.id == keep)
+                           .values(last_message_at=last_message_at))
+        merged += len(extras)
+    if merged:
+        logger.info(f"已合并 {merged} 个重复会话")
+    return merged
+
+
+@migration(3, 'lookup_indexes')
+def add_lookup_indexes():
+    # 会话按参与者查找 / 消息按会话游标翻页；会话对唯一索引要求库中没有重复会话，先合并已有的重复会话
+    merged = merge_duplicate_conversations()
+    create_index(_index(Conversation.__table__, 'ix_conversation_pair'))
+    create_index(_index(Conversation.__table__, 'ix_conversation_user_two_id'))
+    create_index(_index(Message.__table__, 'ix_message_conversation_timestamp_id'))
+    create_index(_index(ConversationMember.__table__, 'ix_conversation_member_user_id'))
+    return 'rebuild_summaries' if merged else None
+
+
+@migration(4, 'delivery_queue')
+def add_delivery_queue():
+    create_table(DeliveryCursor)
+    create_table(PendingDelivery)
+
+
+@migration(5, 'read_watermark')
+def add_read_watermark():
+    # 原 add_read_watermark.py：添加已读水位并用旧的 is_read 标记回填（对方发来的已读消息中最大的ID）
+    add_column('conversation_member', 'last_read_message_id', 'BIGINT NOT NULL DEFAULT 0')
+    last_read = select(func.max(Message.id)).where(
+        Message.conversation_id == ConversationMember.conversation_id,
+        Message.sender_id != ConversationMember.user_id,
+        Message.is_read == True  # noqa: E712
+    ).scalar_subquery()
+    db.session.execute(update(ConversationMember)
+                       .where(ConversationMember.last_read_message_id == 0)
+                       .values(last_read_message_id=func.coalesce(last_read, 0)))
+    return 'rebuild_summaries'
+
+
+@migration(6, 'message_search')
+def add_message_search():
+    # 全文索引表（仅 SQLite），用已有消息回填；数据量大时回填耗时较长，也可之后单独运行 rebuild_index()
+    create_search_index(db.session.connection())
+    db.session.commit()
+    rebuild_index()
+
+
+@migration(7, 'jobs')
+def add_jobs():
+    create_table(Job)
+
+
+@migration(8, 'message_archive')
+def add_message_archive():
+    add_column('job', 'cursor', 'INTEGER NOT NULL DEFAULT 0')
+    create_table(MessageArchive)
+    create_table(RetentionPolicy)
+
+
+@migration(9, 'group_conversations')
+def add_group_conversations():
+    # 群聊：会话类型、名称、群主；群聊没有 user_one_id / user_two_id
+    add_column('conversation', 'is_group', 'BOOLEAN NOT NULL DEFAULT FALSE')
+    add_column('conversation', 'title', 'VARCHAR(50)')
+    add_column('conversation', 'owner_id', 'INTEGER')
+    drop_not_null(Conversation, 'user_one_id', 'user_two_id')
+
+
+@migration(10, 'friendship_indexes')
+def add_friendship_indexes():
+    # 好友关系按 user_b_id 查找（好友列表、好友关系判断的另一方向）
+    create_index(_index(Friendship.__table__, 'ix_friendship_user_b_id'))
+
+
+@migration(11, 'user_directory')
+def add_user_directory():
+    # 管理员目录：按是否管理员过滤的索引，用户数 / 管理员数的计数表（按现有用户回填）
+    from utils.directory import rebuild_counts
+    create_index(_index(User.__table__, 'ix_user_is_admin_id'))
+    create_table(StatCounter)
+    rebuild_counts()
+
+
+@migration(12, 'message_search_bigrams')
+def add_message_search_bigrams():
+    # 两个字的中日韩关键词走的二元组索引表（仅 SQLite），用已有文本消息回填；
+    # 从更早的版本升级时迁移 6 已按当前代码一并建好并回填，跳过
+    if db.session.get_bind().dialect.name != 'sqlite' or has_table(BIGRAM_TABLE):
+        return
+    create_search_index(db.session.connection())
+    db.session.commit()
+    rebuild_index(trigrams=False)
+
+
+@migration(13, 'user_tombstone')
+def add_user_tombstone():
+    # 删除用户时先标记墓碑，删除任务完成前拒绝该账号的登录、请求和连接
+    add_column('user', 'deleted_at', 'DATETIME')
+
+
+# --- 执行 ---
+def current_version():
+    if not has_table(schema_version.name):
+        return 0
+    return db.session.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def _stamp(version, name):
+    db.session.execute(schema_version.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+
+
+def pending_migrations():
+    version = current_version()
+    return [(v, name) for v, name, _ in MIGRATIONS if v > version]
+
+
+def upgrade():
+    """
+    把数据库升级到最新版本（需在应用上下文中调用），返回执行的迁移名称列表。
+    - 空库：直接按当前模型建表，并记为最新版本
+    - 旧库（没有 schema_version 表，由旧版 db.create_all() 或一次性脚本建立）：从第 1 个迁移开始依次执行
+    每个迁移一个事务，成功后记录版本；失败时回滚并抛出异常，修复后重新运行会从失败的迁移继续。
+    """
+    from utils.summary import rebuild_summaries
+
+    fresh = not has_table('user')
+    schema_version.create(db.session.connection(), checkfirst=True)
+    db.session.commit()
+    if fresh:
+        from utils.directory import rebuild_counts
+        db.create_all()
+        rebuild_counts()  # 计数行从一开始就存在，注册时只需增减
+        for version, name, _ in MIGRATIONS:
+            _stamp(version, name)
+        db.session.commit()
+        logger.info(f"已创建数据库表，当前版本 {MIGRATIONS[-1][0]}")
+        return []
+
+    applied = []
+    rebuild = False
+    current = current_version()
+    for version, name, fn in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            rebuild = fn() == 'rebuild_summaries' or rebuild
+            _stamp(version, name)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.error(f"迁移 {version:04d}_{name} 失败")
+            raise
+        logger.info(f"已执行迁移 {version:04d}_{name}")
+        applied.append(name)
+    # 补建模型中其余缺少的表（不修改已有表），再统一重建一次摘要和未读计数
+    db.create_all()
+    if rebuild:
+        rebuild_summaries()
+    return applied
@@ -0,0 +1,108 @@
+import logging
+import threading
+from collections import Counter
+from engineio import packet as eio_packet
+from socketio import packet as sio_packet
+
+logger = logging.getLogger(__name__)
+
+
+def check_socketio_internals(server, names):
+    """
+    启动时检查 Socket.IO 服务端上要包装 / 调用的内部属性（如 '_send_eio_packet'、'eio.sockets'）都存在。
+    这些属性不属于 python-socketio / python-engineio 的公开 API，版本在 requirements.txt 中固定；
+    升级后缺少时抛出 RuntimeError，而不是让背压 / 紧凑编码静默失效
+    """
+    missing = []
+    for name in names:
+        target = server
+        for part in name.split('.'):
+            if not hasattr(target, part):
+                missing.append(name)
+                break
+            target = getattr(target, part)
+    if missing:
+        raise RuntimeError(f"python-socketio 缺少内部属性 {', '.join(missing)}，"
+                           f"请安装 requirements.txt 中固定的 python-socketio / python-engineio 版本")
+
+
+class OutboundGuard:
+    """
+    出站背压：python-socketio 把发给每个连接的包放进 engine.io 的发送队列，队列没有上限，
+    客户端读得慢（网络差、标签页挂起）时会在服务端无限堆积。
+    - 可丢弃的事件（输入状态等）用 emit_droppable 发送：连接队列超过 OUTBOUND_SOFT_LIMIT 时跳过该连接
+    - 任何事件在连接队列达到 OUTBOUND_HARD_LIMIT 时不再入队并断开该连接；消息不会丢失，
+      客户端重连后按投递序号补发（sync）
+    通过包装 Socket.IO 服务端逐连接发包的方法实现（经消息队列转发的跨进程推送同样经过这里）；
+    python-socketio 版本不提供这些方法时启动失败（见 check_socketio_internals）。
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.socketio = None
+        self._closing = set()  # 已安排断开的 eio sid
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        self.socketio = socketio
+        self.soft_limit = app.config.get('OUTBOUND_SOFT_LIMIT', 64)
+        self.hard_limit = app.config.get('OUTBOUND_HARD_LIMIT', 1000)
+        server = socketio.server
+        check_socketio_internals(server, ('_send_packet', '_send_eio_packet', 'eio.sockets'))
+        self.enabled = True
+        # OUTBOUND_HARD_LIMIT 为 0 时同样包装，只统计最大队列长度
+        send_packet, send_eio_packet = server._send_packet, server._send_eio_packet
+        server._send_packet = lambda eio_sid, pkt: self._admit(eio_sid) and send_packet(eio_sid, pkt)
+        server._send_eio_packet = lambda eio_sid, pkt: self._admit(eio_sid) and send_eio_packet(eio_sid, pkt)
+
+    def depth(self, eio_sid):
+        """连接的待发包数（未知连接为 0）"""
+        socket = self.socketio.server.eio.sockets.get(eio_sid)
+        return socket.queue.qsize() if socket is not None else 0
+
+    def _admit(self, eio_sid):
+        depth = self.depth(eio_sid)
+        if depth > self.stats['max_depth']:
+            self.stats['max_depth'] = depth
+        if not self.hard_limit or depth < self.hard_limit:
+            return True
+        self.stats['dropped'] += 1
+        with self._lock:
+            if eio_sid in self._closing:
+                return False
+            self._closing.add(eio_sid)
+        self.stats['slow_disconnects'] += 1
+        logger.warning(f"连接 {eio_sid} 的发送队列已积压 {depth} 个包，断开（重连后补发）")
+        self.socketio.start_background_task(self._disconnect, eio_sid)
+        return False
+
+    def _disconnect(self, eio_sid):
+        try:
+            self.socketio.server.eio.disconnect(eio_sid)
+        except Exception as e:
+            logger.error(f"断开慢连接 {eio_sid} 失败: {e}")
+        finally:
+            with self._lock:
+                self._closing.discard(eio_sid)
+
+    def emit_droppable(self, event, data, room, namespace='/'):
+        """向房间中本进程的连接发送可丢弃的事件：发送队列超过软上限的连接直接跳过"""
+        if not self.enabled:
+            self.socketio.emit(event, data, to=room, namespace=namespace)
+            return
+        server = self.socketio.server
+        pkt = None
+        for sid, eio_sid in list(server.manager.get_participants(namespace, room)):
+            if self.depth(eio_sid) >= self.soft_limit:
+                self.stats[f'{event}_dropped'] += 1
+                continue
+            if pkt is None:
+                encoded = server.packet_class(sio_packet.EVENT, namespace=namespace, data=[event, data]).encode()
+                pkt = eio_packet.Packet(eio_packet.MESSAGE, encoded)
+            server._send_eio_packet(eio_sid, pkt)
+            self.stats[f'{event}_sent'] += 1
+
+    def get_stats(self):
+        return dict(self.stats, enabled=self.enabled)
@@ -0,0 +1,278 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+from sqlalchemy import insert, update
+from models import db, Message, Conversation, ConversationMember, DeliveryCursor, PendingDelivery
+from utils.ids import IdGenerator
+from utils.green import create_event
+from utils.summary import update_summary, increment_group_unread
+from utils.search import index_messages
+
+logger = logging.getLogger(__name__)
+
+# 持久化等待的默认超时（秒）
+DEFAULT_ACK_TIMEOUT = 10
+
+
+class PendingMessage:
+    """排队等待批量提交的消息"""
+    __slots__ = ('message', 'recipient_ids', 'group', 'deliveries', 'unread_counts', 'event', 'ok')
+
+    def __init__(self, message, recipient_ids, event=None, group=False):
+        self.message = message
+        self.recipient_ids = recipient_ids
+        # 群聊消息：不逐个接收方分配投递序号，未读数按会话一条 UPDATE 累加，提交后经群房间一次推送
+        self.group = group
+        # 提交时分配的 [(接收方 user_id, 投递序号)]
+        self.deliveries = []
+        # 提交后会话各参与者的未读数 {user_id: unread_count}（同一会话的消息共用）
+        self.unread_counts = {}
+        self.event = event
+        self.ok = None
+
+    def wait(self, timeout=DEFAULT_ACK_TIMEOUT):
+        """等待所在批次提交完成，返回是否写入成功"""
+        if self.event is not None:
+            self.event.wait(timeout)
+        return bool(self.ok)
+
+    def _done(self, ok):
+        self.ok = ok
+        if self.event is not None:
+            self.event.set()
+
+
+class MessageWriter:
+    """
+    消息写入管道（write-behind）：
+    - submit() 立即分配服务端消息ID并入队，调用方无需等待 SQLite 提交即可推送消息
+    - 后台任务每 MESSAGE_FLUSH_INTERVAL_MS 毫秒或累计 MESSAGE_FLUSH_BATCH_SIZE 条时合并提交一次
+      （消息插入、会话 last_message_at、会话摘要和未读计数在同一事务内）
+    - MESSAGE_DURABLE_ACK 开启时调用方可 wait() 到批次提交后再确认
+    - 关闭 MESSAGE_WRITE_BEHIND 时 submit() 直接同步提交（每条消息一个事务）
+    - 每个接收方在同一事务内分配递增的投递序号并写入待确认队列；提交后调用 on_commit(batch) 推送
+    - 群聊消息（group=True）的写入与成员数无关：不分配投递序号，全体成员的未读数一条 UPDATE 累加
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.app = None
+        self.socketio = None
+        self._queue = []
+        self._pending_conversations = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = None
+        self._task = None
+        self._running = False
+        self.stats = Counter()
+        # 批次提交成功后的回调（实时推送给接收方），参数为 PendingMessage 列表
+        self.on_commit = None
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        self.app = app
+        self.socketio = socketio
+        self.enabled = app.config.get('MESSAGE_WRITE_BEHIND', True)
+        self.interval = app.config.get('MESSAGE_FLUSH_INTERVAL_MS', 20) / 1000.0
+        self.batch_size = app.config.get('MESSAGE_FLUSH_BATCH_SIZE', 200)
+        self.durable_ack = app.config.get('MESSAGE_DURABLE_ACK', False)
+        self.ids = IdGenerator(app.config.get('WORKER_ID', 0))
+        atexit.register(self.stop)
+
+    # --- 写入 ---
+    def submit(self, message, recipient_ids=(), group=False):
+        """
+        分配消息ID并排队写入，返回 PendingMessage。
+        message 为尚未加入 session 的 Message 对象（需已设置 timestamp）；
+        recipient_ids 为接收方，累加未读数并分配投递序号；群聊消息传 group=True，不需要 recipient_ids。
+        """
+        if message.id is None:
+            message.id = self.ids.next_id()
+        pending = PendingMessage(message, [] if group else list(recipient_ids),
+                                 create_event(self.socketio) if self.durable_ack else None, group)
+        if not self.enabled:
+            self._write([pending])
+            return pending
+
+        with self._lock:
+            self._queue.append(pending)
+            self._pending_conversations[message.conversation_id] += 1
+            queued = len(self._queue)
+        self._ensure_started()
+        if queued >= self.batch_size:
+            self._wakeup.set()
+        return pending
+
+    def has_pending(self, conversation_id):
+        """该会话是否还有未提交的消息"""
+        return self._pending_conversations.get(conversation_id, 0) > 0
+
+    def queue_size(self):
+        """等待提交的消息数"""
+        return len(self._queue)
+
+    def flush(self):
+        """
+        立即提交队列中的所有消息。取出队列和提交都在写锁内：
+        后台任务已取走、尚未提交的批次（has_pending 仍为真）先提交完，这里才返回，保证读到自己刚发的消息
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._queue = self._queue, []
+            if not batch:
+                return
+            try:
+                committed = self._commit(batch)
+            finally:
+                with self._lock:
+                    self._pending_conversations.subtract(p.message.conversation_id for p in batch)
+                    self._pending_conversations += Counter()  # 去掉计数为 0 的会话
+        for done in committed:
+            self._notify(done)
+
+    def stop(self):
+        """停止后台任务并提交剩余消息（进程退出时调用）"""
+        self._running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+        self.flush()
+
+    # --- 后台任务 ---
+    def _ensure_started(self):
+        if self._task is not None:
+            return
+        with self._lock:
+            if self._task is not None:
+                return
+            self._wakeup = create_event(self.socketio)
+            self._running = True
+            self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"批量写入消息失败: {e}")
+
+    def _write(self, batch):
+        """提交一批消息（未启用批量写入时逐条调用），提交后推送"""
+        with self._flush_lock:
+            committed = self._commit(batch)
+        for done in committed:
+            self._notify(done)
+
+    def _commit(self, batch):
+        """在写锁内提交一批消息，返回已提交的批次列表（整批失败时逐条重试，隔离出错的消息）"""
+        with self.app.app_context():
+            try:
+                self._apply(batch)
+                db.session.commit()
+                self.stats['batches'] += 1
+                self.stats['messages'] += len(batch)
+                for pending in batch:
+                    pending._done(True)
+                return [batch]
+            except Exception as e:
+                db.session.rollback()
+                if len(batch) == 1:
+                    logger.error(f"写入消息 {batch[0].message.id} 失败: {e}")
+                    self.stats['failed'] += 1
+                    batch[0]._done(False)
+                    return []
+                logger.warning(f"批量写入失败，逐条重试: {e}")
+        committed = []
+        for pending in batch:
+            committed += self._commit([pending])
+        return committed
+
+    def _notify(self, batch):
+        """提交成功后推送（在写锁之外执行）"""
+        if self.on_commit is None:
+            return
+        try:
+            self.on_commit(batch)
+        except Exception as e:
+            logger.error(f"推送已提交的消息失败: {e}")
+
+    def _apply(self, batch):
+        """在当前事务中写入一批消息及其会话更新"""
+        db.session.execute(insert(Message), [
+            {
+                'id': p.message.id,
+                'conversation_id': p.message.conversation_id,
+                'sender_id': p.message.sender_id,
+                'content': p.message.content,
+                'type': p.message.type,
+                'timestamp': p.message.timestamp,
+                'is_read': bool(p.message.is_read),
+            }
+            for p in batch
+        ])
+        index_messages([p.message for p in batch])
+
+        # 每个会话只需更新一次：取批次内最后一条消息，未读数按人累加
+        last_by_conversation = {}
+        unread_by_conversation = {}
+        group_senders = {}
+        for p in batch:
+            conv_id = p.message.conversation_id
+            last = last_by_conversation.get(conv_id)
+            if last is None or (p.message.timestamp, p.message.id) > (last.timestamp, last.id):
+                last_by_conversation[conv_id] = p.message
+            increments = unread_by_conversation.setdefault(conv_id, Counter())
+            for user_id in p.recipient_ids:
+                increments[user_id] += 1
+            if p.group:
+                group_senders.setdefault(conv_id, Counter())[p.message.sender_id] += 1
+
+        db.session.execute(update(Conversation), [
+            {'id': conv_id, 'last_message_at': last.timestamp}
+            for conv_id, last in last_by_conversation.items()
+        ])
+        for conv_id, last in last_by_conversation.items():
+            update_summary(conv_id, last, unread_by_conversation[conv_id])
+        for conv_id, sender_counts in group_senders.items():
+            increment_group_unread(conv_id, sender_counts)
+
+        # 累加后的未读数：整批一次查询，提交后随会话列表增量（conversation_updated）推送；
+        # 群聊不读出（成员可能上千），客户端按增量中的发送者自行累加
+        unread_counts = {}
+        pair_ids = [conv_id for conv_id in last_by_conversation if conv_id not in group_senders]
+        if pair_ids:
+            for conv_id, user_id, count in db.session.query(
+                    ConversationMember.conversation_id, ConversationMember.user_id, ConversationMember.unread_count
+            ).filter(ConversationMember.conversation_id.in_(pair_ids)):
+                unread_counts.setdefault(conv_id, {})[user_id] = count
+        for p in batch:
+            p.unread_counts = unread_counts.get(p.message.conversation_id, {})
+
+        self._assign_deliveries(batch)
+
+    def _assign_deliveries(self, batch):
+        """
+        为每个接收方分配递增的投递序号并写入待确认队列。
+        在已持有写锁的事务内读取并更新序号（此前已插入消息），多进程下序号也不会重复。
+        """
+        recipient_ids = {uid for p in batch for uid in p.recipient_ids}
+        if not recipient_ids:
+            return
+        cursors = {c.user_id: c for c in DeliveryCursor.query
+                   .filter(DeliveryCursor.user_id.in_(recipient_ids)).with_for_update()}
+        rows = []
+        for p in sorted(batch, key=lambda p: p.message.id):
+            p.deliveries = []
+            for user_id in p.recipient_ids:
+                cursor = cursors.get(user_id)
+                if cursor is None:
+                    cursor = cursors[user_id] = DeliveryCursor(user_id=user_id, last_seq=0, acked_seq=0)
+                    db.session.add(cursor)
+                cursor.last_seq += 1
+                p.deliveries.append((user_id, cursor.last_seq))
+                rows.append({'user_id': user_id, 'seq': cursor.last_seq,
+                             'message_id': p.message.id, 'conversation_id': p.message.conversation_id})
+        db.session.execute(insert(PendingDelivery), rows)
@@ -0,0 +1,151 @@
+import threading
+import time
+from utils.redis_helpers import redis_store, RedisUnavailable
+
+# 连接的存活时间（秒）：客户端每 30 秒发送一次 heartbeat，连续错过约 3 次视为离线
+DEFAULT_TTL = 90
+
+
+def user_room(user_id):
+    """用户的 Socket.IO 房间名，该用户的所有连接都会加入"""
+    return f"user:{user_id}"
+
+
+def _user_key(user_id):
+    return f"online:{user_id}"
+
+
+def _sid_key(sid):
+    return f"sid:{sid}"
+
+
+class Presence:
+    """
+    在线状态：一个用户可同时有多个连接（多标签页 / 多设备）。
+    - online:{user_id}  有序集合，成员为 sid，分数为该连接的过期时间；按连接各自过期
+    - sid:{sid}         反向索引 sid -> user_id，断开连接时据此找到用户
+    heartbeat 刷新过期时间；进程崩溃未触发 disconnect 的连接在 TTL 后自动视为离线。
+    Redis 不可用（熔断）时使用进程内存储（不跨进程共享）；恢复后连接在下一次 heartbeat 时重新登记到 Redis。
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._user_sids = {}  # user_id -> {sid: 过期时间}
+        self._sid_user = {}   # sid -> user_id
+
+    # --- 连接生命周期 ---
+    def connect(self, user_id, sid):
+        """登记新连接"""
+        self._touch(user_id, sid)
+
+    def heartbeat(self, sid, user_id=None):
+        """刷新连接的过期时间；user_id 未知时通过反向索引查找。返回 user_id"""
+        if user_id is None:
+            user_id = self.get_user(sid)
+        if user_id is not None:
+            self._touch(user_id, sid)
+        return user_id
+
+    def disconnect(self, sid):
+        """移除连接，返回 (user_id, 该用户剩余在线连接数)；未知 sid 返回 (None, 0)"""
+        # 熔断期间登记的连接只在内存中，两边都要移除
+        with self._lock:
+            local_user = self._sid_user.pop(sid, None)
+            sids = self._user_sids.get(local_user, {})
+            sids.pop(sid, None)
+            if not sids:
+                self._user_sids.pop(local_user, None)
+        try:
+            user_id = redis_store.call('get', _sid_key(sid))
+        except RedisUnavailable:
+            user_id = None
+        if user_id is None:
+            if local_user is None:
+                return None, 0
+            return local_user, len(self.get_sids(local_user))
+
+        user_id = int(user_id)
+        now = time.time()
+
+        def build(pipe):
+            pipe.zrem(_user_key(user_id), sid)
+            pipe.delete(_sid_key(sid))
+            pipe.zcount(_user_key(user_id), now, '+inf')
+        try:
+            return user_id, redis_store.pipeline(build, 'presence.disconnect')[2]
+        except RedisUnavailable:
+            return user_id, 0
+
+    # --- 查询 ---
+    def get_user(self, sid):
+        try:
+            user_id = redis_store.call('get', _sid_key(sid))
+        except RedisUnavailable:
+            return self._sid_user.get(sid)
+        return int(user_id) if user_id is not None else self._sid_user.get(sid)
+
+    def get_sids(self, user_id):
+        """该用户所有未过期的连接"""
+        return self.get_sids_many([user_id])[user_id]
+
+    def is_online(self, user_id):
+        return bool(self.get_sids(user_id))
+
+    def get_sids_many(self, user_ids):
+        """批量查询多个用户的在线连接（Redis 下一次往返），返回 {user_id: [sid, ...]}"""
+        user_ids = list(dict.fromkeys(user_ids))
+        now = time.time()
+
+        def build(pipe):
+            for uid in user_ids:
+                pipe.zrangebyscore(_user_key(uid), now, '+inf')
+        try:
+            return dict(zip(user_ids, redis_store.pipeline(build, 'presence.sids')))
+        except RedisUnavailable:
+            return self._local_sids(user_ids, now)
+
+    def online_users(self, user_ids):
+        """批量判断在线状态（好友列表用），返回在线的 user_id 集合"""
+        user_ids = list(dict.fromkeys(user_ids))
+        now = time.time()
+
+        def build(pipe):
+            for uid in user_ids:
+                pipe.zcount(_user_key(uid), now, '+inf')
+        try:
+            counts = redis_store.pipeline(build, 'presence.online')
+        except RedisUnavailable:
+            return {uid for uid, sids in self._local_sids(user_ids, now).items() if sids}
+        return {uid for uid, count in zip(user_ids, counts) if count}
+
+    # --- 内部 ---
+    def _local_sids(self, user_ids, now):
+        with self._lock:
+            return {uid: [sid for sid, expires in self._user_sids.get(uid, {}).items() if expires > now]
+                    for uid in user_ids}
+
+    def _touch(self, user_id, sid):
+        now = time.time()
+        expires = now + self.ttl
+
+        # 一次往返：登记连接、清理过期连接、续期两个键
+        def build(pipe):
+            pipe.zadd(_user_key(user_id), {sid: expires})
+            pipe.zremrangebyscore(_user_key(user_id), '-inf', now)
+            pipe.expire(_user_key(user_id), self.ttl)
+            pipe.set(_sid_key(sid), user_id, ex=self.ttl)
+        try:
+            redis_store.pipeline(build, 'presence.touch')
+            return
+        except RedisUnavailable:
+            pass
+
+        with self._lock:
+            sids = self._user_sids.setdefault(user_id, {})
+            sids[sid] = expires
+            self._sid_user[sid] = user_id
+            # 顺带清理该用户已过期的连接
+            for stale in [s for s, e in sids.items() if e <= now]:
+                del sids[stale]
+                self._sid_user.pop(stale, None)
@@ -0,0 +1,188 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, Counter, namedtuple
+from functools import wraps
+from flask import jsonify, request
+from utils.redis_helpers import redis_store, RedisUnavailable
+
+logger = logging.getLogger(__name__)
+
+# 令牌桶：每秒补充 rate 个令牌，最多攒 burst 个；每个请求 / 事件消耗一个（批量事件按条数消耗）
+Rule = namedtuple('Rule', ['rate', 'burst', 'shared'])
+# allowed 为 False 时 retry_after 为再次可用前需要等待的秒数
+Decision = namedtuple('Decision', ['allowed', 'retry_after'])
+
+ALLOW = Decision(True, 0.0)
+
+# 本进程最多保留的令牌桶数（按最近使用淘汰，被淘汰的桶视为已满）
+MAX_BUCKETS = 100000
+
+# Redis 中的令牌桶：用服务器时间，多个进程共用同一个桶；空闲到桶满后自动过期
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+def parse_rule(value, shared=False):
+    """'<每秒令牌数>,<桶容量>'，如 '5,20'；'0' 或空表示不限制（返回 None）"""
+    if not value or value.strip() == '0':
+        return None
+    rate, _, burst = value.partition(',')
+    rate = float(rate)
+    burst = int(burst) if burst else max(1, math.ceil(rate))
+    if rate <= 0:
+        return None
+    return Rule(rate, burst, shared)
+
+
+class RateLimiter:
+    """
+    令牌桶限流：
+    - socket:   每个连接的所有 Socket.IO 事件（按 sid，只在本进程）
+    - send_msg: 每个用户发送消息（按用户ID，同一用户的所有设备共用）
+    - typing:   每对 (发送方, 接收方) 的输入状态，桶容量 1 即合并窗口，窗口内多余的事件直接丢弃
+    - login / register: 按客户端 IP；upload: 按用户ID
+    按用户 / IP 的规则在 RATE_LIMIT_REDIS 开启时存放在 Redis 中，多进程共用同一个桶；
+    Redis 不可用（熔断）时退回本进程内的桶。
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.socketio = None
+        self.rules = {}
+        self._buckets = OrderedDict()  # (规则, key) -> [tokens, 上次补充时间]
+        self._notices = {}  # (sid, 规则) -> 下次可再提示的时间，限流提示本身也不刷屏
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        self.socketio = socketio
+        shared = app.config.get('RATE_LIMIT_REDIS', False)
+        self.rules = {
+            'socket': parse_rule(app.config.get('RATE_LIMIT_SOCKET', '20,100')),
+            'send_msg': parse_rule(app.config.get('RATE_LIMIT_SEND_MSG', '5,20'), shared),
+            'typing': parse_rule(app.config.get('RATE_LIMIT_TYPING', '0.5,1')),
+            'login': parse_rule(app.config.get('RATE_LIMIT_LOGIN', '1,10'), shared),
+            'register': parse_rule(app.config.get('RATE_LIMIT_REGISTER', '0.1,5'), shared),
+            'upload': parse_rule(app.config.get('RATE_LIMIT_UPLOAD', '1,10'), shared),
+        }
+
+    # --- 令牌桶 ---
+    def hit(self, name, key, cost=1):
+        """消耗规则 name 下 key 的 cost 个令牌（不足时一个也不消耗），返回 Decision；规则未配置时总是放行"""
+        rule = self.rules.get(name)
+        if rule is None:
+            return ALLOW
+        retry_after = None
+        if rule.shared:
+            try:
+                retry_after = float(redis_store.execute('ratelimit', lambda client: client.eval(
+                    _TOKEN_BUCKET_LUA, 1, f"ratelimit:{name}:{key}", rule.rate, rule.burst, cost)))
+            except RedisUnavailable:
+                self.stats['redis_fallbacks'] += 1
+        if retry_after is None:
+            retry_after = self._hit_local(rule, (name, key), cost)
+        if retry_after > 0:
+            self.stats[f'{name}_throttled'] += 1
+            return Decision(False, retry_after)
+        self.stats[f'{name}_allowed'] += 1
+        return ALLOW
+
+    def _hit_local(self, rule, bucket_key, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                bucket = self._buckets[bucket_key] = [float(rule.burst), now]
+                while len(self._buckets) > MAX_BUCKETS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(bucket_key)
+                bucket[0] = min(rule.burst, bucket[0] + (now - bucket[1]) * rule.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0.0
+            return (cost - bucket[0]) / rule.rate
+
+    def forget(self, sid):
+        """连接断开时清除该连接的桶和提示记录"""
+        with self._lock:
+            self._buckets.pop(('socket', sid), None)
+            for key in [k for k in self._notices if k[0] == sid]:
+                del self._notices[key]
+
+    # --- Flask 路由 ---
+    def limit_request(self, name, key_func):
+        """路由装饰器：超过限制时返回 429 和 Retry-After 头；key_func() 返回 None 时不限制（如未登录）"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = key_func()
+                if key is not None:
+                    decision = self.hit(name, key)
+                    if not decision.allowed:
+                        retry_after = math.ceil(decision.retry_after)
+                        response = jsonify({'message': 'Too many requests', 'retry_after': retry_after})
+                        response.headers['Retry-After'] = str(retry_after)
+                        return response, 429
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # --- Socket.IO 事件 ---
+    def limit_event(self, name=None, key_func=None, cost_func=None):
+        """
+        Socket.IO 事件处理函数的装饰器（写在 @socketio.on 之下）：
+        先按连接检查 socket 规则，再按 key_func(*事件参数) 检查 name 规则（消耗 cost_func(*事件参数) 个令牌，
+        默认一个）；超过限制的事件直接丢弃。
+        send_msg 等用户可见的操作被丢弃时向该连接发送 rate_limited 事件（每个等待窗口最多一次）。
+        """
+        def decorator(handler):
+            @wraps(handler)
+            def wrapper(*args, **kwargs):
+                decision = self.hit('socket', request.sid)
+                rule = 'socket'
+                if decision.allowed and name is not None:
+                    key = key_func(*args, **kwargs) if key_func else request.sid
+                    if key is not None:
+                        decision = self.hit(name, key, cost_func(*args, **kwargs) if cost_func else 1)
+                        rule = name
+                if not decision.allowed:
+                    if rule != 'socket' and rule != 'typing':
+                        self._notify(request.sid, rule, decision.retry_after)
+                    return None
+                return handler(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _notify(self, sid, rule, retry_after):
+        now = time.monotonic()
+        with self._lock:
+            if self._notices.get((sid, rule), 0) > now:
+                return
+            self._notices[(sid, rule)] = now + retry_after
+        self.socketio.emit('rate_limited', {'event': rule, 'retry_after': round(retry_after, 3)}, to=sid)
+
+    def get_stats(self):
+        return dict(self.stats, buckets=len(self._buckets))
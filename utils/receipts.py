@@ -0,0 +1,198 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+from sqlalchemy import func
+from models import db, Message, Conversation, DeliveryCursor, PendingDelivery, ConversationMember, ConversationSummary
+from utils.green import create_event
+from utils.presence import user_room
+from utils.groups import group_room
+from utils.summary import advance_watermark
+
+logger = logging.getLogger(__name__)
+
+
+class ReceiptAggregator:
+    """
+    送达 / 已读回执：
+    - 送达：客户端 ack 已连续收到的最大投递序号；已读：客户端报告每个会话 "已读到某条消息" 的水位
+    - 两者都先在内存中按用户（会话）取最大值合并，后台任务每 RECEIPT_FLUSH_INTERVAL_MS 毫秒批量落库一次，
+      一批只提交一次，不再每次读消息都单独 UPDATE + commit
+    - 送达落库时每个用户一次范围查询，按 (会话, 发送方) 只给发送方推送一条 "送达到某条消息" 的回执；
+      已确认的投递从待确认队列删除，游标 acked_seq 前移
+    - 已读落库时前移参与者的已读水位并按水位重算未读数，再给会话中其他参与者推送已读回执，
+      给已读者自己的各设备推送新的未读数（conversation_updated）；群聊的已读回执发到群房间（一次推送，与成员数无关）
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.app = None
+        self.socketio = None
+        self._delivered = {}  # user_id -> 尚未落库的最大已确认序号
+        self._reads = {}      # (user_id, conversation_id) -> 尚未落库的最大已读消息ID
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = None
+        self._task = None
+        self._running = False
+        self.stats = Counter()
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        self.app = app
+        self.socketio = socketio
+        self.interval = app.config.get('RECEIPT_FLUSH_INTERVAL_MS', 200) / 1000.0
+        atexit.register(self.stop)
+
+    # --- 客户端确认 ---
+    def ack_delivered(self, user_id, seq):
+        """记录用户已连续收到 seq 及之前的所有投递"""
+        with self._lock:
+            if seq <= self._delivered.get(user_id, 0):
+                return
+            self._delivered[user_id] = seq
+        self.stats['acks'] += 1
+        self._ensure_started()
+
+    def mark_read(self, user_id, conversation_id, message_id):
+        """记录用户已读到会话中的 message_id（含）"""
+        key = (user_id, conversation_id)
+        with self._lock:
+            if message_id <= self._reads.get(key, 0):
+                return
+            self._reads[key] = message_id
+        self.stats['reads'] += 1
+        self._ensure_started()
+
+    def acked_seq(self, user_id):
+        """本进程内尚未落库的已确认序号（补发时一并跳过）"""
+        return self._delivered.get(user_id, 0)
+
+    def flush(self):
+        """立即落库所有待处理的确认和已读水位"""
+        with self._lock:
+            delivered, self._delivered = self._delivered, {}
+            reads, self._reads = self._reads, {}
+        if delivered or reads:
+            self._write(delivered, reads)
+
+    def stop(self):
+        """停止后台任务并落库剩余的确认（进程退出时调用）"""
+        self._running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+        self.flush()
+
+    # --- 后台任务 ---
+    def _ensure_started(self):
+        if self._task is not None:
+            return
+        with self._lock:
+            if self._task is not None:
+                return
+            self._wakeup = create_event(self.socketio)
+            self._running = True
+            self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"批量写入回执失败: {e}")
+
+    def _write(self, delivered, reads):
+        receipts, updates = [], []
+        with self._flush_lock, self.app.app_context():
+            try:
+                receipts.extend(self._apply_delivered(delivered))
+                read_receipts, updates = self._apply_reads(reads)
+                receipts.extend(read_receipts)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self.stats['failed'] += 1
+                logger.error(f"写入回执失败: {e}")
+                return
+        self.stats['flushes'] += 1
+        for room, receipt in receipts:
+            self.stats[f"{receipt['status']}_receipts"] += 1
+            self.socketio.emit('receipt', receipt, to=room)
+        # 已读者自己的各设备：会话列表中该会话的未读数
+        for user_id, update in updates:
+            self.socketio.emit('conversation_updated', update, to=user_room(user_id))
+
+    def _apply_delivered(self, delivered):
+        """返回 [(发送方的房间, 回执)]"""
+        receipts = []
+        if not delivered:
+            return receipts
+        cursors = DeliveryCursor.query.filter(DeliveryCursor.user_id.in_(delivered)).all()
+        for cursor in cursors:
+            seq = min(delivered[cursor.user_id], cursor.last_seq)
+            if seq <= cursor.acked_seq:
+                continue
+            in_range = (PendingDelivery.user_id == cursor.user_id,
+                        PendingDelivery.seq > cursor.acked_seq,
+                        PendingDelivery.seq <= seq)
+            rows = db.session.query(PendingDelivery.conversation_id, Message.sender_id,
+                                    func.max(PendingDelivery.message_id))\
+                .join(Message, Message.id == PendingDelivery.message_id)\
+                .filter(*in_range)\
+                .group_by(PendingDelivery.conversation_id, Message.sender_id).all()
+            receipts.extend((user_room(sender_id), {
+                'conversation_id': conv_id,
+                'message_id': message_id,
+                'user_id': cursor.user_id,
+                'status': 'delivered'
+            }) for conv_id, sender_id, message_id in rows)
+            PendingDelivery.query.filter(*in_range).delete(synchronize_session=False)
+            cursor.acked_seq = seq
+        return receipts
+
+    def _apply_reads(self, reads):
+        """返回 ([(接收回执的房间, 回执)], [(已读者 user_id, 会话列表增量)])"""
+        receipts, updates = [], []
+        if not reads:
+            return receipts, updates
+        conv_ids = {conv_id for _, conv_id in reads}
+        # 水位不能超过会话中已提交的最后一条消息
+        last_ids = dict(db.session.query(ConversationSummary.conversation_id, ConversationSummary.last_message_id)
+                        .filter(ConversationSummary.conversation_id.in_(conv_ids)))
+        advanced = {}
+        for (user_id, conv_id), message_id in reads.items():
+            message_id = min(message_id, last_ids.get(conv_id) or 0)
+            if message_id and advance_watermark(conv_id, user_id, message_id):
+                advanced[(user_id, conv_id)] = message_id
+        if not advanced:
+            return receipts, updates
+        advanced_conv_ids = {conv_id for _, conv_id in advanced}
+        group_ids = {i for (i,) in db.session.query(Conversation.id)
+                     .filter(Conversation.id.in_(advanced_conv_ids), Conversation.is_group == True)}  # noqa: E712
+        # 单聊取全部参与者（推送回执），群聊只取已读者自己的成员行（未读数）
+        members = db.session.query(ConversationMember.conversation_id, ConversationMember.user_id,
+                                   ConversationMember.unread_count)\
+            .filter(ConversationMember.conversation_id.in_(advanced_conv_ids - group_ids)).all()
+        if group_ids:
+            members += db.session.query(ConversationMember.conversation_id, ConversationMember.user_id,
+                                        ConversationMember.unread_count)\
+                .filter(ConversationMember.conversation_id.in_(group_ids),
+                        ConversationMember.user_id.in_({user_id for user_id, _ in advanced})).all()
+        for (user_id, conv_id), message_id in advanced.items():
+            receipt = {
+                'conversation_id': conv_id,
+                'message_id': message_id,
+                'user_id': user_id,
+                'status': 'read'
+            }
+            if conv_id in group_ids:
+                receipts.append((group_room(conv_id), receipt))
+            else:
+                receipts.extend((user_room(member_id), receipt) for member_conv_id, member_id, _ in members
+                                if member_conv_id == conv_id and member_id != user_id)
+            updates.extend((user_id, {'conversation_id': conv_id, 'unread_count': unread_count})
+                           for member_conv_id, member_id, unread_count in members
+                           if member_conv_id == conv_id and member_id == user_id)
+        return receipts, updates
@@ -1,61 +1,192 @@
 import redis
 from config import Config
 import logging
+import threading
+import time
+from collections import defaultdict
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 尝试初始化 Redis 客户端
-redis_client = None
-try:
-    redis_client = redis.StrictRedis(host=Config.REDIS_HOST, port=Config.REDIS_PORT, db=0, decode_responses=True)
-    # 测试连接
-    redis_client.ping()
-    logger.info("Redis连接成功")
-except Exception as e:
-    logger.warning(f"Redis连接失败: {e}")
-    logger.info("使用内存存储替代Redis")
-    # 使用内存存储替代Redis
-    redis_client = {}
-
-# TTL (Time To Live) in seconds for socket mapping
-SOCKET_TTL = 3600 
-
-def set_user_socket(user_id, sid):
-    """绑定用户ID到当前Socket ID"""
+
+class RedisUnavailable(Exception):
+    """Redis 不可用（熔断中或本次调用失败），调用方应使用本地兜底"""
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败 threshold 次后熔断 reset_timeout 秒，期间调用直接失败不再等待网络超时；
+    到期后放行一次试探调用，成功即恢复，失败则继续熔断。
+    """
+
+    def __init__(self, threshold=3, reset_timeout=5.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                return True
+            # 熔断中，或试探调用尚未返回
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info("Redis连接已恢复")
+            self.state = 'closed'
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                if self.state == 'closed':
+                    logger.warning(f"Redis连续失败 {self.failures} 次，熔断 {self.reset_timeout} 秒，期间使用内存存储")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class RedisStore:
+    """
+    Redis 访问层：
+    - 显式连接池（max_connections 上限、短超时），首次使用时才建立连接，导入时不阻塞
+    - pipeline() 把多条命令合并为一次往返
+    - 调用失败计入熔断器；熔断期间抛出 RedisUnavailable，由调用方兜底，恢复后自动重新使用 Redis
+    - 按命令记录调用次数、错误数、耗时
+    """
+
+    def __init__(self, host, port, db=0, max_connections=50, socket_timeout=0.5,
+                 breaker_threshold=3, breaker_reset=5.0):
+        self.pool = redis.ConnectionPool(
+            host=host, port=port, db=db, decode_responses=True,
+            max_connections=max_connections,
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=socket_timeout,
+            health_check_interval=30,
+        )
+        self.client = redis.Redis(connection_pool=self.pool)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self._stats = defaultdict(lambda: {'calls': 0, 'errors': 0, 'rejected': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        self._stats_lock = threading.Lock()
+        # 每次调用后回调 (命令名, 耗时秒数, 是否失败)，用于导出指标
+        self.on_record = None
+
+    def execute(self, name, fn):
+        """在熔断器保护下执行 fn(client)，name 用于统计"""
+        if not self.breaker.allow():
+            with self._stats_lock:
+                self._stats[name]['rejected'] += 1
+            raise RedisUnavailable(name)
+        start = time.perf_counter()
+        try:
+            result = fn(self.client)
+        except redis.RedisError as e:
+            self.breaker.failure()
+            self._record(name, start, error=True)
+            raise RedisUnavailable(f"{name}: {e}") from e
+        self.breaker.success()
+        self._record(name, start)
+        return result
+
+    def call(self, command, *args, **kwargs):
+        """执行单条命令，如 call('get', key)"""
+        return self.execute(command, lambda client: getattr(client, command)(*args, **kwargs))
+
+    def pipeline(self, build, name='pipeline'):
+        """build(pipe) 向管道添加命令，一次往返执行（非事务），返回各命令结果列表"""
+        def run(client):
+            pipe = client.pipeline(transaction=False)
+            build(pipe)
+            return pipe.execute()
+        return self.execute(name, run)
+
+    def mget(self, keys):
+        """批量读取，返回与 keys 一一对应的值列表"""
+        keys = list(keys)
+        if not keys:
+            return []
+        return self.call('mget', keys)
+
+    def _record(self, name, start, error=False):
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            entry = self._stats[name]
+            entry['calls'] += 1
+            entry['errors'] += error
+            entry['total_ms'] += elapsed
+            entry['max_ms'] = max(entry['max_ms'], elapsed)
+        if self.on_record is not None:
+            self.on_record(name, elapsed / 1000, error)
+
+    def get_stats(self):
+        """熔断状态、连接池占用和各命令的耗时统计"""
+        with self._stats_lock:
+            commands = {
+                name: {
+                    'calls': s['calls'],
+                    'errors': s['errors'],
+                    'rejected': s['rejected'],
+                    'avg_ms': round(s['total_ms'] / s['calls'], 3) if s['calls'] else 0.0,
+                    'max_ms': round(s['max_ms'], 3),
+                }
+                for name, s in self._stats.items()
+            }
+        return {
+            'state': self.breaker.state,
+            'connections': self.pool._created_connections,
+            'in_use': len(self.pool._in_use_connections),
+            'commands': commands,
+        }
+
+
+redis_store = RedisStore(
+    Config.REDIS_HOST, Config.REDIS_PORT,
+    max_connections=Config.REDIS_MAX_CONNECTIONS,
+    socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+    breaker_threshold=Config.REDIS_BREAKER_THRESHOLD,
+    breaker_reset=Config.REDIS_BREAKER_RESET,
+)
+
+
+def is_redis_available():
+    """当前能否连上 Redis（否则在线状态等只保存在本进程内，多进程之间不共享）"""
     try:
-        if hasattr(redis_client, 'set'):
-            redis_client.set(f"user:{user_id}", sid, ex=SOCKET_TTL)
-        else:
-            # 使用内存存储
-            redis_client[f"user:{user_id}"] = sid
-    except Exception as e:
-        logger.error(f"设置用户Socket失败: {e}")
-
-def get_user_socket(user_id):
-    """通过用户ID获取Socket ID"""
+        return bool(redis_store.call('ping'))
+    except RedisUnavailable:
+        return False
+
+
+# 在线状态（用户 -> 多个连接、sid 反向索引）见 utils/presence.py
+
+# --- 通用缓存（Redis 不可用时读取返回 None、写入忽略，由调用方的进程内缓存兜底） ---
+def cache_get(key):
+    """读取缓存值，Redis 不可用时返回 None"""
     try:
-        if hasattr(redis_client, 'get'):
-            return redis_client.get(f"user:{user_id}")
-        else:
-            # 使用内存存储
-            return redis_client.get(f"user:{user_id}")
-    except Exception as e:
-        logger.error(f"获取用户Socket失败: {e}")
+        return redis_store.call('get', key)
+    except RedisUnavailable:
         return None
 
-def remove_user_socket(user_id):
-    """移除用户的绑定状态"""
+def cache_set(key, value, ttl):
+    """写入缓存值"""
+    try:
+        redis_store.call('set', key, value, ex=ttl)
+    except RedisUnavailable as e:
+        logger.debug(f"写入缓存失败: {e}")
+
+def cache_delete(*keys):
+    """删除缓存键"""
+    if not keys:
+        return
     try:
-        if hasattr(redis_client, 'delete'):
-            redis_client.delete(f"user:{user_id}")
-        else:
-            # 使用内存存储
-            if f"user:{user_id}" in redis_client:
-                del redis_client[f"user:{user_id}"]
-    except Exception as e:
-        logger.error(f"移除用户Socket失败: {e}")
-    
-# ⚠️ 注意：实际应用中，还需要一个 sid -> user_id 的反向映射以便在 disconnect 时查询。
-# 为简化，我们在 connect 时将 user_id 存储在 Flask Session 中，或使用反向映射。
\ No newline at end of file
+        redis_store.call('delete', *keys)
+    except RedisUnavailable as e:
+        logger.error(f"删除缓存失败: {e}")
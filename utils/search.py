@@ -0,0 +1,326 @@
+import html
+import logging
+import re
+from sqlalchemy import DDL, bindparam, event, select, text
+from models import db, Message, ConversationMember
+
+logger = logging.getLogger(__name__)
+
+# 每页默认 / 最大条数
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+# 摘要长度（字符）：命中位置前后各取一段
+SNIPPET_CHARS = 24
+# 相关度排序的候选数：只对最近的这么多条命中计算 bm25（常见词在全库可能命中几十万条）
+RANK_CANDIDATES = 1000
+# 索引是全局的，命中要逐条按会话过滤：常见词在全库命中很多、而用户会话内消息很少时，
+# 直接扫描用户自己的消息反而更快。全库命中数超过会话内消息数的 INDEX_COST_RATIO 倍时改为扫描，
+# 会话内消息超过 SCAN_LIMIT 条时总是走索引
+INDEX_COST_RATIO = 2
+SCAN_LIMIT = 50000
+# trigram 分词按 3 个字符一组建索引，更短的关键词无法走 trigram 索引；
+# 两个字的中日韩关键词（如 "你好"）走二元组索引，其余更短的关键词（单字、两个字母）只能在命中行上逐条比对
+MIN_INDEXED_TERM = 3
+
+# 摘要中标记命中的占位符，转义 HTML 后再替换为 <mark>
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+# 中日韩文字（假名、汉字、扩展 A、兼容汉字、谚文音节），连续两个以上时生成重叠的二元组
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_CJK_RUN = re.compile(f'[{_CJK}]{{2,}}')
+_CJK_PAIR = re.compile(f'[{_CJK}]{{2}}')
+
+# 全文索引（SQLite FTS5）：rowid 即消息ID，只索引文本消息，所属会话通过 message 表过滤；
+# trigram 分词对中文按字切分，不依赖分词词典，任意 3 个字以上的片段都能命中。
+# 大部分中文词只有两个字：另建二元组索引表，内容为消息中每段中日韩文字的重叠二元组（"今天天气" -> "今天 天天 天气"），
+# 以空格分隔、按 unicode61 分词，每个二元组是一个词，两个字的关键词按词精确命中
+FTS_TABLE = 'message_fts'
+BIGRAM_TABLE = 'message_fts_bigram'
+_CREATE_FTS = DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+    f"USING fts5(content, tokenize='trigram')"
+).execute_if(dialect='sqlite')
+_DROP_FTS = DDL(f"DROP TABLE IF EXISTS {FTS_TABLE}").execute_if(dialect='sqlite')
+_CREATE_BIGRAM = DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {BIGRAM_TABLE} "
+    f"USING fts5(content, tokenize='unicode61')"
+).execute_if(dialect='sqlite')
+_DROP_BIGRAM = DDL(f"DROP TABLE IF EXISTS {BIGRAM_TABLE}").execute_if(dialect='sqlite')
+
+# 与 message 表一同创建 / 删除（db.create_all / db.drop_all）
+event.listen(Message.__table__, 'after_create', _CREATE_FTS)
+event.listen(Message.__table__, 'after_create', _CREATE_BIGRAM)
+event.listen(Message.__table__, 'before_drop', _DROP_FTS)
+event.listen(Message.__table__, 'before_drop', _DROP_BIGRAM)
+
+
+class SearchResult:
+    """一页搜索结果"""
+    __slots__ = ('hits', 'has_more', 'truncated')
+
+    def __init__(self, hits, has_more, truncated=False):
+        self.hits = hits        # [(Message, 摘要 HTML)]
+        self.has_more = has_more
+        self.truncated = truncated  # 扫描只覆盖了会话内最近的 SCAN_LIMIT 条消息
+
+
+def fts_available():
+    """当前数据库是否支持 FTS5 全文索引（其他数据库回退为 LIKE 扫描）"""
+    return db.engine.dialect.name == 'sqlite'
+
+
+def create_index(connection, bigrams=True):
+    """创建全文索引表（迁移用，已存在时跳过）；bigrams=False 时只建 trigram 索引表"""
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text(_CREATE_FTS.statement))
+        if bigrams:
+            connection.execute(text(_CREATE_BIGRAM.statement))
+
+
+def cjk_bigrams(content):
+    """二元组索引表的内容：每段连续中日韩文字的重叠二元组，以空格分隔；没有时为空字符串"""
+    return ' '.join(run[i:i + 2] for run in _CJK_RUN.findall(content or '') for i in range(len(run) - 1))
+
+
+# --- 增量维护（都在调用方的事务中执行，不提交） ---
+def index_messages(messages):
+    """新消息写入时加入索引（与消息插入在同一事务内）"""
+    if not fts_available():
+        return
+    rows = [{'id': m.id, 'content': m.content} for m in messages if m.type == 'text' and m.content]
+    if not rows:
+        return
+    db.session.execute(text(f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (:id, :content)"), rows)
+    _index_bigrams(rows)
+
+
+def _index_bigrams(rows):
+    rows = [{'id': row['id'], 'content': cjk_bigrams(row['content'])} for row in rows]
+    rows = [row for row in rows if row['content']]
+    if rows:
+        db.session.execute(text(f"INSERT INTO {BIGRAM_TABLE}(rowid, content) VALUES (:id, :content)"), rows)
+
+
+def unindex_messages(message_ids):
+    """删除消息前移除其索引行（须在删除 Message 之前或同一事务内调用）"""
+    message_ids = list(message_ids)
+    if not fts_available() or not message_ids:
+        return
+    for table in (FTS_TABLE, BIGRAM_TABLE):
+        db.session.execute(text(
+            f"DELETE FROM {table} WHERE rowid IN :ids"
+        ).bindparams(bindparam('ids', expanding=True)), {'ids': message_ids})
+
+
+def compact_index(pages=200):
+    """
+    增量合并全文索引的段（大量删除 / 归档后调用）：FTS5 的删除只写入删除标记，合并时才真正释放空间。
+    每个索引表每次最多写 pages 页，一个短事务；返回 False 表示已没有可合并的内容。
+    """
+    if not fts_available():
+        return False
+    before = db.session.execute(text("SELECT total_changes()")).scalar()
+    # 负数：不论各层段数多少都合并（相当于分段执行 optimize）
+    for table in (FTS_TABLE, BIGRAM_TABLE):
+        db.session.execute(text(f"INSERT INTO {table}({table}, rank) VALUES ('merge', :pages)"),
+                           {'pages': -pages})
+    # 每个表的 merge 命令本身计 1 次修改
+    return db.session.execute(text("SELECT total_changes()")).scalar() - before >= 3
+
+
+def rebuild_index(batch_size=10000, trigrams=True):
+    """
+    从 Message 表重建全文索引（迁移或索引损坏后使用），按消息ID分批提交。返回索引的消息数。
+    trigrams=False 时只重建二元组索引表（二元组在 Python 中生成，比 trigram 的 INSERT ... SELECT 慢）
+    """
+    if not fts_available():
+        return 0
+    for table in (FTS_TABLE, BIGRAM_TABLE) if trigrams else (BIGRAM_TABLE,):
+        db.session.execute(text(f"DELETE FROM {table}"))
+    db.session.commit()
+    indexed = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(text(
+            "SELECT id, content FROM message WHERE id > :last_id AND type = 'text' ORDER BY id LIMIT :limit"
+        ), {'last_id': last_id, 'limit': batch_size}).mappings().all()
+        if not rows:
+            break
+        batch_last = rows[-1]['id']
+        if trigrams:
+            db.session.execute(text(
+                f"INSERT INTO {FTS_TABLE}(rowid, content) "
+                "SELECT id, content FROM message "
+                "WHERE id > :last_id AND id <= :batch_last AND type = 'text'"
+            ), {'last_id': last_id, 'batch_last': batch_last})
+        _index_bigrams(rows)
+        db.session.commit()
+        indexed += len(rows)
+        last_id = batch_last
+    return indexed
+
+
+# --- 查询 ---
+def parse_terms(query):
+    """按空白拆分关键词（各关键词之间为 AND）"""
+    return [t for t in re.split(r'\s+', query or '') if t]
+
+
+def _index_for(term):
+    """关键词能走的索引表：不少于 3 个字符走 trigram，两个中日韩文字走二元组；更短的返回 None"""
+    if len(term) >= MIN_INDEXED_TERM:
+        return FTS_TABLE
+    if _CJK_PAIR.fullmatch(term):
+        return BIGRAM_TABLE
+    return None
+
+
+def _plan(terms):
+    """按索引表分组关键词：{索引表: [关键词]}，以及不能走索引的关键词"""
+    indexed, unindexed = {}, []
+    for term in terms:
+        table = _index_for(term)
+        if table is None:
+            unindexed.append(term)
+        else:
+            indexed.setdefault(table, []).append(term)
+    return indexed, unindexed
+
+
+def search_messages(user_id, query, conversation_id=None, limit=DEFAULT_PAGE_SIZE, offset=0):
+    """
+    在用户参与的会话中搜索文本消息，返回 SearchResult。
+    - 至少一个关键词能走索引（不少于 3 个字符，或两个中日韩文字）、且走索引比扫描会话更省时（见 _use_index）时
+      走 FTS5 索引，在最近的 RANK_CANDIDATES 条命中内按 bm25 相关度排序；不能走索引的关键词在命中行上逐条比对
+    - 否则（或非 SQLite 数据库）在用户的会话内做 LIKE 扫描，按时间倒序，只扫描会话内最近的 SCAN_LIMIT 条消息
+      （超出时 truncated 为 True）
+    conversation_id 指定时只搜该会话（仍须是该用户参与的会话）。已归档的消息不在 Message 表和索引中，搜不到。
+    """
+    terms = parse_terms(query)
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    offset = max(0, int(offset))
+    if not terms:
+        return SearchResult([], False)
+
+    scope = db.session.query(ConversationMember.conversation_id)\
+        .filter(ConversationMember.user_id == user_id)
+    if conversation_id is not None:
+        scope = scope.filter(ConversationMember.conversation_id == conversation_id)
+    conversation_ids = [row[0] for row in scope]
+    if not conversation_ids:
+        return SearchResult([], False)
+
+    # 只数到上限为止（走 conversation_id 索引）
+    scoped = db.session.execute(text(
+        "SELECT COUNT(*) FROM (SELECT 1 FROM message WHERE conversation_id IN :conversation_ids LIMIT :limit)"
+    ).bindparams(bindparam('conversation_ids', expanding=True)),
+        {'conversation_ids': conversation_ids, 'limit': SCAN_LIMIT + 1}).scalar()
+    truncated = False
+    if _use_index(scoped, terms):
+        rows = _search_fts(conversation_ids, terms, limit, offset)
+    else:
+        rows = _search_like(conversation_ids, terms, limit, offset)
+        truncated = scoped > SCAN_LIMIT
+    has_more = len(rows) > limit
+    return SearchResult(rows[:limit], has_more, truncated)
+
+
+def _use_index(scoped, terms):
+    """scoped 为会话内的消息数（数到 SCAN_LIMIT + 1 为止）"""
+    indexed, _ = _plan(terms)
+    if not fts_available() or not indexed:
+        return False
+    if scoped > SCAN_LIMIT:
+        return True
+    # 用驱动查询的索引表估计命中数，也只数到上限为止
+    table = _driving_table(indexed)
+    budget = scoped * INDEX_COST_RATIO
+    matches = db.session.execute(text(
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE {table} MATCH :match LIMIT :limit)"
+    ), {'match': _match_expression(indexed[table]), 'limit': budget + 1}).scalar()
+    return matches <= budget
+
+
+def _driving_table(indexed):
+    # 有 trigram 关键词时由 trigram 索引驱动（关键词更长，命中更少），二元组索引按 rowid 逐条核对
+    return FTS_TABLE if FTS_TABLE in indexed else BIGRAM_TABLE
+
+
+def _match_expression(terms):
+    # 每个关键词作为短语，避免 FTS5 查询语法（引号、AND/OR/NEAR、*）被用户输入触发
+    return ' '.join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def _like_pattern(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _search_fts(conversation_ids, terms, limit, offset):
+    indexed, unindexed = _plan(terms)
+    table = _driving_table(indexed)
+    params = {'match': _match_expression(indexed[table]), 'conversation_ids': conversation_ids,
+              'candidates': RANK_CANDIDATES, 'limit': limit + 1, 'offset': offset}
+    joins, filters = [], []
+    if table == FTS_TABLE and BIGRAM_TABLE in indexed:
+        joins.append(f"JOIN {BIGRAM_TABLE} b ON b.rowid = f.rowid")
+        filters.append(f"b.{BIGRAM_TABLE} MATCH :bigram_match")
+        params['bigram_match'] = _match_expression(indexed[BIGRAM_TABLE])
+    for i, term in enumerate(unindexed):
+        filters.append(f"lower(m.content) LIKE lower(:like_{i}) ESCAPE '\\'")
+        params[f'like_{i}'] = _like_pattern(term)
+    # 先按 rowid（即时间）倒序取会话内最近的候选，FTS5 顺序遍历命中并在够数后停止；再在候选内按 bm25 排序分页。
+    # 会话按 message 主键过滤，比读取 FTS 表自身的 conversation_id 列快
+    ranked = db.session.execute(text(
+        "SELECT id FROM ("
+        f"SELECT f.rowid AS id, f.rank FROM {table} f JOIN message m ON m.id = f.rowid {' '.join(joins)} "
+        f"WHERE f.{table} MATCH :match AND m.conversation_id IN :conversation_ids "
+        + ''.join(f"AND {condition} " for condition in filters) +
+        "ORDER BY f.rowid DESC LIMIT :candidates"
+        ") ORDER BY rank, id DESC LIMIT :limit OFFSET :offset"
+    ).bindparams(bindparam('conversation_ids', expanding=True)), params).scalars().all()
+    if not ranked:
+        return []
+    messages = {m.id: m for m in Message.query.filter(Message.id.in_(ranked))}
+    if set(indexed) != {FTS_TABLE} or unindexed:
+        # 二元组索引的内容不是原文，短关键词也不在 trigram 索引中：按原文截取摘要并标记所有关键词
+        return [(messages[message_id], _render_snippet(_make_snippet(messages[message_id].content, terms)))
+                for message_id in ranked if message_id in messages]
+    snippets = dict(db.session.execute(text(
+        f"SELECT rowid, snippet({FTS_TABLE}, 0, :start, :end, '…', :tokens) FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH :match AND rowid IN :ids"
+    ).bindparams(bindparam('ids', expanding=True)), {
+        'match': params['match'], 'start': _MARK_START, 'end': _MARK_END, 'tokens': SNIPPET_CHARS, 'ids': ranked
+    }).fetchall())
+    return [(messages[message_id], _render_snippet(snippets.get(message_id)))
+            for message_id in ranked if message_id in messages]
+
+
+def _search_like(conversation_ids, terms, limit, offset):
+    # 只扫描会话内最近的 SCAN_LIMIT 条消息：内层按 (conversation_id, timestamp, id) 索引取最近的消息ID
+    # （只读索引，不读消息内容），外层只对这些消息做 LIKE 比对
+    recent = db.session.query(Message.id)\
+        .filter(Message.conversation_id.in_(conversation_ids), Message.type == 'text')\
+        .order_by(Message.timestamp.desc(), Message.id.desc()).limit(SCAN_LIMIT).subquery()
+    query = Message.query.filter(Message.id.in_(select(recent.c.id)))
+    for term in terms:
+        query = query.filter(Message.content.ilike(_like_pattern(term), escape='\\'))
+    messages = query.order_by(Message.timestamp.desc(), Message.id.desc())\
+        .offset(offset).limit(limit + 1).all()
+    return [(m, _render_snippet(_make_snippet(m.content, terms))) for m in messages]
+
+
+def _make_snippet(content, terms):
+    """以第一个命中的关键词为中心截取摘要，并标记所有关键词"""
+    lower = content.lower()
+    first = min((i for i in (lower.find(t.lower()) for t in terms) if i >= 0), default=0)
+    start = max(0, first - SNIPPET_CHARS // 2)
+    end = min(len(content), start + SNIPPET_CHARS * 2)
+    piece = content[start:end]
+    pattern = re.compile('|'.join(re.escape(t) for t in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    piece = pattern.sub(lambda m: _MARK_START + m.group(0) + _MARK_END, piece)
+    return ('…' if start > 0 else '') + piece + ('…' if end < len(content) else '')
+
+
+def _render_snippet(snippet):
+    """转义 HTML 后把命中标记换成 <mark>（消息内容由用户输入，不能原样插入页面）"""
+    return html.escape(snippet or '').replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
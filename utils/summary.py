@@ -0,0 +1,186 @@
+from sqlalchemy import func, case
+from models import db, Conversation, ConversationSummary, ConversationMember, Message
+from utils.archive import latest_archived
+
+# 会话列表预览的最大长度
+PREVIEW_LENGTH = 100
+
+
+def make_preview(content, message_type='text'):
+    """生成会话列表中显示的消息预览"""
+    if message_type == 'image':
+        return '[图片]'
+    if not content:
+        return None
+    return content[:PREVIEW_LENGTH]
+
+
+def ensure_members(conv):
+    """为会话的两个参与者补齐成员行（新建会话时调用，不提交）"""
+    existing = {m.user_id for m in conv.members}
+    for user_id in (conv.user_one_id, conv.user_two_id):
+        if user_id not in existing:
+            conv.members.append(ConversationMember(user_id=user_id, unread_count=0))
+
+
+def update_summary(conversation_id, last_message, unread_increments):
+    """
+    在写入消息的同一事务内更新会话摘要，并按 unread_increments（{user_id: 增量}）累加参与者未读数。
+    last_message 为该批次中会话的最后一条消息。调用方负责 commit。
+    """
+    values = {
+        'last_message_id': last_message.id,
+        'last_message_preview': make_preview(last_message.content, last_message.type),
+        'last_message_type': last_message.type,
+        'last_sender_id': last_message.sender_id,
+        'last_message_at': last_message.timestamp,
+    }
+    updated = ConversationSummary.query.filter_by(conversation_id=conversation_id)\
+        .update(values, synchronize_session=False)
+    if not updated:
+        db.session.add(ConversationSummary(conversation_id=conversation_id, **values))
+
+    missing = []
+    for user_id, increment in unread_increments.items():
+        updated = ConversationMember.query.filter_by(conversation_id=conversation_id, user_id=user_id)\
+            .update({'unread_count': ConversationMember.unread_count + increment}, synchronize_session=False)
+        if not updated:
+            missing.append((user_id, increment))
+    # 旧会话缺少成员行：补齐后再计数
+    for user_id, increment in missing:
+        db.session.add(ConversationMember(conversation_id=conversation_id, user_id=user_id, unread_count=increment))
+
+
+def increment_group_unread(conversation_id, sender_counts):
+    """
+    群聊未读数：一条 UPDATE 给全体成员加上本批消息数，减去各成员自己发送的条数（sender_counts: {user_id: 条数}），
+    语句数与成员数无关。调用方负责 commit。
+    """
+    total = sum(sender_counts.values())
+    own = case({user_id: count for user_id, count in sender_counts.items()},
+               value=ConversationMember.user_id, else_=0)
+    ConversationMember.query.filter_by(conversation_id=conversation_id)\
+        .update({'unread_count': ConversationMember.unread_count + total - own}, synchronize_session=False)
+
+
+def count_unread(conversation_id, user_id, watermark):
+    """会话中其他人发送的、id 大于已读水位的消息数（走 conversation_id 索引按 id 范围扫描）"""
+    return db.session.query(func.count(Message.id))\
+        .filter(Message.conversation_id == conversation_id,
+                Message.sender_id != user_id,
+                Message.id > watermark).scalar()
+
+
+def advance_watermark(conversation_id, user_id, message_id):
+    """
+    把参与者的已读水位前移到 message_id，并按水位重算未读数（不提交）。
+    水位只增不减；不是该会话参与者或水位未前移时返回 False。
+    """
+    member = ConversationMember.query.filter_by(conversation_id=conversation_id, user_id=user_id).first()
+    if member is None or message_id <= member.last_read_message_id:
+        return False
+    member.last_read_message_id = message_id
+    member.unread_count = count_unread(conversation_id, user_id, message_id)
+    return True
+
+
+def reset_conversation(conversation_id):
+    """清空聊天记录时立即清除摘要和所有参与者的未读数（不提交），会话列表马上反映，消息由后台任务删除"""
+    ConversationSummary.query.filter_by(conversation_id=conversation_id).delete(synchronize_session=False)
+    ConversationMember.query.filter_by(conversation_id=conversation_id)\
+        .update({'unread_count': 0}, synchronize_session=False)
+
+
+def refresh_conversation(conversation_id):
+    """
+    删除会话中的部分消息（清空聊天记录、删除过期归档）后，按剩余消息重建该会话的摘要和各参与者的未读数（不提交）。
+    清空期间新发送的消息不在删除范围内，仍会保留在摘要中；热表中没有消息时取归档中的最后一条。
+    """
+    last = Message.query.filter_by(conversation_id=conversation_id)\
+        .order_by(Message.timestamp.desc(), Message.id.desc()).first()
+    if last is None:
+        last = latest_archived(conversation_id)
+    ConversationSummary.query.filter_by(conversation_id=conversation_id).delete(synchronize_session=False)
+    if last is not None:
+        update_summary(conversation_id, last, {})
+    for member in ConversationMember.query.filter_by(conversation_id=conversation_id):
+        member.unread_count = count_unread(conversation_id, member.user_id, member.last_read_message_id) \
+            if last is not None else 0
+
+
+def rebuild_summaries(batch_size=500):
+    """
+    从 Message 表（及消息归档）重建所有会话的摘要和未读计数（崩溃或迁移后对账用）。
+    按会话ID分批处理，每批一个短事务。返回处理的会话数。
+    群聊的成员行表示成员关系，只按水位重算未读数，不删除重建。
+    """
+    processed = 0
+    last_id = 0
+    while True:
+        convs = Conversation.query.filter(Conversation.id > last_id)\
+            .order_by(Conversation.id.asc()).limit(batch_size).all()
+        if not convs:
+            break
+        conv_ids = [c.id for c in convs]
+        last_id = conv_ids[-1]
+
+        # 每个会话的最后一条消息
+        ranked = db.session.query(
+            Message.id, Message.conversation_id, Message.sender_id,
+            Message.content, Message.type, Message.timestamp,
+            func.row_number().over(
+                partition_by=Message.conversation_id,
+                order_by=(Message.timestamp.desc(), Message.id.desc())
+            ).label('rn')
+        ).filter(Message.conversation_id.in_(conv_ids)).subquery()
+        last_messages = {row.conversation_id: row for row in
+                         db.session.query(ranked).filter(ranked.c.rn == 1)}
+        # 消息已全部归档的会话：取归档中的最后一条
+        for conv_id in conv_ids:
+            if conv_id not in last_messages:
+                archived = latest_archived(conv_id)
+                if archived is not None:
+                    last_messages[conv_id] = archived
+
+        # 保留各参与者的已读水位，未读数按水位重算
+        watermarks = {(conv_id, user_id): watermark for conv_id, user_id, watermark in db.session.query(
+            ConversationMember.conversation_id, ConversationMember.user_id, ConversationMember.last_read_message_id
+        ).filter(ConversationMember.conversation_id.in_(conv_ids))}
+        # 缺少成员行的旧会话：按旧的 is_read 标记推算水位（对方发来的已读消息中最大的ID）
+        read_by_sender = {(conv_id, sender_id): max_id for conv_id, sender_id, max_id in db.session.query(
+            Message.conversation_id, Message.sender_id, func.max(Message.id)
+        ).filter(Message.conversation_id.in_(conv_ids), Message.is_read == True)  # noqa: E712
+            .group_by(Message.conversation_id, Message.sender_id)}
+
+        ConversationSummary.query.filter(ConversationSummary.conversation_id.in_(conv_ids))\
+            .delete(synchronize_session=False)
+        ConversationMember.query.filter(ConversationMember.conversation_id.in_(
+            [c.id for c in convs if not c.is_group])).delete(synchronize_session=False)
+        for conv in convs:
+            last = last_messages.get(conv.id)
+            if last is not None:
+                db.session.add(ConversationSummary(
+                    conversation_id=conv.id,
+                    last_message_id=last.id,
+                    last_message_preview=make_preview(last.content, last.type),
+                    last_message_type=last.type,
+                    last_sender_id=last.sender_id,
+                    last_message_at=last.timestamp,
+                ))
+            if conv.is_group:
+                for member in ConversationMember.query.filter_by(conversation_id=conv.id):
+                    member.unread_count = count_unread(conv.id, member.user_id, member.last_read_message_id) \
+                        if last is not None else 0
+                continue
+            for user_id, other_id in ((conv.user_one_id, conv.user_two_id), (conv.user_two_id, conv.user_one_id)):
+                watermark = watermarks.get((conv.id, user_id))
+                if watermark is None:
+                    watermark = read_by_sender.get((conv.id, other_id), 0)
+                db.session.add(ConversationMember(
+                    conversation_id=conv.id, user_id=user_id, last_read_message_id=watermark,
+                    unread_count=count_unread(conv.id, user_id, watermark) if last is not None else 0
+                ))
+        db.session.commit()
+        db.session.expunge_all()
+        processed += len(convs)
+    return processed